@@ -1,10 +1,10 @@
 ﻿# RG_Tag_Mapper.py — fixed context menus, anchor priority, Z in meters on add, multi_id only with extras
-import sys, math, json, base64, os, copy, posixpath, zlib, stat
-import paramiko
+import sys, math, json, os, copy, posixpath, zlib, stat, threading, queue, time, shutil, itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QGraphicsView, QGraphicsScene, QGraphicsItem,
     QGraphicsRectItem, QGraphicsEllipseItem, QGraphicsLineItem, QMenu, QTreeWidget,
-    QTreeWidgetItem, QDockWidget, QFileDialog, QToolBar, QMessageBox, QDialog,
+    QTreeWidgetItem, QTreeView, QDockWidget, QFileDialog, QToolBar, QMessageBox, QDialog,
     QFormLayout, QDialogButtonBox, QSpinBox, QDoubleSpinBox, QLineEdit, QComboBox,
     QLabel, QInputDialog, QCheckBox, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QGroupBox, QStyle, QTextBrowser, QHeaderView, QAbstractItemView, QProgressDialog,
@@ -12,68 +12,84 @@ from PySide6.QtWidgets import (
 )
 from PySide6.QtGui import (
     QAction, QPainter, QPen, QBrush, QColor, QPixmap, QPainterPath, QFont,
-    QPdfWriter, QPageSize, QCursor, QKeySequence, QIcon, QPalette
+    QPdfWriter, QPageSize, QCursor, QKeySequence, QIcon, QPalette, QImage, QFontMetricsF,
+    QPixmapCache
+)
+from PySide6.QtCore import (
+    Qt, QRectF, QPointF, QSizeF, QLineF, QBuffer, QByteArray, QTimer, QPoint, QSize, QSettings,
+    QThread, QEventLoop, Signal, QObject, QFileSystemWatcher, QStandardPaths,
+    QAbstractItemModel, QModelIndex, QItemSelectionModel
 )
-from PySide6.QtCore import Qt, QRectF, QPointF, QSizeF, QBuffer, QByteArray, QTimer, QPoint, QSize, QSettings
 from datetime import datetime
-from mutagen.mp3 import MP3
-
-
-def find_default_ssh_key(base_dir: str) -> str | None:
-    try:
-        entries = os.listdir(base_dir)
-    except OSError:
-        return None
-
-    preferred_names = {
-        "id_rsa",
-        "id_dsa",
-        "id_ecdsa",
-        "id_ed25519",
-        "id_ecdsa_sk",
-        "id_ed25519_sk",
-    }
-    for name in preferred_names:
-        path = os.path.join(base_dir, name)
-        if os.path.isfile(path):
-            return path
-
-    allowed_suffixes = (".pem", ".key", ".rsa", ".ppk")
-    for entry in sorted(entries):
-        if entry.lower().endswith(allowed_suffixes):
-            path = os.path.join(base_dir, entry)
-            if os.path.isfile(path):
-                return path
+from rg_mapper_core import (
+    fix_negative_zero, extract_track_id, parse_additional_ids, normalize_int_list,
+    load_audio_file_info, audio_file_ref,
+    AudioMetadataCache, PROJECT_FORMAT_VERSION, PROJECT_IMAGE_MEMBER, image_bytes_extension,
+    read_project_file, write_project_file, validate_project_data, sanitize_name_for_folder,
+    project_layout, ensure_project_layout, rooms_json_path, tracks_json_path,
+    audio_metadata_cache_path, ExportRoom, RoomsValidationError, validate_rooms_model,
+    write_rooms_json, render_rooms_json, build_export_payload, normalize_unmatched_audio_files,
+    merge_unmatched_audio_files, iter_language_audio_files, collect_language_audio_files,
+    merge_language_audio_files, merge_existing_tracks_metadata, ExportCache,
+    recalculate_tracks_files_metadata, write_auxiliary_configs, SYSTEM_CONFIG_FILENAMES,
+    DEFAULT_REMOTE_PROJECTS_DIR, DEFAULT_SERVER_HOST, DEFAULT_SERVER_USERNAME, DEFAULT_SERVER_PORT,
+    DEFAULT_TRANSFER_CHANNELS, TRANSFER_CHUNK_SIZE, find_default_ssh_key, load_private_key,
+    build_remote_manifest, SshSessionManager, ensure_remote_dirs, resolve_remote_base_dir,
+    read_remote_bytes, read_local_bytes, upload_remote_file, extract_track_crc_map,
+    decode_json_payload, diff_json_values, compare_upload_item, collect_local_audio_names,
+    project_config_label, excursion_folder_name, main as run_cli
+)
 
-    return None
 
-def fix_negative_zero(val):
-    return 0.0 if abs(val) < 1e-9 else val
+UNDO_MEMORY_LIMIT_BYTES = 64 * 1024 * 1024
+UNDO_STATE_COLLECTIONS = ("halls", "anchors", "proximity_zones")
+UNDO_STATE_ITEMS_KEY = "items"
 
 
-def _tracks_data_signature(tracks_data: dict) -> str:
-    if not isinstance(tracks_data, dict):
-        return ""
-    normalized = copy.deepcopy(tracks_data)
-    normalized.pop("version", None)
-    return json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+def _state_inverse_patch(before: dict, after: dict) -> dict | None:
+    # Патч хранит только изменившиеся поля и объекты в их прежнем виде:
+    # None в коллекции означает, что объект был создан и при отмене удаляется.
+    patch = {"fields": {}}
+    for key, value in before.items():
+        if key in UNDO_STATE_COLLECTIONS or key == UNDO_STATE_ITEMS_KEY:
+            continue
+        if key not in after or after[key] != value:
+            patch["fields"][key] = value
+    for collection in UNDO_STATE_COLLECTIONS:
+        before_items = {entry["uid"]: entry for entry in before.get(collection, [])}
+        after_items = {entry["uid"]: entry for entry in after.get(collection, [])}
+        changes = {}
+        for uid, entry in before_items.items():
+            if after_items.get(uid) != entry:
+                changes[uid] = entry
+        for uid in after_items:
+            if uid not in before_items:
+                changes[uid] = None
+        if changes:
+            patch[collection] = changes
+        before_order = list(before_items)
+        if before_order != list(after_items):
+            patch[f"{collection}_order"] = before_order
+    if not patch["fields"] and len(patch) == 1:
+        return None
+    return patch
 
 
-def _is_tracks_version_valid(value) -> bool:
-    if not isinstance(value, str):
-        return False
-    try:
-        datetime.strptime(value, "%y%m%d-%H%M")
-    except ValueError:
-        return False
-    return True
+def _estimate_state_size(value) -> int:
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, dict):
+        return 64 + sum(_estimate_state_size(k) + _estimate_state_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 56 + sum(_estimate_state_size(v) for v in value)
+    return 28
 
 
 SETTINGS_ORG = "RG"
 SETTINGS_APP = "RG_Tag_Mapper"
 SETTINGS_LAST_DIR = "paths/last_dir"
-SYSTEM_CONFIG_FILENAMES = ("config.json", "defconfig.json", "excurs.json", "settings.json")
-DEFAULT_REMOTE_PROJECTS_DIR = "/ftpradiog"
+DEFAULT_HUMAN_HEIGHT_CM = 130.0
+DOWNLOAD_PREFETCH_REQUESTS = 64
 REMOTE_SERVICE_PROJECT_DIRS = {"hpbuf", "default", "ENRG", "esp_default"}
 
 
@@ -125,59 +141,421 @@ def choose_directory(parent, title: str, directory: str = ""):
 # ---------------------------------------------------------------------------
 # Audio helpers and widgets
 # ---------------------------------------------------------------------------
-def extract_track_id(filename: str) -> int:
-    name = os.path.splitext(os.path.basename(filename))[0]
-    digits = ''.join(ch for ch in name if ch.isdigit())
-    return int(digits) if digits else 0
+AUDIO_SCAN_WORKERS = min(8, (os.cpu_count() or 2) * 2)
 
 
-def parse_additional_ids(text: str):
-    ids = []
-    for token in text.split(','):
-        token = token.strip()
-        if not token:
-            continue
-        try:
-            ids.append(int(token))
-        except ValueError:
-            continue
-    return ids
+class SystemConfigStore(QObject):
+    # Системные JSON проекта (settings.json и др.) читаются с диска один раз и
+    # дальше отдаются из памяти. QFileSystemWatcher следит за каталогом проекта:
+    # при внешнем изменении файл перечитывается, и если данные действительно
+    # поменялись, подписчики получают сигнал changed(имя файла).
+    changed = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.config_dir = None
+        self._entries = {}
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._refresh)
+        self._watcher.fileChanged.connect(self._refresh)
+
+    def set_config_dir(self, config_dir: str | None):
+        config_dir = os.path.abspath(config_dir) if config_dir else None
+        if config_dir == self.config_dir:
+            return
+        watched = self._watcher.files() + self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+        self.config_dir = config_dir
+        self._entries = {}
+        self._watch_paths()
+        for filename in SYSTEM_CONFIG_FILENAMES:
+            self.changed.emit(filename)
 
+    def _path(self, filename: str) -> str | None:
+        return os.path.join(self.config_dir, filename) if self.config_dir else None
 
-def normalize_int_list(values) -> list[int]:
-    if values is None:
-        return []
-    if isinstance(values, str):
-        return parse_additional_ids(values)
+    @staticmethod
+    def _signature(path: str | None):
+        if not path:
+            return None
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_mtime_ns, file_stat.st_size
 
-    result: list[int] = []
-    if isinstance(values, (list, tuple, set)):
-        for value in values:
+    def _read(self, filename: str):
+        path = self._path(filename)
+        signature = self._signature(path)
+        data = None
+        if signature is not None:
             try:
-                result.append(int(value))
-            except (TypeError, ValueError):
+                with open(path, "r", encoding="utf-8") as config_file:
+                    data = json.load(config_file)
+            except Exception:
+                data = None
+        return signature, data if isinstance(data, dict) else None
+
+    def _watch_paths(self):
+        if not self.config_dir:
+            return
+        if self.config_dir not in self._watcher.directories() and os.path.isdir(self.config_dir):
+            self._watcher.addPath(self.config_dir)
+        watched_files = set(self._watcher.files())
+        for filename in SYSTEM_CONFIG_FILENAMES:
+            path = self._path(filename)
+            if path not in watched_files and os.path.isfile(path):
+                self._watcher.addPath(path)
+
+    def get(self, filename: str) -> dict | None:
+        entry = self._entries.get(filename)
+        if entry is None:
+            entry = self._read(filename)
+            self._entries[filename] = entry
+        return entry[1]
+
+    def store(self, filename: str, data: dict):
+        # Файл только что записан самим приложением: кэш обновляется без
+        # повторного чтения, а последующее уведомление watcher'а совпадёт по
+        # времени изменения и будет проигнорировано.
+        previous = self._entries.get(filename)
+        self._entries[filename] = (self._signature(self._path(filename)), copy.deepcopy(data))
+        self._watch_paths()
+        if previous is None or previous[1] != data:
+            self.changed.emit(filename)
+
+    def _refresh(self, _path: str = ""):
+        self._watch_paths()
+        for filename in SYSTEM_CONFIG_FILENAMES:
+            previous = self._entries.get(filename)
+            if previous is None or self._signature(self._path(filename)) == previous[0]:
                 continue
-    return result
+            entry = self._read(filename)
+            self._entries[filename] = entry
+            if entry[1] != previous[1]:
+                self.changed.emit(filename)
 
 
-def load_audio_file_info(path: str):
-    try:
-        audio = MP3(path)
-    except Exception as exc:
-        raise ValueError(str(exc)) from exc
-    duration_ms = int(round(audio.info.length * 1000)) if audio.info.length else 0
-    try:
-        size_bytes = os.path.getsize(path)
-    except OSError:
-        size_bytes = 0
-    with open(path, 'rb') as fh:
-        encoded = base64.b64encode(fh.read()).decode('ascii')
-    return {
-        'filename': os.path.basename(path),
-        'data': encoded,
-        'duration_ms': duration_ms,
-        'size': size_bytes
-    }
+class ContentLanguageIndex(QObject):
+    # Языковые подпапки content/ сканируются один раз в индекс «имя файла →
+    # языки». QFileSystemWatcher следит за content/ и каждой языковой папкой;
+    # при изменении перечитывается только затронутый каталог, а подписчики
+    # получают сигнал changed, если состав языков действительно поменялся.
+    changed = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.content_dir = None
+        self._files_by_lang: dict[str, set[str]] = {}
+        self._langs_by_file: dict[str, list[str]] = {}
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+
+    def set_content_dir(self, content_dir: str | None):
+        content_dir = os.path.abspath(content_dir) if content_dir else None
+        if content_dir == self.content_dir and (
+            content_dir in self._watcher.directories()
+            or not (content_dir and os.path.isdir(content_dir))
+        ):
+            return
+        watched = self._watcher.directories()
+        if watched:
+            self._watcher.removePaths(watched)
+        self.content_dir = content_dir
+        self._files_by_lang = {}
+        if content_dir and os.path.isdir(content_dir):
+            self._watcher.addPath(content_dir)
+            self._scan_languages()
+        self._rebuild()
+
+    def languages_for(self, filename: str) -> list[str]:
+        # Имена сравниваются без учёта регистра, как их находит Windows:
+        # Track01.MP3 в языковой папке соответствует track01.mp3.
+        audio_name = os.path.basename(str(filename or "").replace("\\", "/"))
+        return list(self._langs_by_file.get(audio_name.lower(), ()))
+
+    @staticmethod
+    def _list_dir(path: str, want_dirs: bool) -> list[str]:
+        try:
+            with os.scandir(path) as entries:
+                return [
+                    entry.name for entry in entries
+                    if (entry.is_dir() if want_dirs else entry.is_file())
+                ]
+        except OSError:
+            return []
+
+    def _scan_language(self, lang_name: str):
+        lang_dir = os.path.join(self.content_dir, lang_name)
+        self._files_by_lang[lang_name] = set(self._list_dir(lang_dir, want_dirs=False))
+        if lang_dir not in self._watcher.directories():
+            self._watcher.addPath(lang_dir)
+
+    def _drop_language(self, lang_name: str):
+        self._files_by_lang.pop(lang_name, None)
+        lang_dir = os.path.join(self.content_dir, lang_name)
+        if lang_dir in self._watcher.directories():
+            self._watcher.removePath(lang_dir)
+
+    def _scan_languages(self):
+        present = {
+            name for name in self._list_dir(self.content_dir, want_dirs=True)
+            if name and not name.startswith(".")
+        }
+        for lang_name in list(self._files_by_lang):
+            if lang_name not in present:
+                self._drop_language(lang_name)
+        for lang_name in present:
+            if lang_name not in self._files_by_lang:
+                self._scan_language(lang_name)
+
+    def _rebuild(self):
+        langs_by_file: dict[str, list[str]] = {}
+        for lang_name in sorted(self._files_by_lang):
+            for filename in self._files_by_lang[lang_name]:
+                langs = langs_by_file.setdefault(filename.lower(), [])
+                if not langs or langs[-1] != lang_name:
+                    langs.append(lang_name)
+        if langs_by_file != self._langs_by_file:
+            self._langs_by_file = langs_by_file
+            self.changed.emit()
+
+    def _on_directory_changed(self, path: str):
+        if not self.content_dir:
+            return
+        path = os.path.abspath(path)
+        if path == self.content_dir:
+            if os.path.isdir(path):
+                if path not in self._watcher.directories():
+                    self._watcher.addPath(path)
+                self._scan_languages()
+            else:
+                for lang_name in list(self._files_by_lang):
+                    self._drop_language(lang_name)
+        elif os.path.dirname(path) == self.content_dir:
+            lang_name = os.path.basename(path)
+            if os.path.isdir(path):
+                self._scan_language(lang_name)
+            else:
+                self._drop_language(lang_name)
+        self._rebuild()
+
+
+# ---------------------------------------------------------------------------
+# Project file (.proj)
+# ---------------------------------------------------------------------------
+PROJECT_LOAD_BATCH = 100
+
+
+class ProjectLoadWorker(QThread):
+    # Чтение архива, разбор JSON, проверка структуры и декодирование плана
+    # в QImage идут в фоне; объекты сцены создаёт уже GUI-поток.
+    def __init__(self, path: str, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.error = ""
+        self.data = None
+        self.image_bytes = b""
+        self.image = QImage()
+
+    def run(self):
+        try:
+            data, image_bytes = read_project_file(self.path)
+            if self.isInterruptionRequested():
+                return
+            self.data = validate_project_data(data)
+            self.image_bytes = image_bytes
+            if image_bytes:
+                self.image = QImage.fromData(image_bytes)
+        except Exception as exc:
+            self.error = str(exc) or exc.__class__.__name__
+
+
+# ---------------------------------------------------------------------------
+# SFTP transfer engine
+# ---------------------------------------------------------------------------
+def format_transfer_stats(speed_bps: float, eta_seconds: float) -> str:
+    speed_text = f"{speed_bps / (1024 * 1024):.2f} МБ/с"
+    if eta_seconds < 0:
+        return f"Скорость: {speed_text}"
+    minutes, seconds = divmod(int(round(eta_seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    eta_text = f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+    return f"Скорость: {speed_text}, осталось: {eta_text}"
+
+
+class SftpTransferWorker(QThread):
+    # Передача выполняется в отдельном потоке по нескольким SFTP-каналам
+    # одного SSH-соединения; диалог получает прогресс только через сигналы.
+    # Один файл передаёт _transfer_job(sftp, job), который определяют
+    # наследники для выгрузки и для загрузки.
+    cancel_message = "Операция отменена пользователем."
+    progress = Signal(object, object, int, int, float, float, str)
+    file_finished = Signal(str, bool, str)
+
+    def __init__(self, open_sftp, jobs: list[dict], channels: int = DEFAULT_TRANSFER_CHANNELS, parent=None):
+        super().__init__(parent)
+        self._open_sftp = open_sftp
+        self.jobs = list(jobs)
+        self.channels = max(1, min(int(channels or 1), len(self.jobs) or 1))
+        self.error = ""
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        self._bytes_done = 0
+        self._bytes_resumed = 0
+        self._files_done = 0
+        self._total_bytes = sum(int(job.get("size") or 0) for job in self.jobs)
+        self._started_at = 0.0
+        self._last_emit = 0.0
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def run(self):
+        self._started_at = time.monotonic()
+        job_queue = queue.Queue()
+        for job in self.jobs:
+            job_queue.put(job)
+        threads = [
+            threading.Thread(target=self._channel_loop, args=(job_queue,), daemon=True)
+            for _ in range(self.channels)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if not self.error and self._cancel_event.is_set():
+            self.error = self.cancel_message
+        self._emit_progress("", force=True)
+
+    def _fail(self, message: str):
+        with self._lock:
+            if not self.error:
+                self.error = message
+        self._cancel_event.set()
+
+    def _channel_loop(self, job_queue: queue.Queue):
+        try:
+            sftp = self._open_sftp()
+        except Exception as exc:
+            self._fail(f"Не удалось открыть SFTP-канал: {exc}")
+            return
+        try:
+            while not self._cancel_event.is_set():
+                try:
+                    job = job_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._transfer_job(sftp, job)
+                except Exception as exc:
+                    self.file_finished.emit(job["display_name"], False, str(exc))
+                    self._fail(str(exc))
+                    return
+                with self._lock:
+                    self._files_done += 1
+                self.file_finished.emit(job["display_name"], True, "OK")
+                self._emit_progress(job["display_name"], force=True)
+        finally:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+
+    def _add_progress(self, byte_count: int, label: str):
+        with self._lock:
+            self._bytes_done += byte_count
+        self._emit_progress(label)
+
+    def _check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise RuntimeError(self.cancel_message)
+
+    def _emit_progress(self, label: str, force: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_emit < 0.1:
+                return
+            self._last_emit = now
+            bytes_done = self._bytes_done
+            bytes_resumed = self._bytes_resumed
+            files_done = self._files_done
+        elapsed = max(now - self._started_at, 1e-6)
+        speed = max(bytes_done - bytes_resumed, 0) / elapsed
+        remaining = max(self._total_bytes - bytes_done, 0)
+        eta = remaining / speed if speed > 0 else -1.0
+        self.progress.emit(bytes_done, self._total_bytes, files_done, len(self.jobs), speed, eta, label)
+
+
+class SftpUploadWorker(SftpTransferWorker):
+    cancel_message = "Выгрузка отменена пользователем."
+
+    def _add_resumed(self, byte_count: int):
+        with self._lock:
+            self._bytes_done += byte_count
+            self._bytes_resumed += byte_count
+
+    def _transfer_job(self, sftp, job: dict):
+        display_name = job["display_name"]
+        self._emit_progress(display_name)
+        upload_remote_file(
+            sftp,
+            job,
+            on_chunk=lambda byte_count: self._add_progress(byte_count, display_name),
+            on_resume=self._add_resumed,
+            check_cancelled=self._check_cancelled,
+        )
+
+
+class SftpDownloadWorker(SftpTransferWorker):
+    # Файл скачивается потоково во временный <имя>.part с ограниченным
+    # числом упреждающих запросов и заменяет локальный только после проверки.
+    cancel_message = "Загрузка отменена пользователем."
+
+    def _transfer_job(self, sftp, job: dict):
+        display_name = job["display_name"]
+        size = int(job.get("size") or 0)
+        local_path = job["local_path"]
+        temp_path = f"{local_path}.part"
+        self._emit_progress(display_name)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        crc = 0
+        received = 0
+        try:
+            with sftp.file(job["remote_path"], "rb") as remote_stream, open(temp_path, "wb") as local_stream:
+                if size > 0:
+                    remote_stream.prefetch(size, max_concurrent_requests=DOWNLOAD_PREFETCH_REQUESTS)
+                while True:
+                    self._check_cancelled()
+                    chunk = remote_stream.read(TRANSFER_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    local_stream.write(chunk)
+                    crc = zlib.crc32(chunk, crc)
+                    received += len(chunk)
+                    self._add_progress(len(chunk), display_name)
+            if size and received != size:
+                raise IOError(f"Размер файла не совпал после загрузки: {display_name}")
+            expected_crc = str(job.get("crc32") or "").strip().lower()
+            if expected_crc and f"{crc & 0xFFFFFFFF:08x}" != expected_crc:
+                raise IOError(f"CRC32 не совпал после загрузки: {display_name}")
+            os.replace(temp_path, local_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        mtime = job.get("mtime")
+        if mtime:
+            try:
+                os.utime(local_path, (mtime, mtime))
+            except OSError:
+                pass
 
 
 def format_audio_menu_line(info) -> str | None:
@@ -270,22 +648,12 @@ class AudioTrackWidget(QWidget):
         if not data:
             self._clear_main_file()
             return
-        self.main_file_info = {
-            'filename': data.get('filename'),
-            'data': data.get('data'),
-            'duration_ms': data.get('duration_ms', 0),
-            'size': data.get('size', 0)
-        }
+        self.main_file_info = audio_file_ref(data)
         self.display_name = data.get('display_name', "") if isinstance(data, dict) else ""
         self.secondary_file_info = None
         if data.get('secondary'):
             sec = data['secondary']
-            self.secondary_file_info = {
-                'filename': sec.get('filename'),
-                'data': sec.get('data'),
-                'duration_ms': sec.get('duration_ms', 0),
-                'size': sec.get('size', 0)
-            }
+            self.secondary_file_info = audio_file_ref(sec)
         self.extra_ids_edit.setText(', '.join(str(x) for x in data.get('extra_ids', [])))
         self.interruptible_box.setChecked(data.get('interruptible', True))
         self.reset_box.setChecked(data.get('reset', False))
@@ -295,26 +663,18 @@ class AudioTrackWidget(QWidget):
     def get_data(self):
         if not self.main_file_info:
             return None
-        result = {
-            'filename': self.main_file_info['filename'],
-            'data': self.main_file_info['data'],
-            'duration_ms': self.main_file_info.get('duration_ms', 0),
-            'size': self.main_file_info.get('size', 0),
+        result = audio_file_ref(self.main_file_info)
+        result.update({
             'extra_ids': parse_additional_ids(self.extra_ids_edit.text()),
             'interruptible': self.interruptible_box.isChecked(),
             'reset': self.reset_box.isChecked(),
             'play_once': self.play_once_box.isChecked()
-        }
+        })
         name_text = (self.display_name or "").strip()
         if name_text:
             result['display_name'] = name_text
         if self.secondary_file_info:
-            result['secondary'] = {
-                'filename': self.secondary_file_info['filename'],
-                'data': self.secondary_file_info['data'],
-                'duration_ms': self.secondary_file_info.get('duration_ms', 0),
-                'size': self.secondary_file_info.get('size', 0)
-            }
+            result['secondary'] = audio_file_ref(self.secondary_file_info)
         return result
 
     def _select_main_file(self):
@@ -379,6 +739,194 @@ class AudioTrackWidget(QWidget):
 # ---------------------------------------------------------------------------
 # Track list dock
 # ---------------------------------------------------------------------------
+class TracksTreeNode:
+    __slots__ = ("key", "payload", "title", "hall", "zone", "info", "parent", "children", "values")
+
+    def __init__(self, key, parent=None):
+        self.key, self.parent = key, parent
+        self.payload, self.title = None, ""
+        self.hall = self.zone = self.info = None
+        self.children = []
+        self.values = None
+
+
+class TracksTreeModel(QAbstractItemModel):
+    # Строки хранят только ссылки на данные трека, тексты ячеек вычисляются
+    # в data() по запросу представления — то есть лишь для видимых строк.
+    # Языки берутся из индекса content/ главного окна без обращений к диску.
+    # Как и в ObjectTreeModel, sync() сверяет строки по ключам и сообщает
+    # представлению только о вставленных, удалённых и изменившихся строках.
+    CHECK_COLUMNS = {2: ('play_once', False), 3: ('reset', False), 4: ('interruptible', True)}
+    EDITABLE_COLUMNS = (1, 5, 6, 7)
+
+    def __init__(self, panel):
+        super().__init__(panel)
+        self.panel = panel
+        self._root = TracksTreeNode(None)
+
+    def sync(self, entries):
+        # entries: [(key, (payload, title, hall, zone, info), дочерние entries)]
+        self._reconcile(self._root, entries)
+        for node, (_, fields, child_entries) in zip(self._root.children, entries):
+            self._update_node(node, fields)
+            self._reconcile(node, child_entries)
+            for child, (_, child_fields, _) in zip(node.children, child_entries):
+                self._update_node(child, child_fields)
+
+    def _node_index(self, node, column=0) -> QModelIndex:
+        if node is None or node is self._root:
+            return QModelIndex()
+        return self.createIndex(node.parent.children.index(node), column, node)
+
+    def _reconcile(self, parent_node, entries):
+        parent_index = self._node_index(parent_node)
+        children = parent_node.children
+        wanted = {key for key, _, _ in entries}
+        row = 0
+        while row < len(children):
+            if children[row].key in wanted:
+                row += 1
+                continue
+            end = row
+            while end + 1 < len(children) and children[end + 1].key not in wanted:
+                end += 1
+            self.beginRemoveRows(parent_index, row, end)
+            del children[row:end + 1]
+            self.endRemoveRows()
+        for row, (key, _, _) in enumerate(entries):
+            if row < len(children) and children[row].key == key:
+                continue
+            current = next((i for i in range(row + 1, len(children)) if children[i].key == key), None)
+            if current is not None:
+                self.beginMoveRows(parent_index, current, current, parent_index, row)
+                children.insert(row, children.pop(current))
+                self.endMoveRows()
+            else:
+                self.beginInsertRows(parent_index, row, row)
+                children.insert(row, TracksTreeNode(key, parent_node))
+                self.endInsertRows()
+
+    def _update_node(self, node, fields):
+        node.payload, node.title, node.hall, node.zone, node.info = fields
+        values = tuple(
+            self._cell(node, column, role)
+            for column in range(len(self.panel.HEADER_LABELS))
+            for role in (Qt.DisplayRole, Qt.CheckStateRole)
+        )
+        if values != node.values:
+            node.values = values
+            self.dataChanged.emit(self._node_index(node), self._node_index(node, len(self.panel.HEADER_LABELS) - 1))
+
+    def top_nodes(self):
+        return list(self._root.children)
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = parent.internalPointer() if parent.isValid() else self._root
+        if row < 0 or row >= len(node.children) or column < 0 or column >= len(self.panel.HEADER_LABELS):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return QObject.parent(self)
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self._root:
+            return QModelIndex()
+        return self.createIndex(self._root.children.index(parent), 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = parent.internalPointer() if parent.isValid() else self._root
+        return len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.panel.HEADER_LABELS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and 0 <= section < len(self.panel.HEADER_LABELS):
+            return self.panel.HEADER_LABELS[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.internalPointer().info is None:
+            return flags
+        if index.column() in self.EDITABLE_COLUMNS:
+            flags |= Qt.ItemIsEditable
+        elif index.column() in self.CHECK_COLUMNS:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        return self._cell(index.internalPointer(), index.column(), role)
+
+    def _cell(self, node, column, role):
+        if role == Qt.UserRole and column == 0:
+            return node.payload
+        info = node.info
+        if info is None:
+            return node.title if role == Qt.DisplayRole and column == 0 else None
+        if role == Qt.CheckStateRole and column in self.CHECK_COLUMNS:
+            key, default = self.CHECK_COLUMNS[column]
+            return Qt.Checked if info.get(key, default) else Qt.Unchecked
+        if role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        if column == 0:
+            return node.title
+        if column == 1:
+            return str(info.get('filename', '') or '')
+        if column == 5:
+            return self._hall_text(node)
+        if column == 6:
+            extras = info.get('extra_ids') if isinstance(info.get('extra_ids'), list) else []
+            return ", ".join(str(x) for x in extras)
+        if column == 7:
+            return str(info.get('display_name', '') or '')
+        if column == 8:
+            return self.panel._available_language_labels(info.get('filename', ''))
+        return ""
+
+    @staticmethod
+    def _hall_text(node) -> str:
+        if node.zone is None:
+            return str(node.hall.number)
+        proximity_zone = node.zone
+        hall_numbers = [h for h in (proximity_zone.halls or []) if isinstance(h, int)]
+        hall_text = ", ".join(str(x) for x in sorted(set(hall_numbers)))
+        if not hall_text and proximity_zone.anchor and isinstance(proximity_zone.anchor.main_hall_number, int):
+            hall_text = str(proximity_zone.anchor.main_hall_number)
+        return hall_text
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or index.internalPointer().info is None:
+            return False
+        column = index.column()
+        if role == Qt.CheckStateRole and column in self.CHECK_COLUMNS:
+            value = Qt.Checked if value in (Qt.Checked, Qt.Checked.value) else Qt.Unchecked
+        elif role != Qt.EditRole or column not in self.EDITABLE_COLUMNS:
+            return False
+        node = index.internalPointer()
+        if not self.panel._apply_edit(node.payload, column, value):
+            return False
+        if node in node.parent.children:
+            self._update_node(node, (node.payload, node.title, node.hall, node.zone, node.info))
+        return True
+
+    def languages_changed(self):
+        last = len(self.panel.HEADER_LABELS) - 1
+        for node in self._root.children:
+            if node.children:
+                parent = self.createIndex(self._root.children.index(node), 0, node)
+                self.dataChanged.emit(self.index(0, last, parent), self.index(len(node.children) - 1, last, parent), [Qt.DisplayRole])
+
+
 class TracksListWidget(QWidget):
     HEADER_LABELS = [
         "Зал / Трек",
@@ -395,16 +943,16 @@ class TracksListWidget(QWidget):
     def __init__(self, mainwindow):
         super().__init__(mainwindow)
         self.mainwindow = mainwindow
-        self._updating = False
         self._pending_snapshot = None
         self._refresh_queued = False
+        self._language_index = None
 
         layout = QVBoxLayout(self)
         layout.setContentsMargins(0, 0, 0, 0)
 
-        self.tree = QTreeWidget(self)
-        self.tree.setColumnCount(len(self.HEADER_LABELS))
-        self.tree.setHeaderLabels(self.HEADER_LABELS)
+        self.model = TracksTreeModel(self)
+        self.tree = QTreeView(self)
+        self.tree.setModel(self.model)
         self.tree.setAlternatingRowColors(True)
         self.tree.setRootIsDecorated(False)
         self.tree.setIndentation(0)
@@ -412,33 +960,32 @@ class TracksListWidget(QWidget):
             QAbstractItemView.EditTrigger.DoubleClicked |
             QAbstractItemView.EditTrigger.SelectedClicked
         )
-        self.tree.itemChanged.connect(self._on_item_changed)
         self.tree.setStyleSheet(
             """
-            QTreeWidget { background-color: transparent; }
-            QTreeWidget::item {
+            QTreeView { background-color: transparent; }
+            QTreeView::item {
                 selection-background-color: rgba(235, 235, 235, 120);
                 selection-color: #000000;
             }
-            QTreeWidget::item:hover {
+            QTreeView::item:hover {
                 background-color: rgba(235, 235, 235, 120);
             }
-            QTreeWidget::item:selected,
-            QTreeWidget::item:selected:active,
-            QTreeWidget::item:selected:!active {
+            QTreeView::item:selected,
+            QTreeView::item:selected:active,
+            QTreeView::item:selected:!active {
                 background-color: rgba(235, 235, 235, 120);
                 color: #000000;
             }
-            QTreeWidget::branch:hover,
-            QTreeWidget::branch:selected,
-            QTreeWidget::branch:selected:active,
-            QTreeWidget::branch:selected:!active {
+            QTreeView::branch:hover,
+            QTreeView::branch:selected,
+            QTreeView::branch:selected:active,
+            QTreeView::branch:selected:!active {
                 background: transparent;
                 background-color: transparent;
                 image: none;
                 border: none;
             }
-            QTreeWidget QLineEdit {
+            QTreeView QLineEdit {
                 background-color: #ffffff;
                 color: #000000;
                 selection-background-color: palette(highlight);
@@ -468,46 +1015,42 @@ class TracksListWidget(QWidget):
     def refresh(self):
         if not hasattr(self.mainwindow, "halls"):
             return
-        self._updating = True
-        try:
-            self.tree.clear()
-            halls = sorted(
-                self.mainwindow.halls,
-                key=lambda h: self._normalize_sort_key(getattr(h, "number", 0))
-            )
-            for hall in halls:
-                hall_title = f"▾ Зал {hall.number}"
-                if hall.name:
-                    hall_title += f" — {hall.name}"
-                hall_item = QTreeWidgetItem([hall_title])
-                hall_item.setData(0, Qt.UserRole, {"type": "hall", "hall": hall.number})
-                hall_item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-                self.tree.addTopLevelItem(hall_item)
-                hall_item.setFirstColumnSpanned(True)
-                hall_item.setExpanded(True)
-
-                if hall.audio_settings:
-                    self._add_track_item(hall_item, hall, hall.audio_settings, True, None)
-
-                for track_id, info in self._sorted_track_items(hall.zone_audio_tracks):
-                    self._add_track_item(hall_item, hall, info, False, track_id)
-
-            proximity_tracks = [pz for pz in getattr(self.mainwindow, "proximity_zones", []) if isinstance(getattr(pz, "audio_info", None), dict)]
-            if proximity_tracks:
-                proximity_root = QTreeWidgetItem(["▾ Зоны по приближению"])
-                proximity_root.setData(0, Qt.UserRole, {"type": "proximity_root"})
-                proximity_root.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-                self.tree.addTopLevelItem(proximity_root)
-                proximity_root.setFirstColumnSpanned(True)
-                proximity_root.setExpanded(True)
-
-                proximity_tracks.sort(key=lambda z: self._normalize_sort_key(getattr(z, "zone_num", 0)))
-                for pz in proximity_tracks:
-                    self._add_proximity_track_item(proximity_root, pz)
-        finally:
-            self._updating = False
+        index_getter = getattr(self.mainwindow, "_content_language_index", None)
+        self._language_index = index_getter() if callable(index_getter) else None
+        entries = []
+        halls = sorted(
+            self.mainwindow.halls,
+            key=lambda h: self._normalize_sort_key(getattr(h, "number", 0))
+        )
+        for hall in halls:
+            hall_title = f"▾ Зал {hall.number}"
+            if hall.name:
+                hall_title += f" — {hall.name}"
+            track_entries = []
+            if hall.audio_settings:
+                self._add_track_entry(track_entries, hall, hall.audio_settings, True, None)
+
+            for track_id, info in self._sorted_track_items(hall.zone_audio_tracks):
+                self._add_track_entry(track_entries, hall, info, False, track_id)
+            entries.append((("hall", hall), ({"type": "hall", "hall": hall.number}, hall_title, hall, None, None), track_entries))
+
+        proximity_tracks = [pz for pz in getattr(self.mainwindow, "proximity_zones", []) if isinstance(getattr(pz, "audio_info", None), dict)]
+        if proximity_tracks:
+            proximity_tracks.sort(key=lambda z: self._normalize_sort_key(getattr(z, "zone_num", 0)))
+            track_entries = []
+            for pz in proximity_tracks:
+                self._add_proximity_track_entry(track_entries, pz)
+            entries.append((("proximity_root",), ({"type": "proximity_root"}, "▾ Зоны по приближению", None, None, None), track_entries))
+
+        self.model.sync(entries)
+        for row in range(len(entries)):
+            self.tree.setFirstColumnSpanned(row, QModelIndex(), True)
+        self.tree.expandAll()
         self._adjust_name_column_width()
 
+    def languages_changed(self):
+        self.model.languages_changed()
+
     @staticmethod
     def _normalize_sort_key(value):
         try:
@@ -527,66 +1070,25 @@ class TracksListWidget(QWidget):
 
     def _available_language_labels(self, filename: str) -> str:
         filename = str(filename or "").strip()
-        if not filename:
+        if not filename or self._language_index is None:
             return ""
-        resolver = getattr(self.mainwindow, "_languages_for_audio_filename", None)
-        if not callable(resolver):
-            return ""
-        return ", ".join(resolver(filename))
+        return ", ".join(self._language_index.languages_for(filename))
 
-    def _add_proximity_track_item(self, parent_item, proximity_zone):
+    def _add_proximity_track_entry(self, entries, proximity_zone):
         info = getattr(proximity_zone, "audio_info", None)
         if not isinstance(info, dict):
             return
-        item = QTreeWidgetItem(parent_item)
-        filename = str(info.get('filename', '') or '')
-        item.setText(0, f"    Зона по приближению {proximity_zone.zone_num}")
-        item.setText(1, filename)
-        item.setText(2, "")
-        item.setText(3, "")
-        item.setText(4, "")
-        hall_numbers = [h for h in (proximity_zone.halls or []) if isinstance(h, int)]
-        hall_text = ", ".join(str(x) for x in sorted(set(hall_numbers)))
-        if not hall_text and proximity_zone.anchor and isinstance(proximity_zone.anchor.main_hall_number, int):
-            hall_text = str(proximity_zone.anchor.main_hall_number)
-        item.setText(5, hall_text)
-        extras = info.get('extra_ids') if isinstance(info.get('extra_ids'), list) else []
-        item.setText(6, ", ".join(str(x) for x in extras))
-        item.setText(7, str(info.get('display_name', '') or ''))
-        item.setText(8, self._available_language_labels(filename))
-
-        item.setCheckState(2, Qt.Checked if info.get('play_once') else Qt.Unchecked)
-        item.setCheckState(3, Qt.Checked if info.get('reset') else Qt.Unchecked)
-        item.setCheckState(4, Qt.Checked if info.get('interruptible', True) else Qt.Unchecked)
-
-        item.setData(0, Qt.UserRole, {"type": "proximity_track", "zone_num": proximity_zone.zone_num, "anchor_id": proximity_zone.anchor.number if proximity_zone.anchor else None})
-        item.setFlags(Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable | Qt.ItemIsUserCheckable)
-
-    def _add_track_item(self, parent_item, hall, info, is_hall_track, track_id):
+        payload = {"type": "proximity_track", "zone_num": proximity_zone.zone_num, "anchor_id": proximity_zone.anchor.number if proximity_zone.anchor else None}
+        entries.append((
+            ("proximity_track", proximity_zone),
+            (payload, f"    Зона по приближению {proximity_zone.zone_num}", None, proximity_zone, info),
+            (),
+        ))
+
+    def _add_track_entry(self, entries, hall, info, is_hall_track, track_id):
         if not isinstance(info, dict):
             return
-        item = QTreeWidgetItem(parent_item)
         title = f"Зал {hall.number}: основной трек" if is_hall_track else f"Зона {track_id}"
-        title = f"    {title}"
-        filename = str(info.get('filename', '') or '')
-        item.setText(0, title)
-        item.setText(1, filename)
-        item.setText(2, "")
-        item.setText(3, "")
-        item.setText(4, "")
-        item.setText(5, str(hall.number))
-        item.setText(6, "")
-        item.setText(7, str(info.get('display_name', '') or ''))
-        item.setText(8, self._available_language_labels(filename))
-
-        extras = info.get('extra_ids') if isinstance(info.get('extra_ids'), list) else []
-        extras_text = ", ".join(str(x) for x in extras)
-        item.setText(6, extras_text)
-
-        item.setCheckState(2, Qt.Checked if info.get('play_once') else Qt.Unchecked)
-        item.setCheckState(3, Qt.Checked if info.get('reset') else Qt.Unchecked)
-        item.setCheckState(4, Qt.Checked if info.get('interruptible', True) else Qt.Unchecked)
-
         payload = {
             "type": "track",
             "hall": hall.number,
@@ -594,11 +1096,7 @@ class TracksListWidget(QWidget):
         }
         if not is_hall_track:
             payload["track_id"] = track_id
-        item.setData(0, Qt.UserRole, payload)
-        item.setData(5, Qt.UserRole, hall.number)
-
-        flags = Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable | Qt.ItemIsUserCheckable
-        item.setFlags(flags)
+        entries.append((("track", is_hall_track, track_id), (payload, f"    {title}", hall, None, info), ()))
 
     def _resolve_track(self, payload):
         if payload.get("type") == "proximity_track":
@@ -622,9 +1120,9 @@ class TracksListWidget(QWidget):
         track_id = payload.get("track_id")
         return hall, hall.zone_audio_tracks.get(track_id), track_id
 
-    def _ensure_snapshot(self):
+    def _ensure_snapshot(self, *items):
         if self._pending_snapshot is None:
-            self._pending_snapshot = self.mainwindow.capture_state()
+            self._pending_snapshot = self.mainwindow.capture_items_state(items)
 
     def _commit_snapshot(self):
         if self._pending_snapshot is None:
@@ -632,29 +1130,26 @@ class TracksListWidget(QWidget):
         self.mainwindow.push_undo_state(self._pending_snapshot)
         self._pending_snapshot = None
 
-    def _on_item_changed(self, item, column):
-        if self._updating:
-            return
-        payload = item.data(0, Qt.UserRole)
+    def _apply_edit(self, payload, column, value) -> bool:
         if not isinstance(payload, dict):
-            return
+            return False
         if payload.get("type") not in ("track", "proximity_track"):
-            return
+            return False
 
         if column == 1:
-            changed = self._handle_filename_change(payload, item.text(1))
+            changed = self._handle_filename_change(payload, value)
         elif column == 2:
-            changed = self._handle_flag_change(payload, 'play_once', item.checkState(2), False)
+            changed = self._handle_flag_change(payload, 'play_once', value, False)
         elif column == 3:
-            changed = self._handle_flag_change(payload, 'reset', item.checkState(3), False)
+            changed = self._handle_flag_change(payload, 'reset', value, False)
         elif column == 4:
-            changed = self._handle_flag_change(payload, 'interruptible', item.checkState(4), True)
+            changed = self._handle_flag_change(payload, 'interruptible', value, True)
         elif column == 5:
-            changed = self._handle_hall_number_change(payload, item.text(5))
+            changed = self._handle_hall_number_change(payload, value)
         elif column == 6:
-            changed = self._handle_extra_ids_change(payload, item.text(6))
+            changed = self._handle_extra_ids_change(payload, value)
         elif column == 7:
-            changed = self._handle_display_name_change(payload, item.text(7))
+            changed = self._handle_display_name_change(payload, value)
         else:
             changed = False
 
@@ -663,6 +1158,7 @@ class TracksListWidget(QWidget):
             self._queue_refresh()
         else:
             self._pending_snapshot = None
+        return changed
 
     def _queue_refresh(self):
         if self._refresh_queued:
@@ -690,15 +1186,11 @@ class TracksListWidget(QWidget):
         label_width = metrics.horizontalAdvance(self.HEADER_LABELS[7]) + 20
 
         max_text_width = 0
-
-        def _iterate(item):
-            nonlocal max_text_width
-            max_text_width = max(max_text_width, metrics.horizontalAdvance(item.text(7)))
-            for idx in range(item.childCount()):
-                _iterate(item.child(idx))
-
-        for index in range(self.tree.topLevelItemCount()):
-            _iterate(self.tree.topLevelItem(index))
+        for top_node in self.model.top_nodes():
+            for node in top_node.children:
+                name = str(node.info.get('display_name', '') or '')
+                if name:
+                    max_text_width = max(max_text_width, metrics.horizontalAdvance(name))
 
         base_width = max(label_width, int(metrics.averageCharWidth() * 18))
         if max_text_width:
@@ -716,7 +1208,7 @@ class TracksListWidget(QWidget):
             return False
         if new_name == current:
             return False
-        self._ensure_snapshot()
+        self._ensure_snapshot(hall)
         info['filename'] = new_name
         return True
 
@@ -728,7 +1220,7 @@ class TracksListWidget(QWidget):
         current = info.get('display_name', '') or ''
         if new_name == current:
             return False
-        self._ensure_snapshot()
+        self._ensure_snapshot(hall)
         if new_name:
             info['display_name'] = new_name
         elif 'display_name' in info:
@@ -743,7 +1235,7 @@ class TracksListWidget(QWidget):
         current_value = info.get(key, default)
         if bool(current_value) == new_value and (key in info or new_value == default):
             return False
-        self._ensure_snapshot()
+        self._ensure_snapshot(hall)
         info[key] = new_value
         return True
 
@@ -765,7 +1257,7 @@ class TracksListWidget(QWidget):
         if target is None:
             QMessageBox.warning(self, "Ошибка", f"Зал с номером {new_hall_number} не найден.")
             return False
-        self._ensure_snapshot()
+        self._ensure_snapshot(hall, target)
         if payload.get('is_hall_track'):
             hall.audio_settings = None
             target.audio_settings = info
@@ -782,7 +1274,7 @@ class TracksListWidget(QWidget):
         current = info.get('extra_ids', [])
         if parsed == current:
             return False
-        self._ensure_snapshot()
+        self._ensure_snapshot(hall)
         info['extra_ids'] = parsed
         return True
 
@@ -1221,6 +1713,151 @@ class ProximityZoneDialog(QDialog):
             'audio': copy.deepcopy(self.audio_widget.get_data())
         }
 
+# ---------------------------------------------------------------------------
+# Item labels
+# ---------------------------------------------------------------------------
+# Контуры номеров на плане строятся один раз на текст и переиспользуются всеми
+# элементами: paint() только сдвигает готовый QPainterPath в нужную точку.
+# Путь задан в координатах элемента, поэтому от масштаба вида не зависит.
+LABEL_OUTLINE_COLOR = QColor(180, 180, 180)
+LABEL_CACHE_LIMIT = 4096
+# Кэш DeviceCoordinateCache всех элементов живёт в QPixmapCache; стандартных
+# 10 МБ не хватает на десятки зон приближения, и при перетаскивании они
+# перерисовывались бы заново каждый кадр.
+ITEM_PIXMAP_CACHE_LIMIT_KB = 128 * 1024
+_label_glyph_cache: dict[str, tuple[QPainterPath, float, float]] = {}
+
+
+def label_glyphs(text: str) -> tuple[QPainterPath, float, float]:
+    glyphs = _label_glyph_cache.get(text)
+    if glyphs is None:
+        font = QFont(); font.setBold(True)
+        metrics = QFontMetricsF(font)
+        path = QPainterPath(); path.addText(QPointF(0, 0), font, text)
+        if len(_label_glyph_cache) >= LABEL_CACHE_LIMIT:
+            _label_glyph_cache.clear()
+        glyphs = _label_glyph_cache[text] = (path, metrics.horizontalAdvance(text), metrics.descent())
+    return glyphs
+
+
+def label_bounds(text: str, pos: QPointF) -> QRectF:
+    # +1 px на половину ширины контура (перо 2 px).
+    return label_glyphs(text)[0].boundingRect().translated(pos).adjusted(-1, -1, 1, 1)
+
+
+def draw_label(painter, text: str, pos: QPointF, fill: QColor):
+    path = label_glyphs(text)[0]
+    painter.save()
+    painter.translate(pos)
+    painter.setPen(QPen(LABEL_OUTLINE_COLOR, 2)); painter.drawPath(path); painter.fillPath(path, fill)
+    painter.restore()
+
+
+# ---------------------------------------------------------------------------
+# Spatial index
+# ---------------------------------------------------------------------------
+SPATIAL_BUCKET_SIZE = 64.0
+SPATIAL_MAX_BUCKETS_PER_ITEM = 4096
+
+
+class SceneSpatialIndex:
+    # Корзины фиксированного размера по координатам сцены для залов, зон,
+    # якорей и зон приближения. Элементы сами помечают себя «грязными» при
+    # перемещении, смене геометрии или сцены; пересчёт корзин выполняется
+    # лениво при следующем запросе и затрагивает только изменившиеся элементы.
+    def __init__(self, bucket_size: float = SPATIAL_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self._buckets: dict[tuple[int, int], set] = {}
+        self._oversized = set()
+        self._item_keys = {}
+        self._dirty = set()
+
+    def clear(self):
+        self._buckets.clear()
+        self._oversized.clear()
+        self._item_keys.clear()
+        self._dirty.clear()
+
+    def mark_dirty(self, item):
+        self._dirty.add(item)
+
+    def remove(self, item):
+        self._dirty.discard(item)
+        keys = self._item_keys.pop(item, None)
+        if keys is None:
+            return
+        if not keys:
+            self._oversized.discard(item)
+            return
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(item)
+                if not bucket:
+                    del self._buckets[key]
+
+    def _insert(self, item):
+        rect = item.sceneBoundingRect()
+        size = self.bucket_size
+        x0, x1 = math.floor(rect.left() / size), math.floor(rect.right() / size)
+        y0, y1 = math.floor(rect.top() / size), math.floor(rect.bottom() / size)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > SPATIAL_MAX_BUCKETS_PER_ITEM:
+            self._oversized.add(item)
+            self._item_keys[item] = ()
+            return
+        keys = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(item)
+        self._item_keys[item] = keys
+
+    def _flush(self):
+        while self._dirty:
+            item = self._dirty.pop()
+            self.remove(item)
+            if item.scene() is not None:
+                self._insert(item)
+
+    def items_at(self, pos: QPointF, types=None) -> list:
+        self._flush()
+        key = (math.floor(pos.x() / self.bucket_size), math.floor(pos.y() / self.bucket_size))
+        candidates = self._buckets.get(key, set()) | self._oversized
+        return [
+            item for item in candidates
+            if (types is None or isinstance(item, types)) and item.contains(item.mapFromScene(pos))
+        ]
+
+
+def mark_spatial_dirty(item):
+    index = getattr(item.scene(), "spatial_index", None)
+    if index is not None:
+        index.mark_dirty(item)
+
+
+def track_spatial_item_change(item, change):
+    if change == QGraphicsItem.ItemSceneChange:
+        index = getattr(item.scene(), "spatial_index", None)
+        if index is not None:
+            index.remove(item)
+    elif change in (
+        QGraphicsItem.ItemSceneHasChanged,
+        QGraphicsItem.ItemScenePositionHasChanged,
+        QGraphicsItem.ItemTransformHasChanged,
+    ):
+        mark_spatial_dirty(item)
+
+
+def move_anchors_by(anchors, delta: QPointF, scene):
+    # Зал сдвигается по шагу сетки, поэтому якоря едут на тот же шаг без
+    # повторной привязки и пересчёта Z-порядка для каждого из них.
+    scene.moving_anchor_group = True
+    try:
+        for anchor in anchors:
+            if anchor.scene() is scene:
+                anchor.moveBy(delta.x(), delta.y())
+    finally:
+        scene.moving_anchor_group = False
+
+
 # ---------------------------------------------------------------------------
 # HallItem
 # ---------------------------------------------------------------------------
@@ -1231,27 +1868,41 @@ class HallItem(QGraphicsRectItem):
         self.name, self.number = name, number
         self.scene_ref = scene
         self.setPen(QPen(QColor(0,0,255),2)); self.setBrush(QColor(0,0,255,50))
-        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges)
-        self.setZValue(-w_px*h_px); self.tree_item = None
+        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges|QGraphicsItem.ItemSendsScenePositionChanges)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+        self.setZValue(-w_px*h_px)
         self.audio_settings = None
         self.extra_tracks: list[int] = []
         self.zone_audio_tracks = {}
         self._undo_snapshot = None
         self._undo_initial_pos = None
+        self._drag_anchors = None
+
+    def _label_pos(self) -> QPointF:
+        return self.rect().bottomLeft() + QPointF(2,-2)
+
+    def boundingRect(self):
+        return super().boundingRect().united(label_bounds(str(self.number), self._label_pos()))
+
+    def prepareGeometryChange(self):
+        super().prepareGeometryChange()
+        mark_spatial_dirty(self)
+
+    def setRect(self, *args):
+        super().setRect(*args)
+        mark_spatial_dirty(self)
 
     def paint(self, painter, option, widget=None):
         super().paint(painter, option, widget)
-        painter.save()
-        font = QFont(); font.setBold(True); painter.setFont(font)
-        fill = self.pen().color(); outline = QColor(180,180,180)
-        rect = self.rect()
-        pos = rect.bottomLeft() + QPointF(2,-2)
-        path = QPainterPath(); path.addText(pos, font, str(self.number))
-        painter.setPen(QPen(outline,2)); painter.drawPath(path); painter.fillPath(path, fill)
-        painter.restore()
+        draw_label(painter, str(self.number), self._label_pos(), self.pen().color())
 
     def itemChange(self, change, value):
+        track_spatial_item_change(self, change)
+        if change == QGraphicsItem.ItemPositionHasChanged:
+            mark_tree_dirty(self)
         if change == QGraphicsItem.ItemPositionChange and self.scene():
+            if getattr(self.scene().mainwindow, "_restoring_state", False):
+                return super().itemChange(change, value)
             new = QPointF(value)
             sr = self.scene().sceneRect(); r = self.rect()
             new.setX(max(sr.left(), min(new.x(), sr.right()-r.width())))
@@ -1262,16 +1913,20 @@ class HallItem(QGraphicsRectItem):
                 new.setY(round(new.y()/step)*step)
             delta = new - self.pos()
             if not delta.isNull():
-                scene = self.scene()
-                if scene:
-                    mw = getattr(scene, "mainwindow", None)
-                    if mw:
-                        for anchor in mw.anchors:
-                            if anchor.main_hall_number == self.number or self.number in anchor.extra_halls:
-                                anchor.moveBy(delta.x(), delta.y())
+                self._move_anchors(delta)
             return new
         return super().itemChange(change, value)
 
+    def _move_anchors(self, delta: QPointF):
+        # Якоря едут вместе с залом сразу; пересчёт пространственного индекса
+        # и строк дерева откладывается через их пометки «грязных» объектов.
+        anchors = self._drag_anchors
+        if anchors is None:
+            mw = getattr(self.scene(), "mainwindow", None)
+            anchors = mw._anchors_for_hall(self.number) if mw else ()
+        if anchors:
+            move_anchors_by(anchors, delta, self.scene())
+
     # Unified menu
     def open_menu(self, global_pos: QPoint):
         if not self.scene(): return
@@ -1292,7 +1947,7 @@ class HallItem(QGraphicsRectItem):
         if act == edit:
             dlg = HallEditDialog(self, mw)
             if dlg.exec() == QDialog.Accepted:
-                prev_state = mw.capture_state()
+                prev_state = mw.capture_items_state([self, *mw._anchors_for_hall(self.number)])
                 values = dlg.values()
                 new_num = values['number']
                 new_name = values['name']
@@ -1305,10 +1960,10 @@ class HallItem(QGraphicsRectItem):
                     if a.main_hall_number == old:
                         a.main_hall_number = new_num
                     a.extra_halls = [new_num if x==old else x for x in a.extra_halls]
+                self.prepareGeometryChange()
                 self.number, self.name = new_num, new_name
                 w_px = new_w_m * ppcm * 100
                 h_px = new_h_m * ppcm * 100
-                self.prepareGeometryChange()
                 self.setRect(0, 0, w_px, h_px)
                 self.setZValue(-w_px*h_px)
                 mw.last_selected_items = []
@@ -1335,6 +1990,7 @@ class HallItem(QGraphicsRectItem):
                         mw.anchors.remove(a); a.scene().removeItem(a)
                 else:
                     a.extra_halls.remove(self.number)
+                    mw._invalidate_hall_anchor_index()
             mw.halls.remove(self); self.scene().removeItem(self)
             mw.last_selected_items = []; mw.populate_tree()
             mw.push_undo_state(prev_state)
@@ -1355,7 +2011,9 @@ class HallItem(QGraphicsRectItem):
             mw = self.scene().mainwindow
             if mw and not getattr(mw, "_restoring_state", False):
                 self._undo_initial_pos = QPointF(self.pos())
-                self._undo_snapshot = mw.capture_state()
+                mw._invalidate_hall_anchor_index()
+                self._undo_snapshot = mw.capture_drag_state(self)
+                self._drag_anchors = list(mw._anchors_for_hall(self.number))
         super().mousePressEvent(event)
 
     def mouseDoubleClickEvent(self, event):
@@ -1375,6 +2033,7 @@ class HallItem(QGraphicsRectItem):
 
     def mouseReleaseEvent(self, event):
         super().mouseReleaseEvent(event)
+        self._drag_anchors = None
         if event.button() == Qt.LeftButton and self.scene():
             if self._undo_snapshot is not None and self._undo_initial_pos is not None:
                 if self.pos() != self._undo_initial_pos:
@@ -1404,21 +2063,52 @@ class HallItem(QGraphicsRectItem):
 # AnchorItem
 # ---------------------------------------------------------------------------
 class AnchorItem(QGraphicsEllipseItem):
+    # Qt накладывает элементы верхнего уровня с равным Z в порядке добавления
+    # на сцену; stacking_index повторяет этот порядок для поиска по индексу.
+    _stacking_counter = itertools.count()
+
     def __init__(self, x, y, number=0, main_hall_number=None, scene=None):
         r = 3
         super().__init__(-r,-r,2*r,2*r)
+        self.stacking_index = next(AnchorItem._stacking_counter)
         self.setPos(x,y); self.number = number; self.z = 0
         self.main_hall_number = main_hall_number; self.extra_halls = []
         self.bound = False
         self.bound_explicit = False
         self.start = False
         self.setPen(QPen(QColor(255,0,0),2)); self.setBrush(QBrush(QColor(255,0,0)))
-        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges)
-        self.tree_item = None
+        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges|QGraphicsItem.ItemSendsScenePositionChanges)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
         self.update_zvalue()
         self._undo_snapshot = None
         self._undo_initial_pos = None
 
+    # Привязка к залам входит в индекс «зал → якоря» главного окна, поэтому
+    # её смена, как и добавление якоря на сцену или удаление с неё, этот
+    # индекс сбрасывает.
+    @property
+    def main_hall_number(self):
+        return self._main_hall_number
+
+    @main_hall_number.setter
+    def main_hall_number(self, value):
+        self._main_hall_number = value
+        self._invalidate_hall_index()
+
+    @property
+    def extra_halls(self):
+        return self._extra_halls
+
+    @extra_halls.setter
+    def extra_halls(self, value):
+        self._extra_halls = value
+        self._invalidate_hall_index()
+
+    def _invalidate_hall_index(self):
+        mw = getattr(self.scene(), "mainwindow", None)
+        if mw is not None:
+            mw._invalidate_hall_anchor_index()
+
     def update_zvalue(self):
         anchor_number = float(self.number) if isinstance(self.number, (int, float)) else 0.0
         self.setZValue(10000.0 + anchor_number * 0.001)
@@ -1429,18 +2119,32 @@ class AnchorItem(QGraphicsEllipseItem):
             return 0.0
         return max(0.0, (float(self.z or 0) / 100.0) * scene.pixel_per_cm_x * 100)
 
+    def _label_pos(self) -> QPointF:
+        br = self.rect()
+        return QPointF(br.center().x()-br.width()/2, br.top()-4)
+
     def boundingRect(self):
-        base = self.rect().adjusted(-2, -2, 2, 2)
-        r = self._start_radius_px()
-        if r <= 0:
-            return base
-        return base.united(QRectF(-r - 2, -r - 2, 2 * r + 4, 2 * r + 4))
+        # Qt запрашивает габариты много раз за кадр перетаскивания; они
+        # меняются только вместе с prepareGeometryChange() или сменой сцены.
+        bounds = getattr(self, "_bounds", None)
+        if bounds is None:
+            bounds = self.rect().adjusted(-2, -2, 2, 2).united(label_bounds(str(self.number), self._label_pos()))
+            r = self._start_radius_px()
+            if r > 0:
+                bounds = bounds.united(QRectF(-r - 2, -r - 2, 2 * r + 4, 2 * r + 4))
+            self._bounds = bounds
+        return bounds
 
     def shape(self):
         path = QPainterPath()
         path.addEllipse(self.rect())
         return path
 
+    def prepareGeometryChange(self):
+        super().prepareGeometryChange()
+        self._bounds = None
+        mark_spatial_dirty(self)
+
     def paint(self, painter, option, widget=None):
         if self.start:
             r = self._start_radius_px()
@@ -1454,17 +2158,20 @@ class AnchorItem(QGraphicsEllipseItem):
                 painter.drawEllipse(QPointF(0, 0), r, r)
                 painter.restore()
         super().paint(painter, option, widget)
-        painter.save()
-        font = QFont(); font.setBold(True); painter.setFont(font)
-        fill = self.pen().color(); outline = QColor(180,180,180)
-        br = self.rect()
-        pos = QPointF(br.center().x()-br.width()/2, br.top()-4)
-        path = QPainterPath(); path.addText(pos, font, str(self.number))
-        painter.setPen(QPen(outline,2)); painter.drawPath(path); painter.fillPath(path, fill)
-        painter.restore()
+        draw_label(painter, str(self.number), self._label_pos(), self.pen().color())
 
     def itemChange(self, change, value):
+        track_spatial_item_change(self, change)
+        if change == QGraphicsItem.ItemSceneChange:
+            self._invalidate_hall_index()
+        if change == QGraphicsItem.ItemSceneHasChanged:
+            self._bounds = None
+            if value is not None:
+                self.stacking_index = next(AnchorItem._stacking_counter)
+            self._invalidate_hall_index()
         if change == QGraphicsItem.ItemPositionChange and self.scene():
+            if getattr(self.scene().mainwindow, "_restoring_state", False) or self.scene().moving_anchor_group:
+                return super().itemChange(change, value)
             new = QPointF(value)
             step = self.scene().pixel_per_cm_x * self.scene().grid_step_cm
             if step>0:
@@ -1472,7 +2179,9 @@ class AnchorItem(QGraphicsEllipseItem):
                 new.setY(round(new.y()/step)*step)
             return new
         if change == QGraphicsItem.ItemPositionHasChanged:
-            self.update_zvalue()
+            if not (self.scene() and self.scene().moving_anchor_group):
+                self.update_zvalue()
+            mark_tree_dirty(self)
         return super().itemChange(change, value)
 
     def mousePressEvent(self, event):
@@ -1512,7 +2221,7 @@ class AnchorItem(QGraphicsEllipseItem):
             self.setSelected(True)
             if scene and mw and not getattr(mw, "_restoring_state", False):
                 self._undo_initial_pos = QPointF(self.scenePos())
-                self._undo_snapshot = mw.capture_state()
+                self._undo_snapshot = mw.capture_drag_state(self)
         super().mousePressEvent(event)
         event.accept()
 
@@ -1626,7 +2335,7 @@ class AnchorItem(QGraphicsEllipseItem):
             btns.rejected.connect(dlg.reject)
             form.addRow(btns)
             if dlg.exec() == QDialog.Accepted:
-                prev_state = mw.capture_state()
+                prev_state = mw.capture_items_state(mw._anchor_with_zones(self))
                 self.prepareGeometryChange()
                 self.number = num_spin.value()
                 x2, y2, z2 = x_spin.value(), y_spin.value(), z_spin.value()
@@ -1641,6 +2350,9 @@ class AnchorItem(QGraphicsEllipseItem):
                 py = hall.rect().height() - y2 * ppcm * 100
                 self.setPos(hall.mapToScene(QPointF(px, py)))
                 self.update_zvalue()
+                self.update()
+                for zone in [z for z in mw.proximity_zones if z.anchor is self]:
+                    zone.update()
                 self.scene().update()
                 mw.last_selected_items = []; mw.populate_tree()
                 mw.push_undo_state(prev_state)
@@ -1680,11 +2392,13 @@ class RectZoneItem(QGraphicsRectItem):
         self.zone_num, self.zone_type, self.zone_angle = zone_num, zone_type, angle
         self.setTransformOriginPoint(0,0); self.setRotation(-angle); self.setPos(bl)
         self._apply_zone_palette()
-        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges)
-        self.tree_item = None
+        self.setFlags(QGraphicsItem.ItemIsMovable|QGraphicsItem.ItemIsSelectable|QGraphicsItem.ItemSendsGeometryChanges|QGraphicsItem.ItemSendsScenePositionChanges)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
         self.update_zvalue()
         self._undo_snapshot = None
         self._undo_initial_pos = None
+        # Родитель передан в конструктор: о смене сцены Qt сообщает до появления Python-обработчика
+        mark_spatial_dirty(self)
 
     def update_zvalue(self):
         hall = self.parentItem()
@@ -1702,16 +2416,29 @@ class RectZoneItem(QGraphicsRectItem):
         fill_color.setAlpha(50)
         self.setBrush(QBrush(fill_color))
 
+    def _label_pos(self) -> QPointF:
+        return self.rect().bottomLeft() + QPointF(2,-2)
+
+    def boundingRect(self):
+        return super().boundingRect().united(label_bounds(str(self.zone_num), self._label_pos()))
+
+    def prepareGeometryChange(self):
+        super().prepareGeometryChange()
+        mark_spatial_dirty(self)
+
+    def setRect(self, *args):
+        super().setRect(*args)
+        mark_spatial_dirty(self)
+
+    def itemChange(self, change, value):
+        track_spatial_item_change(self, change)
+        if change == QGraphicsItem.ItemPositionHasChanged:
+            mark_tree_dirty(self)
+        return super().itemChange(change, value)
+
     def paint(self, painter, option, widget=None):
         super().paint(painter, option, widget)
-        painter.save()
-        font = QFont(); font.setBold(True); painter.setFont(font)
-        fill = self.pen().color(); outline = QColor(180,180,180)
-        rect = self.rect()
-        pos = rect.bottomLeft() + QPointF(2,-2)
-        path = QPainterPath(); path.addText(pos, font, str(self.zone_num))
-        painter.setPen(QPen(outline,2)); painter.drawPath(path); painter.fillPath(path, fill)
-        painter.restore()
+        draw_label(painter, str(self.zone_num), self._label_pos(), self.pen().color())
 
     def get_display_type(self):
         return {"Входная зона":"входная","Выходная зона":"выходная","Переходная":"переходная"}[self.zone_type]
@@ -1773,9 +2500,10 @@ class RectZoneItem(QGraphicsRectItem):
             current_audio = hall.zone_audio_tracks.get(self.zone_num) if hall else None
             dlg = ZoneEditDialog(self, current_audio, mw)
             if dlg.exec() == QDialog.Accepted:
-                prev_state = mw.capture_state()
+                prev_state = mw.capture_items_state([self])
                 values = dlg.values()
                 old_num = self.zone_num
+                self.prepareGeometryChange()
                 self.zone_num = values['zone_num']
                 self.zone_type = values['zone_type']
                 self.zone_angle = values['angle']
@@ -1784,7 +2512,6 @@ class RectZoneItem(QGraphicsRectItem):
                 ppcm = scene.pixel_per_cm_x
                 w_px = values['w'] * ppcm * 100
                 h_px = values['h'] * ppcm * 100
-                self.prepareGeometryChange()
                 self.setRect(0, -h_px, w_px, h_px)
                 self.setTransformOriginPoint(0,0)
                 self.setRotation(-self.zone_angle)
@@ -1836,7 +2563,7 @@ class RectZoneItem(QGraphicsRectItem):
             mw = self.scene().mainwindow
             if mw and not getattr(mw, "_restoring_state", False):
                 self._undo_initial_pos = QPointF(self.scenePos())
-                self._undo_snapshot = mw.capture_state()
+                self._undo_snapshot = mw.capture_drag_state(self)
         super().mousePressEvent(event)
 
     def mouseDoubleClickEvent(self, event):
@@ -1897,9 +2624,11 @@ class ProximityZoneItem(QGraphicsItem):
         self.halls = halls or []
         self.blacklist = blist or []
         self.audio_info = copy.deepcopy(audio) if audio else None
-        self.tree_item = None
         self.setFlag(QGraphicsItem.ItemIsSelectable, True)
+        self.setFlag(QGraphicsItem.ItemSendsScenePositionChanges, True)
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
         self.update_zvalue()
+        mark_spatial_dirty(self)
 
     def _radius_px(self, meters: float) -> float:
         if not self.scene():
@@ -1910,19 +2639,11 @@ class ProximityZoneItem(QGraphicsItem):
         return max(0.0, projected_radius_m * self.scene().pixel_per_cm_x * 100)
 
     def _human_height_cm(self) -> float:
-        default_height = 130.0
         scene = self.scene()
         mainwindow = getattr(scene, "mainwindow", None) if scene else None
         if mainwindow is None:
-            return default_height
-        settings_data = mainwindow._load_system_config("settings.json")
-        coord_sp = settings_data.get("coord_sp") if isinstance(settings_data, dict) else None
-        if not isinstance(coord_sp, dict):
-            return default_height
-        try:
-            return float(coord_sp.get("human_height", default_height))
-        except (TypeError, ValueError):
-            return default_height
+            return DEFAULT_HUMAN_HEIGHT_CM
+        return mainwindow._project_human_height_cm()
 
     def _projected_radius_m(self, sphere_radius_m: float) -> float:
         sphere_radius_m = max(0.0, float(sphere_radius_m or 0.0))
@@ -1935,18 +2656,38 @@ class ProximityZoneItem(QGraphicsItem):
             return 0.0
         return math.sqrt(projected_sq)
 
+    def _label_pos(self, fill_radius: float) -> QPointF:
+        _, advance, descent = label_glyphs(str(self.zone_num))
+        return QPointF(-advance / 2, fill_radius - descent - 2)
+
     def boundingRect(self):
-        r = max(self._radius_px(self.dist_in), self._radius_px(self.dist_out))
-        return QRectF(-r, -r, r * 2, r * 2)
+        # Габариты кэшируются так же, как у якоря
+        bounds = getattr(self, "_bounds", None)
+        if bounds is None:
+            r = max(self._radius_px(self.dist_in), self._radius_px(self.dist_out))
+            bounds = QRectF(-r - 1, -r - 1, r * 2 + 2, r * 2 + 2).united(label_bounds(str(self.zone_num), self._label_pos(r)))
+            self._bounds = bounds
+        return bounds
 
     def shape(self):
         path = QPainterPath()
         r = max(self._radius_px(self.dist_in), self._radius_px(self.dist_out))
         if r <= 0:
             return path
-        path.addEllipse(self.boundingRect())
+        path.addEllipse(QPointF(0, 0), r, r)
         return path
 
+    def prepareGeometryChange(self):
+        super().prepareGeometryChange()
+        self._bounds = None
+        mark_spatial_dirty(self)
+
+    def itemChange(self, change, value):
+        track_spatial_item_change(self, change)
+        if change == QGraphicsItem.ItemSceneHasChanged:
+            self._bounds = None
+        return super().itemChange(change, value)
+
     def paint(self, painter, option, widget=None):
         if not self.scene():
             return
@@ -1981,21 +2722,7 @@ class ProximityZoneItem(QGraphicsItem):
             painter.setPen(pen)
             painter.drawEllipse(QPointF(0, 0), r_out, r_out)
 
-        font = QFont()
-        font.setBold(True)
-        painter.setFont(font)
-        outline = QColor(180, 180, 180)
-        metrics = painter.fontMetrics()
-        text = str(self.zone_num)
-        text_width = metrics.horizontalAdvance(text)
-        x = -text_width / 2
-        y = fill_radius - metrics.descent() - 2
-        text_pos = QPointF(x, y)
-        path = QPainterPath()
-        path.addText(text_pos, font, text)
-        painter.setPen(QPen(outline, 2))
-        painter.drawPath(path)
-        painter.fillPath(path, color_in if r_in > 0 else color_out)
+        draw_label(painter, str(self.zone_num), self._label_pos(fill_radius), color_in if r_in > 0 else color_out)
         painter.restore()
 
     def update_zvalue(self):
@@ -2038,12 +2765,13 @@ class ProximityZoneItem(QGraphicsItem):
         delete = menu.addAction("Удалить")
         act = menu.exec(global_pos)
         if act == edit:
-            prev_state = mw.capture_state()
+            prev_state = mw.capture_items_state([self])
             values = self._open_edit_dialog(mw)
             if values is None:
                 return
             if not values['halls'] and self.anchor and self.anchor.main_hall_number is not None:
                 values['halls'] = [self.anchor.main_hall_number]
+            self.prepareGeometryChange()
             self.zone_num = values['zone_num']
             self.dist_in = values['dist_in']
             self.dist_out = values['dist_out']
@@ -2095,34 +2823,234 @@ class ProximityZoneItem(QGraphicsItem):
         super().mousePressEvent(event)
 
 
-def _zone_area(zone):
-    rect = zone.boundingRect()
-    return abs(rect.width() * rect.height())
+# ---------------------------------------------------------------------------
+# Plan background: tiled image pyramid
+# ---------------------------------------------------------------------------
+BACKGROUND_TILE_SIZE = 512
+BACKGROUND_TILE_MEMORY_LIMIT = 96
+BACKGROUND_TILE_CACHE_KEEP = 8
+BACKGROUND_TILE_STALE_BUILD_SECONDS = 24 * 3600
+GRID_MIN_SCREEN_SPACING_PX = 6.0
+GRID_STEP_MULTIPLIERS = (1, 2, 5)
 
-def _top_anchor(scene, pos):
-    if scene is None:
-        return None
-    # Точное попадание по форме якоря; возьмем верхний по Z
-    for item in scene.items(pos, Qt.ContainsItemShape):
-        if isinstance(item, AnchorItem):
-            return item
-    return None
 
-def _smallest_zone(scene, pos, exclude=None, max_area=None):
-    if scene is None:
-        return None
-    best = None
-    best_area = None
-    for item in scene.items(pos, Qt.IntersectsItemShape):
-        if isinstance(item, (RectZoneItem, ProximityZoneItem)) and item is not exclude:
-            rect = item.boundingRect()
-            area = abs(rect.width() * rect.height())
-            if max_area is not None and area >= max_area:
-                continue
-            if best is None or area < best_area:
-                best = item
-                best_area = area
-    return best
+def background_tile_cache_root() -> str:
+    cache_dir = QStandardPaths.writableLocation(QStandardPaths.GenericCacheLocation)
+    if not cache_dir:
+        return ""
+    return os.path.join(cache_dir, SETTINGS_APP, "plan_tiles")
+
+
+def prune_background_tile_cache(cache_root: str, keep_dir: str):
+    # На диске остаются пирамиды BACKGROUND_TILE_CACHE_KEEP последних
+    # открытых планов (время index.json обновляется при каждом открытии).
+    # Недостроенные каталоги удаляются, только если давно заброшены: их
+    # может прямо сейчас строить другой экземпляр редактора.
+    try:
+        entries = [os.path.join(cache_root, name) for name in os.listdir(cache_root)]
+    except OSError:
+        return
+    now = time.time()
+    finished = []
+    for path in entries:
+        if path == keep_dir or not os.path.isdir(path):
+            continue
+        try:
+            finished.append((os.path.getmtime(os.path.join(path, "index.json")), path))
+        except OSError:
+            try:
+                abandoned = now - os.path.getmtime(path) > BACKGROUND_TILE_STALE_BUILD_SECONDS
+            except OSError:
+                continue
+            if abandoned:
+                shutil.rmtree(path, ignore_errors=True)
+    finished.sort(reverse=True)
+    for _, path in finished[max(BACKGROUND_TILE_CACHE_KEEP - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def grid_step_for_scale(step: float, scale: float) -> float:
+    # Шаг сетки укрупняется по ряду 1-2-5-10-..., пока линии на экране не
+    # окажутся дальше GRID_MIN_SCREEN_SPACING_PX друг от друга.
+    if scale <= 0:
+        return step
+    decade = 1
+    while True:
+        for multiplier in GRID_STEP_MULTIPLIERS:
+            if step * multiplier * decade * scale >= GRID_MIN_SCREEN_SPACING_PX:
+                return step * multiplier * decade
+        decade *= 10
+
+
+def background_level_size(width: int, height: int, level: int) -> tuple[int, int]:
+    for _ in range(level):
+        width = max(1, (width + 1) // 2)
+        height = max(1, (height + 1) // 2)
+    return width, height
+
+
+class BackgroundTileBuilder(QThread):
+    # Строит уменьшенные уровни плана (1/2, 1/4, ...) и режет их на тайлы
+    # в дисковом кэше. Ключ кэша — CRC32 пикселей, поэтому повторное
+    # открытие того же плана пирамиду не перестраивает.
+    def __init__(self, image: QImage, level_count: int, cache_root: str, parent=None):
+        super().__init__(parent)
+        self.image = image
+        self.level_count = level_count
+        self.cache_root = cache_root
+        self.cache_dir = ""
+
+    def run(self):
+        image = self.image
+        width, height = image.width(), image.height()
+        cache_key = f"{zlib.crc32(image.constBits()) & 0xFFFFFFFF:08x}_{width}x{height}"
+        cache_dir = os.path.join(self.cache_root, cache_key)
+        index_path = os.path.join(cache_dir, "index.json")
+        if os.path.isfile(index_path):
+            try:
+                os.utime(index_path)
+            except OSError:
+                pass
+            self.cache_dir = cache_dir
+            prune_background_tile_cache(self.cache_root, cache_dir)
+            return
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            current = image
+            for level in range(1, self.level_count):
+                level_width, level_height = background_level_size(width, height, level)
+                current = current.scaled(level_width, level_height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+                for row in range(0, level_height, BACKGROUND_TILE_SIZE):
+                    for col in range(0, level_width, BACKGROUND_TILE_SIZE):
+                        if self.isInterruptionRequested():
+                            return
+                        tile = current.copy(col, row, BACKGROUND_TILE_SIZE, BACKGROUND_TILE_SIZE)
+                        tile_name = f"{level}_{col // BACKGROUND_TILE_SIZE}_{row // BACKGROUND_TILE_SIZE}.png"
+                        tile.save(os.path.join(cache_dir, tile_name), "PNG")
+            with open(index_path, "w", encoding="utf-8") as index_file:
+                json.dump({"width": width, "height": height, "levels": self.level_count, "tile": BACKGROUND_TILE_SIZE}, index_file)
+        except OSError:
+            return
+        self.cache_dir = cache_dir
+        prune_background_tile_cache(self.cache_root, cache_dir)
+
+
+class BackgroundTilePyramid:
+    # Уровень 0 — исходный план, который рисуется только в пределах
+    # видимой области; при отдалении используются тайлы уровня, близкого
+    # к текущему масштабу вида, подгружаемые с диска по мере необходимости.
+    def __init__(self, pixmap: QPixmap, scene):
+        self.source = pixmap
+        self.width = pixmap.width()
+        self.height = pixmap.height()
+        self.level_count = 1
+        level_width, level_height = self.width, self.height
+        while max(level_width, level_height) > BACKGROUND_TILE_SIZE:
+            level_width, level_height = background_level_size(level_width, level_height, 1)
+            self.level_count += 1
+        self.cache_dir = ""
+        self._tiles = {}
+        self._builder = None
+        cache_root = background_tile_cache_root()
+        if self.level_count > 1 and cache_root:
+            self._builder = BackgroundTileBuilder(pixmap.toImage(), self.level_count, cache_root, scene)
+            self._builder.finished.connect(scene._on_background_tiles_built)
+            self._builder.start()
+
+    def finish_build(self) -> bool:
+        builder = self._builder
+        if builder is None or not builder.isFinished():
+            return False
+        self._builder = None
+        self.cache_dir = builder.cache_dir
+        builder.deleteLater()
+        return bool(self.cache_dir)
+
+    def close(self):
+        if self._builder is not None:
+            self._builder.requestInterruption()
+            self._builder.wait()
+            self._builder.deleteLater()
+            self._builder = None
+        self._tiles.clear()
+
+    def _level_for_scale(self, scale: float) -> int:
+        if not self.cache_dir or scale <= 0 or scale >= 1:
+            return 0
+        return min(self.level_count - 1, int(math.floor(math.log2(1.0 / scale))))
+
+    def _tile(self, level: int, col: int, row: int):
+        key = (level, col, row)
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            tile = QPixmap(os.path.join(self.cache_dir, f"{level}_{col}_{row}.png"))
+            if tile.isNull():
+                return None
+            if len(self._tiles) >= BACKGROUND_TILE_MEMORY_LIMIT:
+                self._tiles.pop(next(iter(self._tiles)))
+        self._tiles[key] = tile
+        return tile
+
+    def draw(self, painter, rect: QRectF, scale: float):
+        exposed = rect.intersected(QRectF(0, 0, self.width, self.height))
+        if exposed.isEmpty():
+            return
+        level = self._level_for_scale(scale)
+        if level == 0:
+            painter.drawPixmap(exposed, self.source, exposed)
+            return
+        factor = 1 << level
+        span = BACKGROUND_TILE_SIZE * factor
+        for row in range(int(exposed.top() // span), int(exposed.bottom() // span) + 1):
+            for col in range(int(exposed.left() // span), int(exposed.right() // span) + 1):
+                tile_rect = QRectF(col * span, row * span, span, span).intersected(QRectF(0, 0, self.width, self.height))
+                tile = self._tile(level, col, row)
+                if tile is None:
+                    painter.drawPixmap(tile_rect, self.source, tile_rect)
+                    continue
+                painter.drawPixmap(
+                    QRectF(col * span, row * span, tile.width() * factor, tile.height() * factor),
+                    tile,
+                    QRectF(tile.rect()),
+                )
+
+
+def _zone_area(zone):
+    rect = zone.boundingRect()
+    return abs(rect.width() * rect.height())
+
+def _top_anchor(scene, pos):
+    if scene is None:
+        return None
+    # Точное попадание по форме якоря; возьмем верхний по Z, а при равном Z —
+    # добавленный на сцену позже, как в порядке наложения scene.items()
+    anchors = scene.spatial_index.items_at(pos, AnchorItem)
+    return max(anchors, key=lambda item: (item.zValue(), item.stacking_index)) if anchors else None
+
+def _hall_at(scene, pos):
+    if scene is None:
+        return None
+    halls = scene.spatial_index.items_at(pos, HallItem)
+    if not halls:
+        return None
+    order = scene.mainwindow.halls if scene.mainwindow else []
+    return min(halls, key=lambda hall: order.index(hall) if hall in order else len(order))
+
+def _smallest_zone(scene, pos, exclude=None, max_area=None):
+    if scene is None:
+        return None
+    best = None
+    best_area = None
+    for item in scene.spatial_index.items_at(pos, (RectZoneItem, ProximityZoneItem)):
+        if item is not exclude:
+            rect = item.boundingRect()
+            area = abs(rect.width() * rect.height())
+            if max_area is not None and area >= max_area:
+                continue
+            if best is None or area < best_area:
+                best = item
+                best_area = area
+    return best
 
 # ---------------------------------------------------------------------------
 # Custom view and scene
@@ -2185,6 +3113,14 @@ class PlanGraphicsScene(QGraphicsScene):
         self.mainwindow=None; self.pixmap=None
         self.pixel_per_cm_x=1.0; self.pixel_per_cm_y=1.0
         self.grid_step_cm=20.0; self.temp_item=None
+        self.background_tiles = None
+        self._grid_cache = None
+        self.spatial_index = SceneSpatialIndex()
+        self.moving_anchor_group = False
+
+    def clear(self):
+        self.spatial_index.clear()
+        super().clear()
 
     def set_background_image(self, pix):
         self.pixmap = pix
@@ -2192,25 +3128,64 @@ class PlanGraphicsScene(QGraphicsScene):
         if self.mainwindow:
             self.mainwindow._reset_background_cache()
 
+    def _background_pyramid(self):
+        if self.background_tiles is not None and self.background_tiles.source is not self.pixmap:
+            self.background_tiles.close()
+            self.background_tiles = None
+        if self.background_tiles is None and self.pixmap:
+            self.background_tiles = BackgroundTilePyramid(self.pixmap, self)
+        return self.background_tiles
+
+    def _on_background_tiles_built(self):
+        if self.background_tiles is not None and self.background_tiles.finish_build():
+            self.update()
+
     def drawBackground(self, painter, rect):
+        # В PDF, на печать и прочие не экранные устройства план выводится в
+        # полном разрешении, а сетка — с шагом, заданным в проекте.
+        device = painter.device()
+        on_screen = any(device is view.viewport() for view in self.views())
         if self.pixmap:
-            painter.drawPixmap(0, 0, self.pixmap)
+            scale = abs(painter.worldTransform().m11()) if on_screen else 1.0
+            self._background_pyramid().draw(painter, rect, scale)
         step = self.pixel_per_cm_x * self.grid_step_cm
         if step <= 0:
             return
-        left = int(rect.left()) - (int(rect.left()) % int(step))
-        top = int(rect.top()) - (int(rect.top()) % int(step))
-        right = int(rect.right()); bottom = int(rect.bottom())
+        if on_screen:
+            step = grid_step_for_scale(step, abs(painter.worldTransform().m11()))
+        vertical, horizontal, first_col, first_row = self._grid_lines(step, rect)
         pen = QPen(QColor(0,0,0,50)); pen.setWidth(0)
         painter.setPen(pen)
-        x = left
-        while x <= right:
-            painter.drawLine(x, top, x, bottom)
-            x += step
-        y = top
-        while y <= bottom:
-            painter.drawLine(left, y, right, y)
-            y += step
+        col_from = max(0, math.ceil(rect.left() / step) - first_col)
+        col_to = math.floor(rect.right() / step) - first_col + 1
+        row_from = max(0, math.ceil(rect.top() / step) - first_row)
+        row_to = math.floor(rect.bottom() / step) - first_row + 1
+        if col_to > col_from:
+            painter.drawLines(vertical[col_from:col_to])
+        if row_to > row_from:
+            painter.drawLines(horizontal[row_from:row_to])
+
+    def _grid_lines(self, step: float, rect: QRectF):
+        # Линии сетки строятся один раз на шаг и охватываемую область; кадр
+        # рисует только срез видимых линий одним вызовом drawLines.
+        cache = self._grid_cache
+        if cache is None or cache[0] != step or not cache[1].contains(rect):
+            extent = self.sceneRect().united(rect)
+            margin_x = extent.width() * 0.5
+            margin_y = extent.height() * 0.5
+            extent = extent.adjusted(-margin_x, -margin_y, margin_x, margin_y)
+            first_col = math.ceil(extent.left() / step)
+            first_row = math.ceil(extent.top() / step)
+            vertical = [
+                QLineF(col * step, extent.top(), col * step, extent.bottom())
+                for col in range(first_col, math.floor(extent.right() / step) + 1)
+            ]
+            horizontal = [
+                QLineF(extent.left(), row * step, extent.right(), row * step)
+                for row in range(first_row, math.floor(extent.bottom() / step) + 1)
+            ]
+            cache = self._grid_cache = (step, extent, vertical, horizontal, first_col, first_row)
+        return cache[2], cache[3], cache[4], cache[5]
 
     def finishCalibration(self, start, end):
         mw = self.mainwindow
@@ -2233,7 +3208,7 @@ class PlanGraphicsScene(QGraphicsScene):
             mw, "Шаг сетки", "Укажите шаг (см):", 10, 1, 1000
         )
         if ok: self.grid_step_cm = float(step)
-        mw.resnap_objects(); self.update()
+        mw.resnap_objects(); mw._refresh_scale_dependent_items()
         mw.push_undo_state(prev_state)
 
     def mousePressEvent(self, event):
@@ -2261,7 +3236,7 @@ class PlanGraphicsScene(QGraphicsScene):
                 return
             if m == "zone":
                 if not mw.temp_start_point:
-                    hall = next((h for h in mw.halls if h.contains(h.mapFromScene(pos))), None)
+                    hall = _hall_at(self, pos)
                     if not hall: return
                     mw.current_hall_for_zone = hall; mw.temp_start_point = pos
                     self.temp_item = QGraphicsRectItem()
@@ -2271,7 +3246,7 @@ class PlanGraphicsScene(QGraphicsScene):
                     self.temp_item.setRect(QRectF(pos, QSizeF(0,0)))
                 return
             if m == "anchor":
-                hall = next((h for h in mw.halls if h.contains(h.mapFromScene(pos))), None)
+                hall = _hall_at(self, pos)
                 if not hall:
                     QMessageBox.warning(mw, "Ошибка", "Не найден зал для якоря."); return
                 params = mw.get_anchor_parameters()
@@ -2388,7 +3363,7 @@ class PlanGraphicsScene(QGraphicsScene):
                 if self.temp_item: self.removeItem(self.temp_item); self.temp_item=None
                 mw.temp_start_point=None; mw.add_mode=None
                 return
-            prev_state = mw.capture_state()
+            prev_state = mw.capture_items_state([hall])
             num, zt, ang = params
             RectZoneItem(bl, w_pix, h_pix, num, zt, ang, hall)
             mw.last_selected_items=[]; mw.populate_tree()
@@ -2399,13 +3374,13 @@ class PlanGraphicsScene(QGraphicsScene):
 
         super().mouseReleaseEvent(event)
         try:
-            mw.populate_tree()
+            mw.refresh_tree_items()
             handled = False
             if (event.button() == Qt.LeftButton and mw and not mw.add_mode):
                 down = event.buttonDownScenePos(Qt.LeftButton) if hasattr(event, "buttonDownScenePos") else pos
                 diff = pos - down
                 if abs(diff.x()) < 2 and abs(diff.y()) < 2:
-                    items_at = [it for it in self.items(pos, Qt.IntersectsItemShape)
+                    items_at = [it for it in self.spatial_index.items_at(pos)
                                  if it.flags() & QGraphicsItem.ItemIsSelectable]
                     if items_at:
                         def item_area(it):
@@ -2416,7 +3391,7 @@ class PlanGraphicsScene(QGraphicsScene):
                             return abs(br.width()*br.height())
                         def priority(it):
                             return 0 if isinstance(it, (AnchorItem, RectZoneItem)) else 1
-                        chosen = min(items_at, key=lambda it: (item_area(it), priority(it)))
+                        chosen = min(items_at, key=lambda it: (item_area(it), priority(it), -it.zValue()))
                         if not (event.modifiers() & Qt.ControlModifier):
                             for selected in list(self.selectedItems()):
                                 if selected is not chosen:
@@ -2432,6 +3407,208 @@ class PlanGraphicsScene(QGraphicsScene):
                     mw.last_selected_items=[clicked]; mw.on_scene_selection_changed()
         except: pass
 
+# ---------------------------------------------------------------------------
+# Object tree
+# ---------------------------------------------------------------------------
+class ObjectTreeNode:
+    __slots__ = ("key", "kind", "ref", "parent", "children", "text")
+
+    def __init__(self, key, kind, ref, parent=None):
+        self.key, self.kind, self.ref, self.parent = key, kind, ref, parent
+        self.children = []
+        self.text = ""
+
+
+class ObjectTreeModel(QAbstractItemModel):
+    # Строки «Списка объектов» живут между обновлениями: sync() сверяет
+    # нужную структуру с текущей и сообщает представлению только о вставленных,
+    # удалённых, перемещённых и изменившихся строках, поэтому выделение и
+    # прокрутка не сбрасываются. Перемещённые на плане объекты помечаются
+    # через mark_dirty(), и refresh_dirty() пересчитывает только их строки.
+    def __init__(self, mainwindow):
+        super().__init__(mainwindow)
+        self.mainwindow = mainwindow
+        self._root = ObjectTreeNode(None, "root", None)
+        self._nodes_by_ref = {}
+        self._dirty = set()
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = parent.internalPointer() if parent.isValid() else self._root
+        if column != 0 or row < 0 or row >= len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, 0, node.children[row])
+
+    def parent(self, index=None):
+        if index is None:
+            return QObject.parent(self)
+        if not index.isValid():
+            return QModelIndex()
+        return self._node_index(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        node = parent.internalPointer() if parent.isValid() else self._root
+        return len(node.children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.text
+        if role == Qt.UserRole:
+            return {"type": node.kind, "ref": node.ref}
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section == 0:
+            return "Объекты"
+        return None
+
+    def _node_index(self, node) -> QModelIndex:
+        if node is None or node is self._root:
+            return QModelIndex()
+        return self.createIndex(node.parent.children.index(node), 0, node)
+
+    def index_for_ref(self, ref) -> QModelIndex:
+        nodes = self._nodes_by_ref.get(ref)
+        return self._node_index(nodes[0]) if nodes else QModelIndex()
+
+    def mark_dirty(self, ref):
+        self._dirty.add(ref)
+
+    def sync(self, halls, anchors, proximity_zones):
+        anchors_by_hall = {}
+        for a in anchors:
+            for num in dict.fromkeys([a.main_hall_number, *a.extra_halls]):
+                anchors_by_hall.setdefault(num, []).append(a)
+        proximity_by_hall = {}
+        for z in proximity_zones:
+            zone_halls = z.halls or ([z.anchor.main_hall_number] if z.anchor else [])
+            for num in dict.fromkeys(zone_halls):
+                proximity_by_hall.setdefault(num, []).append(z)
+
+        self._reconcile(self._root, [(("hall", h), "hall", h) for h in halls])
+        for hall_node in self._root.children:
+            hall = hall_node.ref
+            entries = [(("anchor", a), "anchor", a) for a in anchors_by_hall.get(hall.number, ())]
+            entries += [(("proximity_zone", z), "proximity_zone", z) for z in proximity_by_hall.get(hall.number, ())]
+            zones_by_num = {}
+            for ch in hall.childItems():
+                if isinstance(ch, RectZoneItem):
+                    zones_by_num.setdefault(ch.zone_num, []).append(ch)
+            entries += [(("zone_group", num), "zone_group", zlist) for num, zlist in zones_by_num.items()]
+            self._reconcile(hall_node, entries)
+
+        self._nodes_by_ref = {}
+        for hall_node in self._root.children:
+            self._nodes_by_ref.setdefault(hall_node.ref, []).append(hall_node)
+            self._update_text(hall_node)
+            for node in hall_node.children:
+                for ref in (node.ref if node.kind == "zone_group" else [node.ref]):
+                    self._nodes_by_ref.setdefault(ref, []).append(node)
+                self._update_text(node)
+        self._dirty.clear()
+
+    def refresh_dirty(self):
+        dirty, self._dirty = self._dirty, set()
+        nodes = {}
+        for ref in dirty:
+            for node in self._nodes_by_ref.get(ref, ()):
+                nodes[id(node)] = node
+                if node.kind == "hall":
+                    # Координаты якорей и зон считаются от угла зала
+                    nodes.update((id(child), child) for child in node.children)
+        for node in nodes.values():
+            self._update_text(node)
+
+    def _reconcile(self, parent_node, entries):
+        parent_index = self._node_index(parent_node)
+        children = parent_node.children
+        wanted = {key for key, _, _ in entries}
+        row = 0
+        while row < len(children):
+            if children[row].key in wanted:
+                row += 1
+                continue
+            end = row
+            while end + 1 < len(children) and children[end + 1].key not in wanted:
+                end += 1
+            self.beginRemoveRows(parent_index, row, end)
+            del children[row:end + 1]
+            self.endRemoveRows()
+        for row, (key, kind, ref) in enumerate(entries):
+            if row < len(children) and children[row].key == key:
+                children[row].ref = ref
+                continue
+            current = next((i for i in range(row + 1, len(children)) if children[i].key == key), None)
+            if current is not None:
+                self.beginMoveRows(parent_index, current, current, parent_index, row)
+                children.insert(row, children.pop(current))
+                self.endMoveRows()
+                children[row].ref = ref
+            else:
+                self.beginInsertRows(parent_index, row, row)
+                children.insert(row, ObjectTreeNode(key, kind, ref, parent_node))
+                self.endInsertRows()
+
+    def _update_text(self, node):
+        text = self._node_text(node)
+        if text != node.text:
+            node.text = text
+            index = self._node_index(node)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def _node_text(self, node) -> str:
+        ppm = self.mainwindow.scene.pixel_per_cm_x * 100
+        if node.kind == "hall":
+            h = node.ref
+            wm = h.rect().width()/ppm
+            hm = h.rect().height()/ppm
+            return (f'Зал {h.number} "{h.name}" ({wm:.1f} x {hm:.1f} м)'
+                    if h.name.strip() else f'Зал {h.number} ({wm:.1f} x {hm:.1f} м)')
+        if node.kind == "anchor":
+            a, h = node.ref, node.parent.ref
+            lp = h.mapFromScene(a.scenePos())
+            xm = fix_negative_zero(round(lp.x()/ppm,1))
+            ym = fix_negative_zero(round((h.rect().height()-lp.y())/ppm,1))
+            at = f'Якорь {a.number} (x={xm} м, y={ym} м, z={fix_negative_zero(round(a.z/100,1))} м)'
+            if a.start:
+                at += " [стартовый]"
+            return at
+        if node.kind == "proximity_zone":
+            z = node.ref
+            info = f"Зона {z.zone_num} (якорь {z.anchor.number}, вход {z.dist_in} м, выход {z.dist_out} м)"
+            if z.bound:
+                info += " [переходная]"
+            if z.blacklist:
+                info += f"; ЧС: {', '.join(str(x) for x in z.blacklist)}"
+            return info
+        default = {"x":0,"y":0,"w":0,"h":0,"angle":0}
+        enter = default.copy(); exitz = default.copy()
+        for z in node.ref:
+            data = z.get_export_data()
+            if z.zone_type in ("Входная зона","Переходная"):
+                enter = data
+            if z.zone_type == "Выходная зона":
+                exitz = data
+        return (f"Зона {node.key[1]}: enter: x = {enter['x']} м, y = {enter['y']} м, "
+                f"w = {enter['w']} м, h = {enter['h']} м, angle = {enter['angle']}°; "
+                f"exit: x = {exitz['x']} м, y = {exitz['y']} м, "
+                f"w = {exitz['w']} м, h = {exitz['h']} м, angle = {exitz['angle']}°")
+
+
+def mark_tree_dirty(item):
+    mainwindow = getattr(item.scene(), "mainwindow", None)
+    model = getattr(mainwindow, "object_tree_model", None)
+    if model is not None:
+        model.mark_dirty(item)
+
+
 # ---------------------------------------------------------------------------
 # Main window
 # ---------------------------------------------------------------------------
@@ -2460,7 +3637,8 @@ class PlanEditorMainWindow(QMainWindow):
         self.scene.selectionChanged.connect(self.on_scene_selection_changed)
         self.view = MyGraphicsView(self.scene)
         self.view.setRenderHint(QPainter.Antialiasing)
-        self.view.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+        self.view.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
+        QPixmapCache.setCacheLimit(max(QPixmapCache.cacheLimit(), ITEM_PIXMAP_CACHE_LIMIT_KB))
 
         central_widget = QWidget()
         central_widget.setObjectName("centralContainer")
@@ -2492,11 +3670,13 @@ class PlanEditorMainWindow(QMainWindow):
         central_layout.addWidget(central_frame)
         self.setCentralWidget(central_widget)
 
-        self.tree = QTreeWidget(); self.tree.setHeaderLabel("Объекты"); self.tree.setWordWrap(True)
+        self.object_tree_model = ObjectTreeModel(self)
+        self.object_tree_model.rowsInserted.connect(self._expand_inserted_halls)
+        self.tree = QTreeView(); self.tree.setModel(self.object_tree_model); self.tree.setWordWrap(True)
         self.tree.setContextMenuPolicy(Qt.CustomContextMenu)
         self.tree.customContextMenuRequested.connect(self.on_tree_context_menu)
-        self.tree.itemDoubleClicked.connect(self.on_tree_item_double_clicked)
-        self.tree.itemSelectionChanged.connect(self._update_hall_order_buttons)
+        self.tree.doubleClicked.connect(self.on_tree_item_double_clicked)
+        self.tree.selectionModel().selectionChanged.connect(lambda *_: self._update_hall_order_buttons())
 
         dock_container = QWidget()
         dock_container.setObjectName("dockContainer")
@@ -2533,7 +3713,7 @@ class PlanEditorMainWindow(QMainWindow):
             QWidget#dockFrame > * {
                 background-color: transparent;
             }
-            QTreeWidget {
+            QTreeView {
                 background-color: transparent;
             }
             """
@@ -2572,7 +3752,7 @@ class PlanEditorMainWindow(QMainWindow):
             QWidget#tracksDockFrame > * {
                 background-color: transparent;
             }
-            QTreeWidget {
+            QTreeView {
                 background-color: transparent;
             }
             """
@@ -2598,17 +3778,31 @@ class PlanEditorMainWindow(QMainWindow):
         self.add_mode = None; self.temp_start_point = None
         self.current_hall_for_zone = None
         self.halls = []; self.anchors = []; self.proximity_zones = []
+        self._hall_anchor_index = None
         self.grid_calibrated = False
         self.lock_halls = False; self.lock_zones = False; self.lock_anchors = False
         self.last_selected_items = []
+        self._human_height_cm_cache = None
+        self._system_configs = SystemConfigStore(self)
+        self._system_configs.changed.connect(self._on_system_config_changed)
+        self._content_languages = ContentLanguageIndex(self)
+        self._content_languages.changed.connect(self.tracks_panel.languages_changed)
         self.current_project_file = None
         self.unmatched_audio_files = {}
         self.undo_stack = []
-        self._undo_limit = 30
+        self._undo_stack_bytes = 0
+        self._undo_memory_limit = UNDO_MEMORY_LIMIT_BYTES
+        self._undo_uid_seq = 0
         self._restoring_state = False
         self._undo_bg_cache_key = None
         self._undo_bg_image = ""
-        self._saved_state_snapshot = None
+        self._background_image_source = None
+        self._revision = 0
+        self._revision_seq = 0
+        self._saved_revision = None
+        self._audio_cache = None
+        self._export_cache = ExportCache()
+        self._ssh_sessions = SshSessionManager()
 
         self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
         self.view.setDragMode(QGraphicsView.NoDrag)
@@ -2652,16 +3846,7 @@ class PlanEditorMainWindow(QMainWindow):
 
     @staticmethod
     def _sanitize_name_for_folder(name: str) -> str:
-        sanitized_chars = []
-        for ch in name:
-            if ch in ("/", "\\", ":", "*", "?", '"', "<", ">", "|"):
-                sanitized_chars.append("_")
-            elif ch.isspace():
-                sanitized_chars.append("_")
-            else:
-                sanitized_chars.append(ch)
-        sanitized = "".join(sanitized_chars).strip("_")
-        return sanitized
+        return sanitize_name_for_folder(name)
 
     def _build_remote_export_folder_name(self) -> str:
         timestamp = datetime.now().strftime("%y%m%d_%H%M")
@@ -2682,23 +3867,12 @@ class PlanEditorMainWindow(QMainWindow):
         base_title = "RG Tags Mapper"
         name = self.project_name.strip()
         if name:
-            self.setWindowTitle(f"{base_title} — {name}")
+            self.setWindowTitle(f"{base_title} — {name}[*]")
         else:
-            self.setWindowTitle(base_title)
-    def _ensure_project_paths(self, project_file: str):
-        project_file_abs = os.path.abspath(project_file)
-        project_dir = os.path.dirname(project_file_abs)
-        project_base_name = os.path.splitext(os.path.basename(project_file_abs))[0]
-        project_folder_name = self._sanitize_name_for_folder(project_base_name) or project_base_name
-        root_dir = os.path.join(project_dir, project_folder_name)
-        content_dir = os.path.join(root_dir, "content")
+            self.setWindowTitle(f"{base_title}[*]")
 
-        os.makedirs(project_dir, exist_ok=True)
-        os.makedirs(root_dir, exist_ok=True)
-        os.makedirs(content_dir, exist_ok=True)
-
-        self.project_root_dir = root_dir
-        self.project_content_dir = content_dir
+    def _ensure_project_paths(self, project_file: str):
+        self.project_root_dir, self.project_content_dir = ensure_project_layout(project_file)
 
     def _ensure_project_layout_for_current_file(self):
         if not self.current_project_file:
@@ -2714,11 +3888,7 @@ class PlanEditorMainWindow(QMainWindow):
         if self.project_root_dir and os.path.isdir(self.project_root_dir):
             return self.project_root_dir
         if self.current_project_file:
-            project_file_abs = os.path.abspath(self.current_project_file)
-            project_dir = os.path.dirname(project_file_abs)
-            project_base_name = os.path.splitext(os.path.basename(project_file_abs))[0]
-            project_folder_name = self._sanitize_name_for_folder(project_base_name) or project_base_name
-            return os.path.join(project_dir, project_folder_name)
+            return project_layout(self.current_project_file)[0]
         return None
 
     def _get_effective_content_dir(self):
@@ -2732,9 +3902,17 @@ class PlanEditorMainWindow(QMainWindow):
     def _rooms_json_path(self):
         if not self.current_project_file:
             return None
-        project_file_abs = os.path.abspath(self.current_project_file)
-        project_dir = os.path.dirname(project_file_abs)
-        return os.path.join(project_dir, "rooms.json")
+        return rooms_json_path(self.current_project_file)
+
+    @property
+    def current_project_file(self):
+        return self._current_project_file
+
+    @current_project_file.setter
+    def current_project_file(self, value):
+        # Кэш системных конфигов и watcher всегда смотрят на папку текущего проекта.
+        self._current_project_file = value
+        self._system_configs.set_config_dir(self._system_config_dir())
 
     def _system_config_dir(self):
         if not self.current_project_file:
@@ -2754,14 +3932,7 @@ class PlanEditorMainWindow(QMainWindow):
         return {filename: os.path.join(config_dir, filename) for filename in SYSTEM_CONFIG_FILENAMES}
 
     def _project_label_for_configs(self) -> str:
-        project_name = getattr(self, "project_name", "")
-        if isinstance(project_name, str) and project_name.strip():
-            return project_name.strip()
-        if self.current_project_file:
-            base_name = os.path.splitext(os.path.basename(self.current_project_file))[0]
-            if base_name:
-                return base_name
-        return "project"
+        return project_config_label(getattr(self, "project_name", ""), self.current_project_file)
 
     def _default_system_configs(self) -> dict[str, dict]:
         project_label = self._project_label_for_configs()
@@ -2834,12 +4005,13 @@ class PlanEditorMainWindow(QMainWindow):
         if not key_path:
             key_path = find_default_ssh_key(app_root) or find_default_ssh_key(os.getcwd()) or ""
         return {
-            "host": "178.154.195.218",
-            "username": "radiog",
+            "host": DEFAULT_SERVER_HOST,
+            "username": DEFAULT_SERVER_USERNAME,
             "remote_dir": DEFAULT_REMOTE_PROJECTS_DIR,
-            "port": 26015,
+            "port": DEFAULT_SERVER_PORT,
             "key_path": key_path,
             "passphrase": "",
+            "transfer_channels": DEFAULT_TRANSFER_CHANNELS,
         }
 
     def _load_server_connection_settings(self) -> dict:
@@ -2852,6 +4024,7 @@ class PlanEditorMainWindow(QMainWindow):
             "port": int(settings.value("server/port", defaults["port"]) or defaults["port"]),
             "key_path": str(settings.value("server/key_path", defaults["key_path"]) or "").strip(),
             "passphrase": str(settings.value("server/passphrase", defaults["passphrase"]) or ""),
+            "transfer_channels": int(settings.value("server/transfer_channels", defaults["transfer_channels"]) or defaults["transfer_channels"]),
         }
 
     def _save_server_connection_settings(self, values: dict):
@@ -2862,6 +4035,7 @@ class PlanEditorMainWindow(QMainWindow):
         settings.setValue("server/port", int(values.get("port", 26015) or 26015))
         settings.setValue("server/key_path", values.get("key_path", ""))
         settings.setValue("server/passphrase", values.get("passphrase", ""))
+        settings.setValue("server/transfer_channels", int(values.get("transfer_channels", DEFAULT_TRANSFER_CHANNELS) or DEFAULT_TRANSFER_CHANNELS))
 
     def show_app_settings_dialog(self):
         current = self._load_server_connection_settings()
@@ -2921,6 +4095,11 @@ class PlanEditorMainWindow(QMainWindow):
         key_layout.addWidget(browse_button)
         form_layout.addRow("Файл ключа:", key_widget)
 
+        channels_spin = QSpinBox(group)
+        channels_spin.setRange(1, 16)
+        channels_spin.setValue(int(current["transfer_channels"] or DEFAULT_TRANSFER_CHANNELS))
+        form_layout.addRow("Параллельных каналов:", channels_spin)
+
         layout.addWidget(group)
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, dialog)
         buttons.accepted.connect(dialog.accept)
@@ -2937,6 +4116,7 @@ class PlanEditorMainWindow(QMainWindow):
             "port": port_spin.value(),
             "key_path": key_path_edit.text().strip(),
             "passphrase": password_edit.text(),
+            "transfer_channels": channels_spin.value(),
         }
         self._save_server_connection_settings(values)
         self.statusBar().showMessage("Настройки приложения сохранены.", 5000)
@@ -2960,31 +4140,50 @@ class PlanEditorMainWindow(QMainWindow):
         return values
 
     def _load_server_private_key(self, key_path: str, passphrase: str | None, title: str):
+        key_obj = self._ssh_sessions.cached_key(key_path, passphrase)
+        if key_obj is not None:
+            return key_obj
         try:
-            if key_path.lower().endswith(".ppk"):
-                import importlib.util
-                if importlib.util.find_spec("paramiko.ppk") is not None:
-                    from paramiko.ppk import PPKKey as _PPKKey
-                    return _PPKKey.from_file(key_path, password=passphrase)
-                if importlib.util.find_spec("paramiko_ppk") is not None:
-                    from paramiko_ppk import PPKKey as _PPKKey  # type: ignore
-                    return _PPKKey.from_file(key_path, password=passphrase)
-                raise ModuleNotFoundError("Поддержка ключей PPK недоступна. Установите пакет paramiko-ppk.")
-            return paramiko.RSAKey.from_private_key_file(key_path, password=passphrase)
+            key_obj = load_private_key(key_path, passphrase)
         except Exception as exc:
             QMessageBox.critical(self, title, f"Не удалось загрузить SSH-ключ:\n{exc}")
             return None
+        self._ssh_sessions.remember_key(key_path, passphrase, key_obj)
+        return key_obj
 
     def _load_system_config(self, filename: str):
-        path = self._system_config_path(filename)
-        if not path or not os.path.isfile(path):
-            return None
+        data = self._system_configs.get(filename)
+        return copy.deepcopy(data) if data is not None else None
+
+    def _read_project_human_height_cm(self) -> float:
+        settings_data = self._system_configs.get("settings.json")
+        coord_sp = settings_data.get("coord_sp") if isinstance(settings_data, dict) else None
+        if not isinstance(coord_sp, dict):
+            return DEFAULT_HUMAN_HEIGHT_CM
         try:
-            with open(path, "r", encoding="utf-8") as config_file:
-                data = json.load(config_file)
-        except Exception:
-            return None
-        return data if isinstance(data, dict) else None
+            return float(coord_sp.get("human_height", DEFAULT_HUMAN_HEIGHT_CM))
+        except (TypeError, ValueError):
+            return DEFAULT_HUMAN_HEIGHT_CM
+
+    def _project_human_height_cm(self) -> float:
+        # Вызывается из boundingRect()/paint() каждой зоны приближения, поэтому
+        # значение держится в памяти до сигнала об изменении settings.json.
+        if self._human_height_cm_cache is None:
+            self._human_height_cm_cache = self._read_project_human_height_cm()
+        return self._human_height_cm_cache
+
+    def _on_system_config_changed(self, filename: str):
+        if filename != "settings.json" or self._human_height_cm_cache is None:
+            return
+        human_height = self._read_project_human_height_cm()
+        if human_height == self._human_height_cm_cache:
+            return
+        for zone in self.proximity_zones:
+            zone.prepareGeometryChange()
+        self._human_height_cm_cache = human_height
+        for zone in self.proximity_zones:
+            zone.update()
+        self.scene.update()
 
     def _load_existing_system_configs(self) -> dict[str, dict]:
         configs = {}
@@ -3009,6 +4208,7 @@ class PlanEditorMainWindow(QMainWindow):
                 path = os.path.join(config_dir, filename)
                 with open(path, "w", encoding="utf-8") as config_file:
                     json.dump(data, config_file, ensure_ascii=False, indent=4)
+                self._system_configs.store(filename, data)
         except Exception as exc:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить настройки проекта:\n{exc}")
             return False
@@ -3044,9 +4244,9 @@ class PlanEditorMainWindow(QMainWindow):
         content_dir = self._get_effective_content_dir()
         if not content_dir:
             return None
-        return os.path.join(content_dir, "tracks.json")
+        return tracks_json_path(content_dir)
 
-    def _write_auxiliary_configs(self, rooms_json_text: str, tracks_data: dict):
+    def _write_auxiliary_configs(self, rooms: list[ExportRoom], tracks_data: dict):
         if not self._ensure_project_layout_for_current_file():
             return False
         rooms_path = self._rooms_json_path()
@@ -3054,11 +4254,9 @@ class PlanEditorMainWindow(QMainWindow):
         if not rooms_path or not tracks_path:
             return False
         self._recalculate_tracks_files_metadata(tracks_data)
+        self._audio_metadata_cache().save()
         try:
-            with open(rooms_path, "w", encoding="utf-8") as rooms_file:
-                rooms_file.write(rooms_json_text)
-            with open(tracks_path, "w", encoding="utf-8") as tracks_file:
-                json.dump(tracks_data, tracks_file, ensure_ascii=False, indent=4)
+            write_auxiliary_configs(rooms_path, tracks_path, rooms, tracks_data, self._export_cache)
         except Exception as exc:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить rooms/tracks:\n{exc}")
             return False
@@ -3067,11 +4265,11 @@ class PlanEditorMainWindow(QMainWindow):
     def _sync_auxiliary_configs_from_current_state(self, show_errors: bool = True) -> bool:
         if not self.current_project_file:
             return False
-        rooms_json_text, tracks_data = self._prepare_export_payload()
+        rooms, tracks_data = self._prepare_export_payload()
         self._merge_unmatched_audio_files_into_tracks_data(tracks_data)
         self._merge_language_audio_files_into_tracks_data(tracks_data)
         self._merge_existing_tracks_metadata(tracks_data)
-        if self._write_auxiliary_configs(rooms_json_text, tracks_data):
+        if self._write_auxiliary_configs(rooms, tracks_data):
             return True
         if not show_errors:
             self.statusBar().showMessage("Не удалось синхронизировать rooms/tracks с текущим состоянием проекта.", 5000)
@@ -3083,8 +4281,7 @@ class PlanEditorMainWindow(QMainWindow):
         data = self._collect_project_data()
         try:
             self._ensure_project_paths(self.current_project_file)
-            with open(self.current_project_file, "w", encoding="utf-8") as project_file:
-                json.dump(data, project_file, ensure_ascii=False, indent=4)
+            write_project_file(self.current_project_file, data, self._background_image_bytes())
         except Exception as exc:
             if show_errors:
                 QMessageBox.critical(self, "Ошибка", f"Не удалось синхронизировать файл проекта:\n{exc}")
@@ -3150,148 +4347,88 @@ class PlanEditorMainWindow(QMainWindow):
                 results.append(full_path)
         return results
 
-    @staticmethod
-    def _read_audio_file_metadata(file_path: str) -> dict:
-        try:
-            size_bytes = os.path.getsize(file_path)
-        except OSError:
-            size_bytes = 0
-
-        crc = 0
-        crc32_hex = ""
-        try:
-            with open(file_path, "rb") as file_handle:
-                while True:
-                    chunk = file_handle.read(4096)
-                    if not chunk:
-                        break
-                    crc = zlib.crc32(chunk, crc)
-            crc32_hex = f"{crc & 0xFFFFFFFF:08x}"
-        except OSError:
-            crc32_hex = ""
-
-        return {
-            "size": int(max(size_bytes, 0)),
-            "crc32": crc32_hex,
-        }
-
-    def _collect_language_audio_files(self) -> tuple[list[str], dict[str, dict]]:
-        content_dir = self._get_effective_content_dir()
-        if not content_dir or not os.path.isdir(content_dir):
-            return [], {}
-
-        langs: list[str] = []
-        files: dict[str, dict] = {}
-        for lang_name in sorted(os.listdir(content_dir)):
-            if not lang_name or lang_name.startswith("."):
-                continue
-            lang_dir = os.path.join(content_dir, lang_name)
-            if not os.path.isdir(lang_dir):
-                continue
-
-            has_audio = False
-            for entry in sorted(os.listdir(lang_dir)):
-                if not entry.lower().endswith(".mp3"):
-                    continue
-                full_path = os.path.join(lang_dir, entry)
-                if not os.path.isfile(full_path):
-                    continue
+    def _audio_metadata_cache_path(self):
+        if not self.current_project_file:
+            return None
+        return audio_metadata_cache_path(self.current_project_file)
 
-                relative_name = f"{lang_name}/{entry}"
-                metadata = self._read_audio_file_metadata(full_path)
-                files[relative_name] = {
-                    "name": relative_name,
-                    "size": metadata["size"],
-                    "crc32": metadata["crc32"],
-                }
-                has_audio = True
+    def _audio_metadata_cache(self) -> AudioMetadataCache:
+        cache_path = self._audio_metadata_cache_path()
+        if self._audio_cache is None or self._audio_cache.cache_path != cache_path:
+            if self._audio_cache is not None:
+                self._audio_cache.save()
+            self._audio_cache = AudioMetadataCache(cache_path)
+        return self._audio_cache
 
-            if has_audio:
-                langs.append(lang_name)
+    def _read_audio_file_metadata(self, file_path: str) -> dict:
+        return self._audio_metadata_cache().file_metadata(file_path)
 
-        return langs, files
+    def _iter_language_audio_files(self) -> list[tuple[str, str, str]]:
+        return iter_language_audio_files(self._get_effective_content_dir())
 
-    def _languages_for_audio_filename(self, filename: str) -> list[str]:
-        content_dir = self._get_effective_content_dir()
-        if not content_dir or not os.path.isdir(content_dir):
-            return []
+    def _collect_language_audio_files(self) -> tuple[list[str], dict[str, dict]]:
+        return collect_language_audio_files(self._get_effective_content_dir(), self._audio_metadata_cache())
+
+    def _scan_audio_files(self, audio_paths: list[str], crc_only_paths: list[str], title: str) -> dict[str, dict] | None:
+        # MP3 разбираются и хэшируются в пуле потоков; GUI-поток только
+        # обновляет прогресс и собирает результаты. None — скан отменён.
+        cache = self._audio_metadata_cache()
+        total = len(audio_paths) + len(crc_only_paths)
+        results: dict[str, dict] = {}
+        if total == 0:
+            return results
+
+        def scan_audio(path: str):
+            try:
+                return load_audio_file_info(path, cache)
+            except ValueError:
+                return None
 
-        audio_name = os.path.basename(str(filename or "").replace("\\", "/"))
-        if not audio_name:
-            return []
+        def scan_crc(path: str):
+            return cache.file_metadata(path)
+
+        progress_dialog = QProgressDialog("Сканирование аудио...", "Отмена", 0, total, self)
+        progress_dialog.setWindowTitle(title)
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+        progress_dialog.setValue(0)
+        executor = ThreadPoolExecutor(max_workers=AUDIO_SCAN_WORKERS)
+        try:
+            pending = {executor.submit(scan_audio, path): path for path in audio_paths}
+            pending.update({executor.submit(scan_crc, path): path for path in crc_only_paths})
+            done_count = 0
+            while pending:
+                if progress_dialog.wasCanceled():
+                    return None
+                done, _ = wait(list(pending), timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    info = future.result()
+                    if info is not None:
+                        results[path] = info
+                    done_count += 1
+                if done:
+                    progress_dialog.setValue(done_count)
+                    progress_dialog.setLabelText(f"Обработано файлов: {done_count} из {total}")
+                QApplication.processEvents()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            progress_dialog.close()
+        return results
 
-        langs: list[str] = []
-        for lang_name in sorted(os.listdir(content_dir)):
-            if not lang_name or lang_name.startswith("."):
-                continue
-            lang_dir = os.path.join(content_dir, lang_name)
-            if not os.path.isdir(lang_dir):
-                continue
-            if os.path.isfile(os.path.join(lang_dir, audio_name)):
-                langs.append(lang_name)
-        return langs
+    def _content_language_index(self) -> ContentLanguageIndex:
+        # Индекс сам следит за изменениями внутри content/; здесь лишь
+        # переключаем его на актуальный каталог, если тот сменился или появился.
+        self._content_languages.set_content_dir(self._get_effective_content_dir())
+        return self._content_languages
 
     def _merge_language_audio_files_into_tracks_data(self, tracks_data: dict):
-        if not isinstance(tracks_data, dict):
-            return
-
-        langs, language_files = self._collect_language_audio_files()
-        tracks_data["langs"] = langs
-
-        files_index = {
-            str(item.get("name", "")): item
-            for item in tracks_data.get("files", [])
-            if isinstance(item, dict) and item.get("name")
-        }
-        for name, meta in language_files.items():
-            existing = files_index.get(name)
-            if existing is None:
-                files_index[name] = meta
-                continue
-            existing["size"] = int(meta.get("size", 0))
-            existing["crc32"] = str(meta.get("crc32", "") or "")
-
-        tracks_data["files"] = [files_index[name] for name in sorted(files_index)]
+        merge_language_audio_files(tracks_data, self._get_effective_content_dir(), self._audio_metadata_cache())
 
     def _recalculate_tracks_files_metadata(self, tracks_data: dict):
-        if not isinstance(tracks_data, dict):
-            return
-        files_section = tracks_data.get("files")
-        if not isinstance(files_section, list):
-            return
-        content_dir = self._get_effective_content_dir()
-        if not content_dir or not os.path.isdir(content_dir):
-            return
-
-        for entry in files_section:
-            if not isinstance(entry, dict):
-                continue
-            name = entry.get("name")
-            if not isinstance(name, str) or not name:
-                continue
-            file_path = os.path.join(content_dir, name)
-            if not os.path.isfile(file_path):
-                continue
-
-            try:
-                size_bytes = os.path.getsize(file_path)
-            except OSError:
-                continue
-
-            crc = 0
-            try:
-                with open(file_path, "rb") as file_handle:
-                    while True:
-                        chunk = file_handle.read(4096)
-                        if not chunk:
-                            break
-                        crc = zlib.crc32(chunk, crc)
-            except OSError:
-                continue
-
-            entry["size"] = int(max(size_bytes, 0))
-            entry["crc32"] = f"{crc & 0xFFFFFFFF:08x}"
-
+        recalculate_tracks_files_metadata(tracks_data, self._get_effective_content_dir(), self._audio_metadata_cache())
 
     def _create_actions(self):
         def load_icon(filename: str, fallback: QStyle.StandardPixmap | None = None):
@@ -3727,6 +4864,37 @@ class PlanEditorMainWindow(QMainWindow):
         self._undo_bg_cache_key = None
         self._undo_bg_image = ""
 
+    def _undo_uid(self, item):
+        uid = getattr(item, "_undo_uid", None)
+        if uid is None:
+            self._undo_uid_seq += 1
+            uid = self._undo_uid_seq
+            item._undo_uid = uid
+        return uid
+
+    def _assign_undo_uid(self, item, uid):
+        if isinstance(uid, int):
+            item._undo_uid = uid
+            self._undo_uid_seq = max(self._undo_uid_seq, uid)
+        else:
+            self._undo_uid(item)
+
+    @staticmethod
+    def _hall_zone_states(hall):
+        zones = []
+        for child in hall.childItems():
+            if isinstance(child, RectZoneItem):
+                zones.append({
+                    "zone_num": child.zone_num,
+                    "zone_type": child.zone_type,
+                    "zone_angle": child.zone_angle,
+                    "bottom_left_x": child.pos().x(),
+                    "bottom_left_y": child.pos().y(),
+                    "w_px": child.rect().width(),
+                    "h_px": child.rect().height()
+                })
+        return zones
+
     def capture_state(self):
         data = {
             "image_data": "",
@@ -3751,196 +4919,446 @@ class PlanEditorMainWindow(QMainWindow):
             if self._undo_bg_cache_key == cache_key and self._undo_bg_image:
                 data["image_data"] = self._undo_bg_image
             else:
-                buf = QBuffer(); buf.open(QBuffer.WriteOnly)
-                self.scene.pixmap.save(buf, "PNG")
-                encoded = buf.data().toBase64().data().decode()
+                encoded = QByteArray(self._background_image_bytes()).toBase64().data().decode()
                 data["image_data"] = encoded
                 self._undo_bg_cache_key = cache_key
                 self._undo_bg_image = encoded
         else:
             self._reset_background_cache()
-        for hall in self.halls:
-            hall_data = {
-                "num": hall.number,
-                "name": hall.name,
-                "x_px": hall.pos().x(),
-                "y_px": hall.pos().y(),
-                "w_px": hall.rect().width(),
-                "h_px": hall.rect().height(),
-                "audio": copy.deepcopy(hall.audio_settings) if hall.audio_settings else None,
-                "extra_tracks": list(hall.extra_tracks),
-                "zone_audio": {str(k): copy.deepcopy(v) for k, v in hall.zone_audio_tracks.items()}
-            }
-            zones = []
-            for child in hall.childItems():
-                if isinstance(child, RectZoneItem):
-                    zones.append({
-                        "zone_num": child.zone_num,
-                        "zone_type": child.zone_type,
-                        "zone_angle": child.zone_angle,
-                        "bottom_left_x": child.pos().x(),
-                        "bottom_left_y": child.pos().y(),
-                        "w_px": child.rect().width(),
-                        "h_px": child.rect().height()
-                    })
-            hall_data["zones"] = zones
-            data["halls"].append(hall_data)
-        for anchor in self.anchors:
-            anchor_data = {
-                "number": anchor.number,
-                "z": anchor.z,
-                "x": anchor.scenePos().x(),
-                "y": anchor.scenePos().y(),
-                "main_hall": anchor.main_hall_number,
-                "extra_halls": list(anchor.extra_halls),
-                "bound": anchor.bound_explicit
-            }
-            if anchor.start:
-                anchor_data["start"] = True
-            data["anchors"].append(anchor_data)
-        for zone in self.proximity_zones:
-            zone_data = {
-                "zone_num": zone.zone_num,
-                "anchor_id": zone.anchor.number,
-                "dist_in": zone.dist_in,
-                "dist_out": zone.dist_out,
-                "bound": zone.bound,
-                "halls": list(zone.halls),
-                "blacklist": list(zone.blacklist),
-                "audio": copy.deepcopy(zone.audio_info) if zone.audio_info else None,
-            }
-            data["proximity_zones"].append(zone_data)
+        data["halls"] = [self._hall_undo_state(hall) for hall in self.halls]
+        data["anchors"] = [self._anchor_undo_state(anchor) for anchor in self.anchors]
+        data["proximity_zones"] = [self._proximity_zone_undo_state(zone) for zone in self.proximity_zones]
         return data
 
-    def restore_state(self, state):
-        if not state:
-            return
-        self._restoring_state = True
-        try:
-            self.scene.clear()
-            self.scene.temp_item = None
-            self.halls.clear()
-            self.anchors.clear()
-            self.proximity_zones.clear()
-            image_data = state.get("image_data") or ""
-            if image_data:
-                ba = QByteArray.fromBase64(image_data.encode())
-                pix = QPixmap()
-                pix.loadFromData(ba, "PNG")
-                self.scene.set_background_image(pix)
-            else:
-                self.scene.pixmap = None
-                self.scene.setSceneRect(0, 0, 1000, 1000)
-                self._reset_background_cache()
+    def capture_items_state(self, items) -> dict:
+        # Прежний вид только перечисленных объектов (зона зала — в составе
+        # своего зала). Годится для действий, которые не создают и не удаляют
+        # объекты: push_undo_state снимет после них те же объекты, а не весь
+        # проект.
+        targets = {}
+        for item in items:
+            if isinstance(item, RectZoneItem):
+                item = item.parentItem()
+            if isinstance(item, HallItem) and item in self.halls:
+                targets[item] = None
+            elif isinstance(item, AnchorItem) and item in self.anchors:
+                targets[item] = None
+            elif isinstance(item, ProximityZoneItem) and item in self.proximity_zones:
+                targets[item] = None
+        return {
+            UNDO_STATE_ITEMS_KEY: list(targets),
+            "halls": [self._hall_undo_state(item) for item in targets if isinstance(item, HallItem)],
+            "anchors": [self._anchor_undo_state(item) for item in targets if isinstance(item, AnchorItem)],
+            "proximity_zones": [
+                self._proximity_zone_undo_state(item) for item in targets if isinstance(item, ProximityZoneItem)
+            ],
+        }
+
+    def capture_drag_state(self, item) -> dict:
+        # Вместе с захваченным объектом Qt двигает и все выделенные, а с
+        # залом — привязанные к нему якоря.
+        items = [item, *self.scene.selectedItems()]
+        for hall in [it for it in items if isinstance(it, HallItem)]:
+            items.extend(self._anchors_for_hall(hall.number))
+        return self.capture_items_state(items)
+
+    def _anchor_with_zones(self, anchor) -> list:
+        # Зоны приближения хранят номер своего якоря.
+        return [anchor, *(zone for zone in self.proximity_zones if zone.anchor is anchor)]
+
+    def _hall_undo_state(self, hall) -> dict:
+        return {
+            "uid": self._undo_uid(hall),
+            "num": hall.number,
+            "name": hall.name,
+            "x_px": hall.pos().x(),
+            "y_px": hall.pos().y(),
+            "w_px": hall.rect().width(),
+            "h_px": hall.rect().height(),
+            "audio": copy.deepcopy(hall.audio_settings) if hall.audio_settings else None,
+            "extra_tracks": list(hall.extra_tracks),
+            "zone_audio": {str(k): copy.deepcopy(v) for k, v in hall.zone_audio_tracks.items()},
+            "zones": self._hall_zone_states(hall),
+        }
+
+    def _anchor_undo_state(self, anchor) -> dict:
+        anchor_data = {
+            "uid": self._undo_uid(anchor),
+            "number": anchor.number,
+            "z": anchor.z,
+            "x": anchor.scenePos().x(),
+            "y": anchor.scenePos().y(),
+            "main_hall": anchor.main_hall_number,
+            "extra_halls": list(anchor.extra_halls),
+            "bound": anchor.bound_explicit
+        }
+        if anchor.start:
+            anchor_data["start"] = True
+        return anchor_data
+
+    def _proximity_zone_undo_state(self, zone) -> dict:
+        return {
+            "uid": self._undo_uid(zone),
+            "zone_num": zone.zone_num,
+            "anchor_id": zone.anchor.number,
+            "dist_in": zone.dist_in,
+            "dist_out": zone.dist_out,
+            "bound": zone.bound,
+            "halls": list(zone.halls),
+            "blacklist": list(zone.blacklist),
+            "audio": copy.deepcopy(zone.audio_info) if zone.audio_info else None,
+        }
+
+    def _set_background_image_bytes(self, image_bytes: bytes, image: QImage | None = None) -> bool:
+        if image is not None and not image.isNull():
+            pix = QPixmap.fromImage(image)
+        else:
+            pix = QPixmap()
+            if not image_bytes or not pix.loadFromData(image_bytes):
+                return False
+        self.scene.set_background_image(pix)
+        self._background_image_source = (pix.cacheKey(), bytes(image_bytes))
+        return True
+
+    def _background_image_bytes(self) -> bytes:
+        # Исходные байты плана (как при загрузке с диска); PNG-перекодирование
+        # нужно только для фона, пришедшего не из файла.
+        if not self.scene.pixmap:
+            return b""
+        cache_key = self.scene.pixmap.cacheKey()
+        source = self._background_image_source
+        if source and source[0] == cache_key:
+            return source[1]
+        buf = QBuffer(); buf.open(QBuffer.WriteOnly)
+        self.scene.pixmap.save(buf, "PNG")
+        image_bytes = bytes(buf.data().data())
+        self._background_image_source = (cache_key, image_bytes)
+        return image_bytes
+
+    def _set_background_from_state(self, image_data):
+        if image_data:
+            self._set_background_image_bytes(bytes(QByteArray.fromBase64(image_data.encode()).data()))
+        else:
+            self.scene.pixmap = None
+            self.scene.setSceneRect(0, 0, 1000, 1000)
+            self._reset_background_cache()
+
+    def _apply_state_fields(self, state):
+        if "pixel_per_cm_x" in state:
             self.scene.pixel_per_cm_x = state.get("pixel_per_cm_x", 1.0)
+            self._refresh_scale_dependent_items()
+        if "pixel_per_cm_y" in state:
             self.scene.pixel_per_cm_y = state.get("pixel_per_cm_y", 1.0)
+        if "grid_step_cm" in state:
             self.scene.grid_step_cm = state.get("grid_step_cm", 20.0)
+        if "grid_calibrated" in state:
             self.grid_calibrated = state.get("grid_calibrated", False)
+        if "lock_halls" in state:
             self.lock_halls = state.get("lock_halls", False)
+        if "lock_zones" in state:
             self.lock_zones = state.get("lock_zones", False)
+        if "lock_anchors" in state:
             self.lock_anchors = state.get("lock_anchors", False)
+        if "current_project_file" in state:
             self.current_project_file = state.get("current_project_file")
+        if "project_name" in state:
             self.project_name = state.get("project_name", "") if isinstance(state.get("project_name", ""), str) else ""
+        if "project_root_dir" in state:
             self.project_root_dir = state.get("project_root_dir")
+        if "project_content_dir" in state:
             self.project_content_dir = state.get("project_content_dir")
+        if "unmatched_audio_files" in state:
             self.unmatched_audio_files = self._normalize_unmatched_audio_files(state.get("unmatched_audio_files"))
+
+    @staticmethod
+    def _add_zones_from_state(hall, zones_data):
+        for zone_data in zones_data:
+            bl = QPointF(zone_data.get("bottom_left_x", 0.0), zone_data.get("bottom_left_y", 0.0))
+            RectZoneItem(
+                bl,
+                zone_data.get("w_px", 0.0),
+                zone_data.get("h_px", 0.0),
+                zone_data.get("zone_num", 0),
+                zone_data.get("zone_type", "Входная зона"),
+                zone_data.get("zone_angle", 0.0),
+                hall
+            )
+
+    @staticmethod
+    def _apply_hall_audio_state(hall, hall_data):
+        hall.audio_settings = copy.deepcopy(hall_data.get("audio")) if hall_data.get("audio") else None
+        hall.extra_tracks = normalize_int_list(hall_data.get("extra_tracks"))
+        zone_audio_raw = hall_data.get("zone_audio") or {}
+        hall.zone_audio_tracks = {}
+        for k, v in zone_audio_raw.items():
+            try:
+                hall.zone_audio_tracks[int(k)] = copy.deepcopy(v)
+            except (TypeError, ValueError):
+                continue
+
+    def _create_hall_from_state(self, hall_data):
+        hall = HallItem(
+            hall_data.get("x_px", 0.0),
+            hall_data.get("y_px", 0.0),
+            hall_data.get("w_px", 0.0),
+            hall_data.get("h_px", 0.0),
+            hall_data.get("name", ""),
+            hall_data.get("num", 0),
+            scene=self.scene
+        )
+        self._assign_undo_uid(hall, hall_data.get("uid"))
+        self._apply_hall_audio_state(hall, hall_data)
+        self.scene.addItem(hall)
+        self.halls.append(hall)
+        self._add_zones_from_state(hall, hall_data.get("zones", []))
+        return hall
+
+    def _update_hall_from_state(self, hall, hall_data):
+        hall.prepareGeometryChange()
+        hall.name = hall_data.get("name", "")
+        hall.number = hall_data.get("num", 0)
+        w_px = hall_data.get("w_px", 0.0)
+        h_px = hall_data.get("h_px", 0.0)
+        if hall.rect().width() != w_px or hall.rect().height() != h_px:
+            hall.setRect(0, 0, w_px, h_px)
+            hall.setZValue(-w_px * h_px)
+        hall.setPos(hall_data.get("x_px", 0.0), hall_data.get("y_px", 0.0))
+        self._apply_hall_audio_state(hall, hall_data)
+        zones_data = hall_data.get("zones", [])
+        if self._hall_zone_states(hall) != zones_data:
+            for child in list(hall.childItems()):
+                if isinstance(child, RectZoneItem):
+                    child.setParentItem(None)
+                    if child.scene():
+                        child.scene().removeItem(child)
+            self._add_zones_from_state(hall, zones_data)
+        else:
+            for child in hall.childItems():
+                if isinstance(child, RectZoneItem):
+                    child.update_zvalue()
+        hall.update()
+
+    @staticmethod
+    def _apply_anchor_flags_state(anchor, anchor_data):
+        anchor.z = anchor_data.get("z", 0)
+        anchor.main_hall_number = anchor_data.get("main_hall")
+        anchor.extra_halls = list(anchor_data.get("extra_halls", []))
+        anchor.start = bool(anchor_data.get("start", False))
+        anchor.bound = bool(anchor_data.get("bound", False))
+        if anchor.start:
+            anchor.bound = False
+        anchor.bound_explicit = anchor.bound
+
+    def _create_anchor_from_state(self, anchor_data):
+        anchor = AnchorItem(
+            anchor_data.get("x", 0.0),
+            anchor_data.get("y", 0.0),
+            anchor_data.get("number", 0),
+            main_hall_number=anchor_data.get("main_hall"),
+            scene=self.scene
+        )
+        self._assign_undo_uid(anchor, anchor_data.get("uid"))
+        self._apply_anchor_flags_state(anchor, anchor_data)
+        self.scene.addItem(anchor)
+        self.anchors.append(anchor)
+        return anchor
+
+    def _update_anchor_from_state(self, anchor, anchor_data):
+        anchor.prepareGeometryChange()
+        anchor.number = anchor_data.get("number", 0)
+        self._apply_anchor_flags_state(anchor, anchor_data)
+        anchor.setPos(anchor_data.get("x", 0.0), anchor_data.get("y", 0.0))
+        anchor.update_zvalue()
+        for child in anchor.childItems():
+            if isinstance(child, ProximityZoneItem):
+                child.prepareGeometryChange()
+        anchor.update()
+
+    def _create_proximity_zone_from_state(self, zone_data, anchor):
+        zone = ProximityZoneItem(
+            anchor,
+            zone_data.get("zone_num", 0),
+            float(zone_data.get("dist_in", 0.0)),
+            float(zone_data.get("dist_out", 0.0)),
+            bool(zone_data.get("bound", False)),
+            list(zone_data.get("halls", [])),
+            list(zone_data.get("blacklist", [])),
+            copy.deepcopy(zone_data.get("audio")) if zone_data.get("audio") else None,
+        )
+        self._assign_undo_uid(zone, zone_data.get("uid"))
+        self.proximity_zones.append(zone)
+        return zone
+
+    @staticmethod
+    def _update_proximity_zone_from_state(zone, zone_data):
+        zone.prepareGeometryChange()
+        zone.zone_num = zone_data.get("zone_num", 0)
+        zone.dist_in = max(0.0, float(zone_data.get("dist_in", 0.0)))
+        zone.dist_out = max(0.0, float(zone_data.get("dist_out", 0.0)))
+        zone.bound = bool(zone_data.get("bound", False))
+        zone.halls = list(zone_data.get("halls", []))
+        zone.blacklist = list(zone_data.get("blacklist", []))
+        zone.audio_info = copy.deepcopy(zone_data.get("audio")) if zone_data.get("audio") else None
+        zone.update_zvalue()
+        zone.update()
+
+    def _remove_anchor_item(self, anchor):
+        for child in list(anchor.childItems()):
+            if isinstance(child, ProximityZoneItem) and child in self.proximity_zones:
+                self.proximity_zones.remove(child)
+        if anchor in self.anchors:
+            self.anchors.remove(anchor)
+        if anchor.scene():
+            anchor.scene().removeItem(anchor)
+
+    def _finish_state_restore(self):
+        self.add_mode = None
+        self.temp_start_point = None
+        self.current_hall_for_zone = None
+        self.apply_lock_flags()
+        self.populate_tree()
+        self.statusBar().clearMessage()
+
+    def restore_state(self, state):
+        if not state:
+            return
+        self._restoring_state = True
+        try:
+            self.scene.clear()
+            self.scene.temp_item = None
+            self.halls.clear()
+            self.anchors.clear()
+            self.proximity_zones.clear()
+            self.last_selected_items = []
+            image_data = state.get("image_data") or ""
+            self._set_background_from_state(image_data)
+            self._apply_state_fields(state)
             self._update_window_title()
             for hall_data in state.get("halls", []):
-                hall = HallItem(
-                    hall_data.get("x_px", 0.0),
-                    hall_data.get("y_px", 0.0),
-                    hall_data.get("w_px", 0.0),
-                    hall_data.get("h_px", 0.0),
-                    hall_data.get("name", ""),
-                    hall_data.get("num", 0),
-                    scene=self.scene
-                )
-                hall.audio_settings = copy.deepcopy(hall_data.get("audio")) if hall_data.get("audio") else None
-                hall.extra_tracks = normalize_int_list(hall_data.get("extra_tracks"))
-                zone_audio_raw = hall_data.get("zone_audio") or {}
-                hall.zone_audio_tracks = {}
-                for k, v in zone_audio_raw.items():
-                    try:
-                        hall.zone_audio_tracks[int(k)] = copy.deepcopy(v)
-                    except (TypeError, ValueError):
-                        continue
-                self.scene.addItem(hall)
-                self.halls.append(hall)
-                for zone_data in hall_data.get("zones", []):
-                    bl = QPointF(zone_data.get("bottom_left_x", 0.0), zone_data.get("bottom_left_y", 0.0))
-                    RectZoneItem(
-                        bl,
-                        zone_data.get("w_px", 0.0),
-                        zone_data.get("h_px", 0.0),
-                        zone_data.get("zone_num", 0),
-                        zone_data.get("zone_type", "Входная зона"),
-                        zone_data.get("zone_angle", 0.0),
-                        hall
-                    )
+                self._create_hall_from_state(hall_data)
             anchor_map = {}
             for anchor_data in state.get("anchors", []):
-                anchor = AnchorItem(
-                    anchor_data.get("x", 0.0),
-                    anchor_data.get("y", 0.0),
-                    anchor_data.get("number", 0),
-                    main_hall_number=anchor_data.get("main_hall"),
-                    scene=self.scene
-                )
-                anchor.z = anchor_data.get("z", 0)
-                anchor.extra_halls = list(anchor_data.get("extra_halls", []))
-                anchor.start = bool(anchor_data.get("start", False))
-                anchor.bound = bool(anchor_data.get("bound", False))
-                if anchor.start:
-                    anchor.bound = False
-                anchor.bound_explicit = anchor.bound
-                self.scene.addItem(anchor)
-                self.anchors.append(anchor)
+                anchor = self._create_anchor_from_state(anchor_data)
                 anchor_map[anchor.number] = anchor
             for zone_data in state.get("proximity_zones", []):
                 anchor = anchor_map.get(zone_data.get("anchor_id"))
                 if not anchor:
                     continue
-                zone = ProximityZoneItem(
-                    anchor,
-                    zone_data.get("zone_num", 0),
-                    float(zone_data.get("dist_in", 0.0)),
-                    float(zone_data.get("dist_out", 0.0)),
-                    bool(zone_data.get("bound", False)),
-                    list(zone_data.get("halls", [])),
-                    list(zone_data.get("blacklist", [])),
-                    copy.deepcopy(zone_data.get("audio")) if zone_data.get("audio") else None,
-                )
-                self.proximity_zones.append(zone)
+                self._create_proximity_zone_from_state(zone_data, anchor)
             if not image_data:
                 rect = self.scene.itemsBoundingRect()
                 if rect.isValid():
                     margin = 100
                     self.scene.setSceneRect(rect.adjusted(-margin, -margin, margin, margin))
-            self.add_mode = None
-            self.temp_start_point = None
-            self.current_hall_for_zone = None
-            self.apply_lock_flags()
-            self.populate_tree()
-            self.statusBar().clearMessage()
+            self._finish_state_restore()
+        finally:
+            self._restoring_state = False
+
+    def _apply_undo_patch(self, patch):
+        fields = patch.get("fields", {})
+        self._restoring_state = True
+        try:
+            if "image_data" in fields:
+                self._set_background_from_state(fields.get("image_data") or "")
+            self._apply_state_fields(fields)
+            self._update_window_title()
+
+            halls_by_uid = {getattr(h, "_undo_uid", None): h for h in self.halls}
+            for uid, hall_data in patch.get("halls", {}).items():
+                hall = halls_by_uid.get(uid)
+                if hall_data is None:
+                    if hall is not None:
+                        self.halls.remove(hall)
+                        if hall.scene():
+                            hall.scene().removeItem(hall)
+                elif hall is None:
+                    halls_by_uid[uid] = self._create_hall_from_state(hall_data)
+                else:
+                    self._update_hall_from_state(hall, hall_data)
+            if "halls_order" in patch:
+                self.halls = [halls_by_uid[uid] for uid in patch["halls_order"] if uid in halls_by_uid]
+
+            anchors_by_uid = {getattr(a, "_undo_uid", None): a for a in self.anchors}
+            for uid, anchor_data in patch.get("anchors", {}).items():
+                anchor = anchors_by_uid.get(uid)
+                if anchor_data is None:
+                    if anchor is not None:
+                        self._remove_anchor_item(anchor)
+                elif anchor is None:
+                    anchors_by_uid[uid] = self._create_anchor_from_state(anchor_data)
+                else:
+                    self._update_anchor_from_state(anchor, anchor_data)
+            if "anchors_order" in patch:
+                self.anchors = [anchors_by_uid[uid] for uid in patch["anchors_order"] if uid in anchors_by_uid]
+
+            anchor_map = {}
+            for anchor in self.anchors:
+                anchor_map.setdefault(anchor.number, anchor)
+            zones_by_uid = {getattr(z, "_undo_uid", None): z for z in self.proximity_zones}
+            for uid, zone_data in patch.get("proximity_zones", {}).items():
+                zone = zones_by_uid.pop(uid, None)
+                target_anchor = anchor_map.get(zone_data.get("anchor_id")) if zone_data else None
+                if zone is not None and (zone_data is None or zone.anchor is not target_anchor):
+                    if zone in self.proximity_zones:
+                        self.proximity_zones.remove(zone)
+                    zone.setParentItem(None)
+                    if zone.scene():
+                        zone.scene().removeItem(zone)
+                    zone = None
+                if zone_data is None or target_anchor is None:
+                    continue
+                if zone is None:
+                    zone = self._create_proximity_zone_from_state(zone_data, target_anchor)
+                else:
+                    self._update_proximity_zone_from_state(zone, zone_data)
+                zones_by_uid[uid] = zone
+            if "proximity_zones_order" in patch:
+                self.proximity_zones = [
+                    zones_by_uid[uid] for uid in patch["proximity_zones_order"] if uid in zones_by_uid
+                ]
+
+            if "image_data" in fields and not fields.get("image_data"):
+                rect = self.scene.itemsBoundingRect()
+                if rect.isValid():
+                    margin = 100
+                    self.scene.setSceneRect(rect.adjusted(-margin, -margin, margin, margin))
+            self.last_selected_items = [
+                item for item in self.last_selected_items if item.scene() is self.scene
+            ]
+            self._finish_state_restore()
+            self.scene.update()
         finally:
             self._restoring_state = False
 
     def push_undo_state(self, state=None):
         if self._restoring_state:
             return
-        snapshot = state if state is not None else self.capture_state()
-        if snapshot is None:
+        before = state if state is not None else self.capture_state()
+        if before is None:
             return
-        self.undo_stack.append(snapshot)
-        if len(self.undo_stack) > self._undo_limit:
-            self.undo_stack.pop(0)
+        if UNDO_STATE_ITEMS_KEY in before:
+            after = self.capture_items_state(before[UNDO_STATE_ITEMS_KEY])
+        else:
+            after = self.capture_state()
+        patch = _state_inverse_patch(before, after)
+        if patch is None:
+            self.update_undo_action()
+            return
+        size = _estimate_state_size(patch)
+        self.undo_stack.append({"patch": patch, "size": size, "revision": self._revision})
+        self._touch_revision()
+        self._undo_stack_bytes += size
+        while len(self.undo_stack) > 1 and self._undo_stack_bytes > self._undo_memory_limit:
+            self._undo_stack_bytes -= self.undo_stack.pop(0)["size"]
         self.update_undo_action()
 
     def undo_last_action(self):
         if not self.undo_stack:
             return
-        state = self.undo_stack.pop()
-        self.restore_state(state)
+        entry = self.undo_stack.pop()
+        self._undo_stack_bytes -= entry["size"]
+        self._apply_undo_patch(entry["patch"])
+        self._set_revision(entry["revision"])
         self.update_undo_action()
         self.statusBar().showMessage("Последнее действие отменено.", 3000)
 
@@ -4021,56 +5439,69 @@ class PlanEditorMainWindow(QMainWindow):
             return
         self.set_mode("calibrate")
         self.statusBar().showMessage("Укажите 2 точки на плане для обозначения отрезка известной длины")
+
+    def _refresh_scale_dependent_items(self):
+        # Радиусы стартовых якорей и зон приближения зависят от масштаба плана,
+        # а их кэшированные изображения сами по себе не обновляются.
+        for item in [*self.anchors, *self.proximity_zones]:
+            item.prepareGeometryChange()
+            item.update()
+        self.scene.update()
+
     def resnap_objects(self):
         step = self.scene.pixel_per_cm_x * self.scene.grid_step_cm
         for h in self.halls:
             p = h.pos(); h.setPos(round(p.x()/step)*step, round(p.y()/step)*step)
         for a in self.anchors:
             p = a.scenePos(); a.setPos(round(p.x()/step)*step, round(p.y()/step)*step)
+        self._touch_revision()
         self.populate_tree(); self.statusBar().showMessage("Координаты пересчитаны.")
 
     # Selection sync
+    def _select_tree_items(self, items, clear=False):
+        selection = self.tree.selectionModel()
+        if clear:
+            selection.clearSelection()
+        for it in items:
+            index = self.object_tree_model.index_for_ref(it)
+            if index.isValid():
+                selection.select(index, QItemSelectionModel.Select)
+
     def on_scene_selection_changed(self):
         try: items = self.scene.selectedItems()
         except: return
         if items:
             self.last_selected_items = items
-            for it in items:
-                if hasattr(it, 'tree_item') and it.tree_item:
-                    it.tree_item.setSelected(True)
+            self._select_tree_items(items)
         else:
-            for it in self.last_selected_items:
-                if hasattr(it, 'tree_item') and it.tree_item:
-                    it.tree_item.setSelected(True)
+            self._select_tree_items(self.last_selected_items)
 
     def update_tree_selection(self):
-        try: items = [i for i in self.scene.items() if i.isSelected()]
+        try: items = self.scene.selectedItems()
         except: return
         if items:
             self.last_selected_items = items
-            def clear(n):
-                n.setSelected(False)
-                for i in range(n.childCount()): clear(n.child(i))
-            for i in range(self.tree.topLevelItemCount()): clear(self.tree.topLevelItem(i))
-            for it in items:
-                if hasattr(it, 'tree_item') and it.tree_item:
-                    it.tree_item.setSelected(True)
+            self._select_tree_items(items, clear=True)
         else:
-            for it in self.last_selected_items:
-                if hasattr(it, 'tree_item') and it.tree_item:
-                    it.tree_item.setSelected(True)
+            self._select_tree_items(self.last_selected_items)
+
+    def _expand_inserted_halls(self, parent, first, last):
+        if parent.isValid():
+            return
+        for row in range(first, last + 1):
+            self.tree.expand(self.object_tree_model.index(row, 0))
 
     # Tree context/double click handlers
     def on_tree_context_menu(self, point: QPoint):
-        item = self.tree.itemAt(point)
-        if not item: return
-        self.handle_tree_item_action(item, self.tree.viewport().mapToGlobal(point))
+        index = self.tree.indexAt(point)
+        if not index.isValid(): return
+        self.handle_tree_item_action(index, self.tree.viewport().mapToGlobal(point))
 
-    def on_tree_item_double_clicked(self, item: QTreeWidgetItem, col: int):
-        self.handle_tree_item_action(item, QCursor.pos())
+    def on_tree_item_double_clicked(self, index: QModelIndex):
+        self.handle_tree_item_action(index, QCursor.pos())
 
-    def handle_tree_item_action(self, item: QTreeWidgetItem, global_pos: QPoint):
-        data = item.data(0, Qt.UserRole)
+    def handle_tree_item_action(self, index: QModelIndex, global_pos: QPoint):
+        data = index.data(Qt.UserRole)
         if not data: return
         tp = data.get("type")
         if tp == "hall":
@@ -4099,10 +5530,10 @@ class PlanEditorMainWindow(QMainWindow):
                 zone.open_menu(global_pos)
 
     def _selected_tree_hall(self):
-        item = self.tree.currentItem()
-        if item is None:
+        index = self.tree.currentIndex()
+        if not index.isValid():
             return None
-        data = item.data(0, Qt.UserRole)
+        data = index.data(Qt.UserRole)
         if not isinstance(data, dict) or data.get("type") != "hall":
             return None
         hall = data.get("ref")
@@ -4129,9 +5560,9 @@ class PlanEditorMainWindow(QMainWindow):
         self.halls.pop(old_index)
         self.halls.insert(new_index, hall)
         self.populate_tree()
-        if getattr(hall, "tree_item", None):
-            self.tree.setCurrentItem(hall.tree_item)
-            hall.tree_item.setSelected(True)
+        index = self.object_tree_model.index_for_ref(hall)
+        if index.isValid():
+            self.tree.setCurrentIndex(index)
         self._update_hall_order_buttons()
         self.push_undo_state(prev_state)
         self.populate_tracks_table()
@@ -4186,75 +5617,28 @@ class PlanEditorMainWindow(QMainWindow):
             return
         panel.refresh()
 
-    def populate_tree(self):
-        self.last_selected_items = []
-        self.tree.clear()
-        # halls
-        for h in self.halls:
-            wm = h.rect().width()/(self.scene.pixel_per_cm_x*100)
-            hm = h.rect().height()/(self.scene.pixel_per_cm_x*100)
-            rt = (f'Зал {h.number} "{h.name}" ({wm:.1f} x {hm:.1f} м)'
-                  if h.name.strip() else f'Зал {h.number} ({wm:.1f} x {hm:.1f} м)')
-            hi = QTreeWidgetItem([rt]); h.tree_item = hi; self.tree.addTopLevelItem(hi)
-            hi.setData(0, Qt.UserRole, {"type":"hall","ref":h})
-
-            # anchors under hall
+    def _anchors_for_hall(self, hall_number) -> list:
+        if self._hall_anchor_index is None:
+            index = {}
             for a in self.anchors:
-                if a.main_hall_number==h.number or h.number in a.extra_halls:
-                    lp = h.mapFromScene(a.scenePos())
-                    xm = fix_negative_zero(round(lp.x()/(self.scene.pixel_per_cm_x*100),1))
-                    ym = fix_negative_zero(round((h.rect().height()-lp.y())/(self.scene.pixel_per_cm_x*100),1))
-                    at = f'Якорь {a.number} (x={xm} м, y={ym} м, z={fix_negative_zero(round(a.z/100,1))} м)'
-                    if a.start:
-                        at += " [стартовый]"
-                    ai = QTreeWidgetItem([at]); a.tree_item = ai; hi.addChild(ai)
-                    ai.setData(0, Qt.UserRole, {"type":"anchor","ref":a})
-
-            for z in self.proximity_zones:
-                halls = z.halls or ([z.anchor.main_hall_number] if z.anchor else [])
-                if h.number not in halls:
-                    continue
-                info = f"Зона {z.zone_num} (якорь {z.anchor.number}, вход {z.dist_in} м, выход {z.dist_out} м)"
-                if z.bound:
-                    info += " [переходная]"
-                if z.blacklist:
-                    info += f"; ЧС: {', '.join(str(x) for x in z.blacklist)}"
-                zi = QTreeWidgetItem([info]); z.tree_item = zi; hi.addChild(zi)
-                zi.setData(0, Qt.UserRole, {"type": "proximity_zone", "ref": z})
-
-            # zones grouped by num
-            zones_by_num = {}
-            for ch in h.childItems():
-                if isinstance(ch,RectZoneItem):
-                    zones_by_num.setdefault(ch.zone_num, []).append(ch)
+                for num in dict.fromkeys([a.main_hall_number, *a.extra_halls]):
+                    index.setdefault(num, []).append(a)
+            self._hall_anchor_index = index
+        return self._hall_anchor_index.get(hall_number, [])
 
-            for num, zlist in zones_by_num.items():
-                # compose one-line text as before
-                default = {"x":0,"y":0,"w":0,"h":0,"angle":0}
-                enter = default.copy(); exitz = default.copy(); bound = False
-                for z in zlist:
-                    data = z.get_export_data()
-                    if z.zone_type in ("Входная зона","Переходная"):
-                        enter = data
-                    if z.zone_type == "Выходная зона":
-                        exitz = data
-                    if z.zone_type == "Переходная":
-                        bound = True
-                zt = (f"Зона {num}: enter: x = {enter['x']} м, y = {enter['y']} м, "
-                      f"w = {enter['w']} м, h = {enter['h']} м, angle = {enter['angle']}°; "
-                      f"exit: x = {exitz['x']} м, y = {exitz['y']} м, "
-                      f"w = {exitz['w']} м, h = {exitz['h']} м, angle = {exitz['angle']}°")
-                zi = QTreeWidgetItem([zt]); hi.addChild(zi)
-                # link every zone to the same item? Keep mapping via UserRole
-                zi.setData(0, Qt.UserRole, {"type":"zone_group","ref":zlist})
-                # also set back-reference for sync highlighting (any zone in this group will highlight this row)
-                for z in zlist: z.tree_item = zi
-
-            hi.setExpanded(True)
+    def _invalidate_hall_anchor_index(self):
+        self._hall_anchor_index = None
 
+    def populate_tree(self):
+        self.last_selected_items = []
+        self._invalidate_hall_anchor_index()
+        self.object_tree_model.sync(self.halls, self.anchors, self.proximity_zones)
         self._update_hall_order_buttons()
         self.populate_tracks_table()
 
+    def refresh_tree_items(self):
+        self.object_tree_model.refresh_dirty()
+
     def set_mode(self, mode):
         if not self.grid_calibrated and mode!="calibrate":
             QMessageBox.information(self,"Внимание","Сначала выполните калибровку!"); return
@@ -4274,27 +5658,55 @@ class PlanEditorMainWindow(QMainWindow):
             return True
         return bool(self.halls or self.anchors)
 
+    # Каждое изменение проекта получает новый номер ревизии (push_undo_state,
+    # правки без отмены — через _touch_revision), отмена возвращает номер,
+    # который был до изменения. Проект считается изменённым, если текущая
+    # ревизия отличается от сохранённой, — без сравнения снимков состояния.
+    def _touch_revision(self):
+        self._revision_seq += 1
+        self._set_revision(self._revision_seq)
+
+    def _set_revision(self, revision: int):
+        self._revision = revision
+        self._update_modified_marker()
+
+    def _update_modified_marker(self):
+        self.setWindowModified(self._has_unsaved_changes())
+
     def _has_unsaved_changes(self) -> bool:
         if not self._has_active_project():
             return False
-        current_state = self.capture_state()
-        if self._saved_state_snapshot is None:
-            return bool(
-                current_state.get("image_data")
-                or current_state.get("halls")
-                or current_state.get("anchors")
-            )
-        return current_state != self._saved_state_snapshot
+        return self._saved_revision is None or self._revision != self._saved_revision
 
     def _mark_state_as_saved(self):
-        self._saved_state_snapshot = self.capture_state()
+        self._saved_revision = self._revision
+        self._update_modified_marker()
+
+    def _forget_saved_state(self):
+        self._saved_revision = None
+        self._update_modified_marker()
 
     def restore_saved_project_snapshot(self) -> bool:
-        if self._saved_state_snapshot is None:
+        # Снимок сохранённого проекта не хранится: правки после сохранения
+        # откатываются по стеку отмены, а если он до сохранённой ревизии не
+        # достаёт (обрезан или отмена ушла дальше сохранения), проект
+        # перечитывается из файла.
+        if self._saved_revision is None:
             return True
+        revisions = [entry["revision"] for entry in self.undo_stack]
         try:
-            self.restore_state(copy.deepcopy(self._saved_state_snapshot))
-            return True
+            if self._saved_revision in revisions:
+                target = len(revisions) - 1 - revisions[::-1].index(self._saved_revision)
+                while len(self.undo_stack) > target:
+                    entry = self.undo_stack.pop()
+                    self._undo_stack_bytes -= entry["size"]
+                    self._apply_undo_patch(entry["patch"])
+                    self._set_revision(entry["revision"])
+                self.update_undo_action()
+                return True
+            if self.current_project_file and os.path.isfile(self.current_project_file):
+                return self._load_project_file(self.current_project_file)
+            raise FileNotFoundError(self.current_project_file or "")
         except Exception as exc:
             QMessageBox.critical(self, "Ошибка", f"Не удалось восстановить последнее сохранённое состояние:\n{exc}")
             return False
@@ -4385,8 +5797,13 @@ class PlanEditorMainWindow(QMainWindow):
         )
         if not fp:
             return
-        pix = QPixmap(fp)
-        if pix.isNull():
+        try:
+            with open(fp, "rb") as image_file:
+                image_bytes = image_file.read()
+        except OSError:
+            image_bytes = b""
+        pix = QPixmap()
+        if not image_bytes or not pix.loadFromData(image_bytes):
             QMessageBox.warning(self, "Ошибка", "Не удалось загрузить.")
             return
 
@@ -4402,12 +5819,13 @@ class PlanEditorMainWindow(QMainWindow):
         self.scene.pixmap = None
         self._reset_background_cache()
         self.scene.set_background_image(pix)
+        self._background_image_source = (pix.cacheKey(), image_bytes)
         self.grid_calibrated = False
         self.current_project_file = os.path.abspath(project_file)
         remember_last_used_path(self.current_project_file)
         self.project_name = project_name
         self._update_window_title()
-        self._saved_state_snapshot = None
+        self._forget_saved_state()
         self.statusBar().showMessage("Калибровка: укажите 2 точки")
         self.set_mode("calibrate")
         self.push_undo_state(prev_state)
@@ -4426,14 +5844,13 @@ class PlanEditorMainWindow(QMainWindow):
                     cleaned[key] = copy.deepcopy(value)
             return cleaned
 
-        buf_data = ""
+        image_member = ""
         if self.scene.pixmap:
-            buf = QBuffer(); buf.open(QBuffer.WriteOnly)
-            self.scene.pixmap.save(buf,"PNG")
-            buf_data = buf.data().toBase64().data().decode()
+            image_member = f"{PROJECT_IMAGE_MEMBER}.{image_bytes_extension(self._background_image_bytes())}"
         data = {
+            "format_version": PROJECT_FORMAT_VERSION,
             "project_name": self.project_name,
-            "image_data": buf_data,
+            "image_member": image_member,
             "pixel_per_cm_x": self.scene.pixel_per_cm_x,
             "pixel_per_cm_y": self.scene.pixel_per_cm_y,
             "grid_step_cm": self.scene.grid_step_cm,
@@ -4496,19 +5913,18 @@ class PlanEditorMainWindow(QMainWindow):
     def _save_project_file(self, fp, data):
         try:
             self._ensure_project_paths(fp)
-            with open(fp, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            write_project_file(fp, data, self._background_image_bytes())
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить:\n{e}")
             return False
 
         self.current_project_file = os.path.abspath(fp)
         remember_last_used_path(self.current_project_file)
-        rooms_json_text, tracks_data = self._prepare_export_payload()
+        rooms, tracks_data = self._prepare_export_payload()
         self._merge_unmatched_audio_files_into_tracks_data(tracks_data)
         self._merge_language_audio_files_into_tracks_data(tracks_data)
         self._merge_existing_tracks_metadata(tracks_data)
-        if not self._write_auxiliary_configs(rooms_json_text, tracks_data):
+        if not self._write_auxiliary_configs(rooms, tracks_data):
             return False
 
         self.statusBar().showMessage("Проект успешно сохранён.", 5000)
@@ -4838,16 +6254,16 @@ class PlanEditorMainWindow(QMainWindow):
         if dialog.exec() != QDialog.Accepted:
             return
 
-        self.project_name = name_edit.text().strip()
+        new_project_name = name_edit.text().strip()
+        if new_project_name != self.project_name:
+            self.project_name = new_project_name
+            self._touch_revision()
         self._update_window_title()
         if editing_system_configs:
             if not self.current_project_file:
                 QMessageBox.warning(self, "Настройки проекта", "Настройки проекта не сохранены: сначала сохраните проект.")
                 return
-            for zone in self.proximity_zones:
-                zone.prepareGeometryChange()
             self._write_system_configs(_collect_system_configs_from_widgets())
-            self.scene.update()
 
     def save_project(self):
         target = self.current_project_file
@@ -5090,7 +6506,6 @@ class PlanEditorMainWindow(QMainWindow):
             extras.append(extra_id)
         info = {
             "filename": filename,
-            "data": "",
             "duration_ms": int(track.get("duration_ms", 0) or 0),
             "size": size_bytes,
             "extra_ids": extras,
@@ -5114,7 +6529,6 @@ class PlanEditorMainWindow(QMainWindow):
                     sec_size = 0
             info["secondary"] = {
                 "filename": track["audio2"],
-                "data": "",
                 "duration_ms": 0,
                 "size": sec_size
             }
@@ -5270,6 +6684,13 @@ class PlanEditorMainWindow(QMainWindow):
         for pz in self.proximity_zones:
             proximity_by_id.setdefault(pz.zone_num, []).append(pz)
 
+        audio_paths = self._iter_project_audio_files()
+        language_paths = [full_path for _, _, full_path in self._iter_language_audio_files()]
+        scanned = self._scan_audio_files(audio_paths, language_paths, "Обновить аудио")
+        if scanned is None:
+            self.statusBar().showMessage("Обновление аудио отменено.", 5000)
+            return
+
         prev_state = self.capture_state()
         changed = False
         assigned_halls = 0
@@ -5277,30 +6698,18 @@ class PlanEditorMainWindow(QMainWindow):
         unmatched: list[str] = []
         unmatched_files: dict[str, dict] = {}
 
-        for audio_path in self._iter_project_audio_files():
-            try:
-                info = load_audio_file_info(audio_path)
-            except ValueError:
+        for audio_path in audio_paths:
+            info = scanned.get(audio_path)
+            if info is None:
                 continue
             filename = str(info.get("filename", "") or "")
             track_id = extract_track_id(filename)
 
             if track_id <= 0:
-                data_b64 = info.get("data", "")
-                crc32_hex = ""
-                if data_b64:
-                    try:
-                        raw_bytes = base64.b64decode(data_b64.encode("ascii"))
-                        crc = 0
-                        for offset in range(0, len(raw_bytes), 4096):
-                            crc = zlib.crc32(raw_bytes[offset:offset + 4096], crc)
-                        crc32_hex = f"{crc & 0xFFFFFFFF:08x}"
-                    except Exception:
-                        crc32_hex = ""
                 unmatched_files[filename] = {
                     "name": filename,
                     "size": int(info.get("size") or 0),
-                    "crc32": crc32_hex,
+                    "crc32": str(info.get("crc32", "") or ""),
                 }
                 unmatched.append(filename)
                 continue
@@ -5328,21 +6737,10 @@ class PlanEditorMainWindow(QMainWindow):
                 continue
 
             unmatched_name = filename
-            data_b64 = info.get("data", "")
-            crc32_hex = ""
-            if data_b64:
-                try:
-                    raw_bytes = base64.b64decode(data_b64.encode("ascii"))
-                    crc = 0
-                    for offset in range(0, len(raw_bytes), 4096):
-                        crc = zlib.crc32(raw_bytes[offset:offset + 4096], crc)
-                    crc32_hex = f"{crc & 0xFFFFFFFF:08x}"
-                except Exception:
-                    crc32_hex = ""
             unmatched_files[unmatched_name] = {
                 "name": unmatched_name,
                 "size": int(info.get("size") or 0),
-                "crc32": crc32_hex,
+                "crc32": str(info.get("crc32", "") or ""),
             }
             unmatched.append(unmatched_name)
 
@@ -5351,12 +6749,12 @@ class PlanEditorMainWindow(QMainWindow):
         if changed:
             self.push_undo_state(prev_state)
 
-        rooms_json_text, tracks_data = self._prepare_export_payload()
+        rooms, tracks_data = self._prepare_export_payload()
         self.unmatched_audio_files = self._normalize_unmatched_audio_files(unmatched_files)
         self._merge_unmatched_audio_files_into_tracks_data(tracks_data)
         self._merge_language_audio_files_into_tracks_data(tracks_data)
         self._merge_existing_tracks_metadata(tracks_data)
-        if not self._write_auxiliary_configs(rooms_json_text, tracks_data):
+        if not self._write_auxiliary_configs(rooms, tracks_data):
             return
         if not self._sync_project_file_and_auxiliary_configs(show_errors=True):
             return
@@ -5383,21 +6781,37 @@ class PlanEditorMainWindow(QMainWindow):
         if not fp: return
         self._load_project_file(fp)
 
-    def _load_project_file(self, fp: str):
+    def _load_project_file(self, fp: str) -> bool:
+        progress_dialog = QProgressDialog("Чтение проекта...", "Отмена", 0, 0, self)
+        progress_dialog.setWindowTitle("Открытие проекта")
+        progress_dialog.setWindowModality(Qt.WindowModal)
+        progress_dialog.setMinimumDuration(300)
+        progress_dialog.setAutoClose(False)
+        progress_dialog.setAutoReset(False)
+        worker = ProjectLoadWorker(fp, self)
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit)
+        progress_dialog.canceled.connect(worker.requestInterruption)
+        worker.start()
+        loop.exec()
+        worker.wait()
+        # Поток — дочерний объект окна: без deleteLater он вместе с байтами
+        # и декодированным планом жил бы до конца сессии.
+        data, image_bytes, image, error = worker.data, worker.image_bytes, worker.image, worker.error
+        worker.deleteLater()
+        if progress_dialog.wasCanceled():
+            progress_dialog.close()
+            self.statusBar().showMessage("Открытие проекта отменено.", 5000)
+            return False
+        if error:
+            progress_dialog.close()
+            QMessageBox.critical(self,"Ошибка",f"Ошибка чтения:\n{error}"); return False
+
         prev_state = self.capture_state()
-        try:
-            with open(fp,"r",encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception as e:
-            QMessageBox.critical(self,"Ошибка",f"Ошибка чтения:\n{e}"); return
         self.scene.clear(); self.halls.clear(); self.anchors.clear(); self.proximity_zones.clear()
         self.scene.pixmap = None
         self._reset_background_cache()
-        buf_data = data.get("image_data","")
-        if buf_data:
-            ba = QByteArray.fromBase64(buf_data.encode())
-            pix = QPixmap(); pix.loadFromData(ba,"PNG")
-            self.scene.set_background_image(pix)
+        self._set_background_image_bytes(image_bytes, image)
         self.scene.pixel_per_cm_x = data.get("pixel_per_cm_x",1.0)
         self.scene.pixel_per_cm_y = data.get("pixel_per_cm_y",1.0)
         self.scene.grid_step_cm   = data.get("grid_step_cm",20.0)
@@ -5408,7 +6822,41 @@ class PlanEditorMainWindow(QMainWindow):
         self.unmatched_audio_files = self._normalize_unmatched_audio_files(data.get("unmatched_audio_files"))
         self._update_window_title()
         self.grid_calibrated = True
-        for hd in data.get("halls",[]):
+
+        # Объекты создаются пачками: между пачками окно перерисовывается,
+        # а отмена возвращает проект, открытый до этого.
+        total = (
+            len(data["halls"]) + sum(len(hd["zones"]) for hd in data["halls"])
+            + len(data["anchors"]) + len(data["proximity_zones"])
+        )
+        progress_dialog.setRange(0, max(total, 1))
+        progress_dialog.setLabelText("Создание объектов...")
+        for done, _ in enumerate(self._populate_project_items(data), 1):
+            if done % PROJECT_LOAD_BATCH:
+                continue
+            progress_dialog.setValue(done)
+            QApplication.processEvents()
+            if progress_dialog.wasCanceled():
+                progress_dialog.close()
+                self.restore_state(prev_state)
+                self.statusBar().showMessage("Открытие проекта отменено.", 5000)
+                return False
+        progress_dialog.close()
+
+        self.apply_lock_flags(); self.populate_tree()
+        self.current_project_file = os.path.abspath(fp)
+        remember_last_used_path(self.current_project_file)
+        self.project_root_dir = None
+        self.project_content_dir = None
+        self._ensure_project_layout_for_current_file()
+        self.populate_tracks_table()
+        self.statusBar().showMessage("Проект успешно загружен.", 5000)
+        self.push_undo_state(prev_state)
+        self._mark_state_as_saved()
+        return True
+
+    def _populate_project_items(self, data: dict):
+        for hd in data["halls"]:
             h = HallItem(
                 hd.get("x_px",0), hd.get("y_px",0),
                 hd.get("w_px",100), hd.get("h_px",100),
@@ -5426,7 +6874,8 @@ class PlanEditorMainWindow(QMainWindow):
                     except (TypeError, ValueError):
                         continue
             self.scene.addItem(h); self.halls.append(h)
-            for zd in hd.get("zones",[]):
+            yield h
+            for zd in hd["zones"]:
                 bl = QPointF(zd.get("bottom_left_x",0), zd.get("bottom_left_y",0))
                 RectZoneItem(
                     bl, zd.get("w_px",0), zd.get("h_px",0),
@@ -5434,8 +6883,9 @@ class PlanEditorMainWindow(QMainWindow):
                     zd.get("zone_type","Входная зона"),
                     zd.get("zone_angle",0), h
                 )
+                yield h
         anchor_map = {}
-        for ad in data.get("anchors",[]):
+        for ad in data["anchors"]:
             a = AnchorItem(
                 ad.get("x",0), ad.get("y",0),
                 ad.get("number",0),
@@ -5450,9 +6900,11 @@ class PlanEditorMainWindow(QMainWindow):
                 a.bound = False
             a.bound_explicit = a.bound
             self.scene.addItem(a); self.anchors.append(a); anchor_map[a.number] = a
-        for zd in data.get("proximity_zones", []):
+            yield a
+        for zd in data["proximity_zones"]:
             anchor = anchor_map.get(zd.get("anchor_id"))
             if not anchor:
+                yield None
                 continue
             zone = ProximityZoneItem(
                 anchor,
@@ -5465,16 +6917,7 @@ class PlanEditorMainWindow(QMainWindow):
                 copy.deepcopy(zd.get("audio")) if zd.get("audio") else None,
             )
             self.proximity_zones.append(zone)
-        self.apply_lock_flags(); self.populate_tree()
-        self.current_project_file = os.path.abspath(fp)
-        remember_last_used_path(self.current_project_file)
-        self.project_root_dir = None
-        self.project_content_dir = None
-        self._ensure_project_layout_for_current_file()
-        self.populate_tracks_table()
-        self.statusBar().showMessage("Проект успешно загружен.", 5000)
-        self.push_undo_state(prev_state)
-        self._mark_state_as_saved()
+            yield zone
 
     def export_rooms_config(self):
         if self.current_project_file:
@@ -5483,10 +6926,10 @@ class PlanEditorMainWindow(QMainWindow):
         if not fp:
             return
 
-        rooms_json_text, _ = self._prepare_export_payload()
+        rooms, _ = self._prepare_export_payload()
         try:
             with open(fp, "w", encoding="utf-8") as f:
-                f.write(rooms_json_text)
+                write_rooms_json(rooms, f)
             self.statusBar().showMessage("Экспорт объектов завершён.", 5000)
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Не удалось экспортировать:\n{e}")
@@ -5539,13 +6982,10 @@ class PlanEditorMainWindow(QMainWindow):
         if key_obj is None:
             return
 
-        ssh = None
         sftp = None
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=host, port=port, username=username, pkey=key_obj, allow_agent=False, look_for_keys=False)
-            sftp = ssh.open_sftp()
+            self._ssh_sessions.connect(host, port, username, key_obj)
+            sftp = self._ssh_sessions.open_sftp()
 
             remote_root_normalized = sftp.normalize(remote_root)
             project_names = []
@@ -5630,60 +7070,6 @@ class PlanEditorMainWindow(QMainWindow):
 
             remote_files: list[tuple[str, str, int]] = []
 
-            def read_remote_bytes(path_value: str) -> bytes | None:
-                try:
-                    with sftp.file(path_value, "rb") as remote_file:
-                        return remote_file.read()
-                except IOError:
-                    return None
-
-            def decode_json_payload(payload: bytes | None):
-                if not payload:
-                    return None
-                try:
-                    return json.loads(payload.decode("utf-8"))
-                except Exception:
-                    return None
-
-            def format_json_value(value) -> str:
-                if isinstance(value, str):
-                    return value
-                if value is None:
-                    return "null"
-                try:
-                    return json.dumps(value, ensure_ascii=False, sort_keys=True)
-                except TypeError:
-                    return str(value)
-
-            def diff_json_values(server_value, local_value, path: str = "") -> list[tuple[str, str, str]]:
-                if isinstance(server_value, dict) and isinstance(local_value, dict):
-                    diffs = []
-                    keys = sorted(set(server_value) | set(local_value), key=str)
-                    for key in keys:
-                        child_path = f"{path}.{key}" if path else str(key)
-                        if key not in server_value:
-                            diffs.append((child_path, "<нет>", format_json_value(local_value.get(key))))
-                        elif key not in local_value:
-                            diffs.append((child_path, format_json_value(server_value.get(key)), "<нет>"))
-                        else:
-                            diffs.extend(diff_json_values(server_value.get(key), local_value.get(key), child_path))
-                    return diffs
-                if isinstance(server_value, list) and isinstance(local_value, list):
-                    diffs = []
-                    max_len = max(len(server_value), len(local_value))
-                    for index in range(max_len):
-                        child_path = f"{path}[{index}]" if path else f"[{index}]"
-                        if index >= len(server_value):
-                            diffs.append((child_path, "<нет>", format_json_value(local_value[index])))
-                        elif index >= len(local_value):
-                            diffs.append((child_path, format_json_value(server_value[index]), "<нет>"))
-                        else:
-                            diffs.extend(diff_json_values(server_value[index], local_value[index], child_path))
-                    return diffs
-                if server_value != local_value:
-                    return [(path or "<root>", format_json_value(server_value), format_json_value(local_value))]
-                return []
-
             def format_timestamp(timestamp_value: float | int | None) -> str:
                 if not timestamp_value:
                     return "неизвестно"
@@ -5692,27 +7078,6 @@ class PlanEditorMainWindow(QMainWindow):
                 except (TypeError, ValueError, OSError):
                     return "неизвестно"
 
-            def extract_track_crc_map(data: dict | None) -> dict[str, str]:
-                result = {}
-                files_section = data.get("files") if isinstance(data, dict) else None
-                if not isinstance(files_section, list):
-                    return result
-                for item in files_section:
-                    if not isinstance(item, dict):
-                        continue
-                    name = item.get("name")
-                    crc = str(item.get("crc32", "") or "").strip().lower()
-                    if isinstance(name, str) and name and crc:
-                        result[name.replace("\\", "/")] = crc
-                return result
-
-            def read_local_bytes(path_value: str) -> bytes | None:
-                try:
-                    with open(path_value, "rb") as local_file:
-                        return local_file.read()
-                except OSError:
-                    return None
-
             def local_mtime(path_value: str) -> float:
                 try:
                     return os.path.getmtime(path_value)
@@ -5837,7 +7202,7 @@ class PlanEditorMainWindow(QMainWindow):
                 return result["action"]
 
             def remote_excursion_folder_name() -> str:
-                excurs_payload = read_remote_bytes(posixpath.join(remote_project_dir, "excurs.json"))
+                excurs_payload = read_remote_bytes(sftp, posixpath.join(remote_project_dir, "excurs.json"))
                 excurs_data = decode_json_payload(excurs_payload)
                 excursions = excurs_data.get("excursions") if isinstance(excurs_data, dict) else None
                 if isinstance(excursions, list) and excursions and isinstance(excursions[0], dict):
@@ -5917,9 +7282,10 @@ class PlanEditorMainWindow(QMainWindow):
 
                 local_tracks_data = decode_json_payload(read_local_bytes(self._tracks_json_path() or ""))
                 remote_tracks_path = posixpath.join(nested_remote_dir, "content", "tracks.json")
-                remote_tracks_data = decode_json_payload(read_remote_bytes(remote_tracks_path))
+                remote_tracks_data = decode_json_payload(read_remote_bytes(sftp, remote_tracks_path))
                 local_crc_map = extract_track_crc_map(local_tracks_data)
                 remote_crc_map = extract_track_crc_map(remote_tracks_data)
+                audio_cache = self._audio_metadata_cache()
                 local_existing_audio_names = collect_local_existing_audio_names(os.path.join(local_project_root, "content"))
                 remote_existing_audio_names = {
                     normalized_audio_key(display_name)
@@ -5956,7 +7322,9 @@ class PlanEditorMainWindow(QMainWindow):
                         reason = ""
                         if is_audio_display_name(display_name):
                             audio_key = normalized_audio_key(display_name)
-                            local_crc = local_crc_map.get(audio_key) or local_crc_map.get(os.path.basename(audio_key))
+                            local_crc = audio_cache.file_metadata(local_path)["crc32"]
+                            if not local_crc:
+                                local_crc = local_crc_map.get(audio_key) or local_crc_map.get(os.path.basename(audio_key))
                             remote_crc = remote_crc_map.get(audio_key) or remote_crc_map.get(os.path.basename(audio_key))
                             if local_crc and remote_crc:
                                 should_download = local_crc != remote_crc
@@ -5965,7 +7333,7 @@ class PlanEditorMainWindow(QMainWindow):
                             if should_download:
                                 reason = "CRC отличается" if local_crc and remote_crc else "размер файла отличается"
                         elif is_json_display_name(display_name):
-                            remote_payload = read_remote_bytes(remote_path)
+                            remote_payload = read_remote_bytes(sftp, remote_path)
                             local_payload = read_local_bytes(local_path)
                             remote_json = decode_json_payload(remote_payload)
                             local_json = decode_json_payload(local_payload)
@@ -5973,8 +7341,12 @@ class PlanEditorMainWindow(QMainWindow):
                             should_download = bool(json_diffs) if remote_json is not None and local_json is not None else remote_payload is not None and remote_payload != local_payload
                             if should_download:
                                 reason = "параметры изменились" if json_diffs else "содержимое отличается"
+                        elif os.path.getsize(local_path) != file_size:
+                            reason = "файл отличается"
+                        elif int(local_time) == int(remote_mtime):
+                            should_download = False
                         else:
-                            remote_payload = read_remote_bytes(remote_path)
+                            remote_payload = read_remote_bytes(sftp, remote_path)
                             local_payload = read_local_bytes(local_path)
                             should_download = remote_payload is not None and remote_payload != local_payload
                             if should_download:
@@ -6059,10 +7431,19 @@ class PlanEditorMainWindow(QMainWindow):
                     download_items.append((remote_path, local_path, relative_path, file_size, 0))
 
             os.makedirs(local_project_dir, exist_ok=True)
-            total_bytes = sum(item[3] for item in download_items)
-            downloaded_bytes = 0
-            file_index = 0
-            total_files = len(download_items)
+            download_jobs = []
+            for remote_path, local_path, display_name, file_size, remote_mtime in download_items:
+                job = {
+                    "remote_path": remote_path,
+                    "local_path": local_path,
+                    "display_name": display_name,
+                    "size": file_size,
+                    "mtime": remote_mtime,
+                }
+                if update_current_project and is_audio_display_name(display_name):
+                    audio_key = normalized_audio_key(display_name)
+                    job["crc32"] = remote_crc_map.get(audio_key) or remote_crc_map.get(os.path.basename(audio_key)) or ""
+                download_jobs.append(job)
 
             progress_dialog = QProgressDialog("Подготовка загрузки...", "Отмена", 0, 100, self)
             progress_dialog.setWindowTitle("Загрузка проекта с сервера")
@@ -6072,39 +7453,23 @@ class PlanEditorMainWindow(QMainWindow):
             progress_dialog.setAutoReset(False)
             progress_dialog.setValue(0)
 
-            def update_progress(file_label: str):
-                percent = int((downloaded_bytes / total_bytes) * 100) if total_bytes > 0 else 0
-                progress_dialog.setValue(min(percent, 100))
-                progress_dialog.setLabelText(
-                    f"Файл {file_index}/{total_files}: {file_label}\n"
-                    f"Прогресс: {downloaded_bytes / (1024 * 1024):.2f} / {total_bytes / (1024 * 1024):.2f} МБ"
-                )
-                QApplication.processEvents()
-
             try:
-                for remote_path, local_path, display_name, file_size, remote_mtime in download_items:
-                    if progress_dialog.wasCanceled():
-                        raise RuntimeError("Загрузка отменена пользователем.")
-                    file_index += 1
-                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                    update_progress(display_name)
-                    with sftp.file(remote_path, "rb") as remote_stream, open(local_path, "wb") as local_stream:
-                        while True:
-                            if progress_dialog.wasCanceled():
-                                raise RuntimeError("Загрузка отменена пользователем.")
-                            chunk = remote_stream.read(256 * 1024)
-                            if not chunk:
-                                break
-                            local_stream.write(chunk)
-                            downloaded_bytes += len(chunk)
-                            update_progress(display_name)
-                    if file_size and os.path.getsize(local_path) != file_size:
-                        raise IOError(f"Размер файла не совпал после загрузки: {display_name}")
-                    if remote_mtime:
-                        try:
-                            os.utime(local_path, (remote_mtime, remote_mtime))
-                        except OSError:
-                            pass
+                download_results = []
+                download_error = self._run_sftp_transfer(
+                    SftpDownloadWorker(self._ssh_sessions.open_sftp, download_jobs, connection_settings["transfer_channels"], self),
+                    progress_dialog,
+                    download_results,
+                )
+                if update_current_project:
+                    downloaded_names = {name for name, ok, _ in download_results if ok}
+                    for job in download_jobs:
+                        if job.get("crc32") and job["display_name"] in downloaded_names:
+                            try:
+                                audio_cache.store(job["local_path"], job["crc32"])
+                            except OSError:
+                                pass
+                if download_error:
+                    raise IOError(download_error)
                 if update_current_project:
                     for audio_name, local_path in local_audio_to_delete:
                         try:
@@ -6128,16 +7493,10 @@ class PlanEditorMainWindow(QMainWindow):
                     sftp.close()
                 except Exception:
                     pass
-            if ssh is not None:
-                try:
-                    ssh.close()
-                except Exception:
-                    pass
 
         if update_current_project:
             current_file = self.current_project_file
-            if current_file and os.path.isfile(current_file):
-                self._load_project_file(current_file)
+            if current_file and os.path.isfile(current_file) and self._load_project_file(current_file):
                 self._sync_project_file_and_auxiliary_configs(show_errors=False)
                 self._mark_state_as_saved()
             self.statusBar().showMessage("Текущий проект обновлён с сервера.", 7000)
@@ -6183,11 +7542,45 @@ class PlanEditorMainWindow(QMainWindow):
 
         QMessageBox.information(self, "Загрузка проекта с сервера", f"Проект загружен в папку:\n{local_project_dir}")
 
+    def _run_sftp_transfer(self, worker: SftpTransferWorker, progress_dialog: QProgressDialog, results: list) -> str:
+        def on_progress(bytes_done, total_bytes, files_done, files_total, speed, eta, label):
+            percent = int((bytes_done / total_bytes) * 100) if total_bytes > 0 else 0
+            progress_dialog.setValue(min(percent, 100))
+            progress_dialog.setLabelText(
+                f"Файлов: {files_done}/{files_total} (каналов: {worker.channels})\n"
+                f"{label}\n"
+                f"Прогресс: {bytes_done / (1024 * 1024):.2f} / {total_bytes / (1024 * 1024):.2f} МБ\n"
+                f"{format_transfer_stats(speed, eta)}"
+            )
+
+        def on_file_finished(display_name, ok, message):
+            results.append((display_name, ok, message))
+            if ok:
+                self.statusBar().showMessage(f"Передан файл: {display_name}")
+
+        loop = QEventLoop()
+        worker.progress.connect(on_progress)
+        worker.file_finished.connect(on_file_finished)
+        worker.finished.connect(loop.quit)
+        progress_dialog.canceled.connect(worker.cancel)
+        worker.start()
+        loop.exec()
+        worker.wait()
+        error = worker.error
+        worker.jobs = []
+        worker.deleteLater()
+        return error
+
     def upload_config_to_server(self):
         if self.current_project_file:
             if not self._sync_project_file_and_auxiliary_configs(show_errors=True):
                 return
-        rooms_json_text, tracks_data = self._prepare_export_payload()
+        rooms, tracks_data = self._prepare_export_payload()
+        try:
+            validate_rooms_model(rooms)
+        except RoomsValidationError as exc:
+            QMessageBox.warning(self, "Выгрузка на сервер", f"Конфигурация содержит повторяющиеся номера и не будет выгружена:\n{exc}")
+            return
         self._merge_unmatched_audio_files_into_tracks_data(tracks_data)
         self._merge_language_audio_files_into_tracks_data(tracks_data)
         self._merge_existing_tracks_metadata(tracks_data)
@@ -6218,7 +7611,7 @@ class PlanEditorMainWindow(QMainWindow):
             return
 
         tracks_json_text = json.dumps(tracks_data, ensure_ascii=False, indent=4)
-        rooms_bytes = rooms_json_text.encode("utf-8")
+        rooms_bytes = render_rooms_json(rooms).encode("utf-8")
         tracks_bytes = tracks_json_text.encode("utf-8")
         system_config_bytes: dict[str, bytes] = {}
         for filename, path in self._system_config_paths().items():
@@ -6230,85 +7623,14 @@ class PlanEditorMainWindow(QMainWindow):
             except OSError:
                 continue
 
-        ssh = None
         sftp = None
         normalized_target_directory = ""
         export_folder_name = ""
         upload_results: list[tuple[str, bool, str]] = []
         progress_dialog = None
 
-        bytes_uploaded = 0
-        total_bytes_to_upload = 0
-        file_index = 0
-        total_files_count = 0
-
-        def update_progress(file_label: str):
-            if progress_dialog is None:
-                return
-            percent = int((bytes_uploaded / total_bytes_to_upload) * 100) if total_bytes_to_upload > 0 else 0
-            progress_dialog.setValue(min(percent, 100))
-            progress_dialog.setLabelText(
-                f"Файл {file_index}/{total_files_count}: {file_label}\n"
-                f"Прогресс: {bytes_uploaded / (1024 * 1024):.2f} / {total_bytes_to_upload / (1024 * 1024):.2f} МБ"
-            )
-            QApplication.processEvents()
-
-        def upload_bytes(remote_path: str, payload: bytes, display_name: str):
-            nonlocal bytes_uploaded, file_index
-            chunk_size = 256 * 1024
-            uploaded_for_file = 0
-            file_size = len(payload)
-            file_index += 1
-            update_progress(display_name)
-            with sftp.file(remote_path, "wb") as remote_file:
-                while uploaded_for_file < file_size:
-                    if progress_dialog is not None and progress_dialog.wasCanceled():
-                        raise RuntimeError("Выгрузка отменена пользователем.")
-                    next_chunk = payload[uploaded_for_file:uploaded_for_file + chunk_size]
-                    remote_file.write(next_chunk)
-                    uploaded_for_file += len(next_chunk)
-                    bytes_uploaded += len(next_chunk)
-                    update_progress(display_name)
-                remote_file.flush()
-            upload_results.append((display_name, True, "OK"))
-
-        def upload_local_file(local_path: str, remote_path: str, display_name: str):
-            nonlocal bytes_uploaded, file_index
-            chunk_size = 256 * 1024
-            file_size = os.path.getsize(local_path)
-            uploaded_for_file = 0
-            file_index += 1
-            update_progress(display_name)
-            with open(local_path, "rb") as local_stream, sftp.file(remote_path, "wb") as remote_stream:
-                while True:
-                    if progress_dialog is not None and progress_dialog.wasCanceled():
-                        raise RuntimeError("Выгрузка отменена пользователем.")
-                    chunk = local_stream.read(chunk_size)
-                    if not chunk:
-                        break
-                    remote_stream.write(chunk)
-                    uploaded_for_file += len(chunk)
-                    bytes_uploaded += len(chunk)
-                    update_progress(display_name)
-                remote_stream.flush()
-
-            if uploaded_for_file != file_size:
-                upload_results.append((display_name, False, "Размер файла не совпал после передачи"))
-                raise IOError(f"Файл передан не полностью: {display_name}")
-            upload_results.append((display_name, True, "OK"))
-
-        def ensure_remote_dirs(path_value: str):
-            normalized = path_value.replace("\\", "/")
-            if not normalized:
-                return
-            parts = [part for part in normalized.split("/") if part]
-            current = "/" if normalized.startswith("/") else ""
-            for part in parts:
-                current = f"{current}/{part}" if current else part
-                try:
-                    sftp.listdir(current)
-                except IOError:
-                    sftp.mkdir(current)
+        remote_manifest: dict = {}
+        known_remote_dirs: set[str] = set()
 
         def remote_exists(path_value: str) -> bool:
             try:
@@ -6317,72 +7639,19 @@ class PlanEditorMainWindow(QMainWindow):
             except IOError:
                 return False
 
-        def read_remote_bytes(path_value: str) -> bytes | None:
-            try:
-                with sftp.file(path_value, "rb") as remote_file:
-                    return remote_file.read()
-            except IOError:
-                return None
-
-        def extract_track_crc_map(data: dict | None) -> dict[str, str]:
-            result = {}
-            files_section = data.get("files") if isinstance(data, dict) else None
-            if not isinstance(files_section, list):
-                return result
-            for item in files_section:
-                if not isinstance(item, dict):
-                    continue
-                name = item.get("name")
-                crc = str(item.get("crc32", "") or "").strip().lower()
-                if isinstance(name, str) and name and crc:
-                    result[name.replace("\\", "/")] = crc
-            return result
-
-        def collect_local_existing_audio_names() -> set[str]:
-            content_dir = self._get_effective_content_dir()
-            if not content_dir or not os.path.isdir(content_dir):
-                return set()
-            result: set[str] = set()
-            for root, _, files in os.walk(content_dir):
-                for filename in files:
-                    if not filename.lower().endswith(".mp3"):
-                        continue
-                    full_path = os.path.join(root, filename)
-                    rel_path = os.path.relpath(full_path, content_dir).replace("\\", "/")
-                    result.add(rel_path)
-            return result
-
         local_track_crc_map = extract_track_crc_map(tracks_data)
-        local_existing_audio_names = collect_local_existing_audio_names()
+        local_existing_audio_names = collect_local_audio_names(self._get_effective_content_dir())
 
         def remote_track_crc_map(remote_tracks_path: str) -> dict[str, str]:
-            payload = read_remote_bytes(remote_tracks_path)
-            if not payload:
-                return {}
-            try:
-                remote_data = json.loads(payload.decode("utf-8"))
-            except Exception:
-                return {}
-            return extract_track_crc_map(remote_data)
+            return extract_track_crc_map(decode_json_payload(read_remote_bytes(sftp, remote_tracks_path)))
 
         def collect_remote_existing_audio_paths(remote_content_dir: str) -> dict[str, str]:
-            result: dict[str, str] = {}
-
-            def walk(remote_dir: str, relative_dir: str = ""):
-                try:
-                    entries = sftp.listdir_attr(remote_dir)
-                except IOError:
-                    return
-                for entry in entries:
-                    remote_path = posixpath.join(remote_dir, entry.filename)
-                    relative_path = posixpath.join(relative_dir, entry.filename) if relative_dir else entry.filename
-                    if stat.S_ISDIR(entry.st_mode or 0):
-                        walk(remote_path, relative_path)
-                    elif entry.filename.lower().endswith(".mp3"):
-                        result[relative_path.replace("\\", "/")] = remote_path
-
-            walk(remote_content_dir)
-            return result
+            prefix = remote_content_dir.rstrip("/") + "/"
+            return {
+                remote_path[len(prefix):]: remote_path
+                for remote_path in remote_manifest
+                if remote_path.startswith(prefix) and remote_path.lower().endswith(".mp3")
+            }
 
         def local_payload_for_upload_item(item_type: str, source: str) -> bytes | None:
             if item_type == "bytes":
@@ -6413,72 +7682,9 @@ class PlanEditorMainWindow(QMainWindow):
             except OSError:
                 return 0
 
-        def is_json_display_name(display_name: str) -> bool:
-            return display_name.lower().endswith(".json")
-
         def is_audio_display_name(display_name: str) -> bool:
             return display_name.lower().endswith(".mp3")
 
-        def excursion_folder_name() -> str:
-            excurs_data = self._load_system_config("excurs.json")
-            excursions = excurs_data.get("excursions") if isinstance(excurs_data, dict) else None
-            if isinstance(excursions, list) and excursions and isinstance(excursions[0], dict):
-                path_value = str(excursions[0].get("path", "") or "").strip()
-                if path_value:
-                    return self._sanitize_name_for_folder(path_value) or path_value
-                name_value = str(excursions[0].get("name", "") or "").strip()
-                if name_value:
-                    return self._sanitize_name_for_folder(name_value) or name_value
-            project_label = self._project_label_for_configs()
-            return self._sanitize_name_for_folder(project_label) or project_label
-
-        def decode_json_payload(payload: bytes | None):
-            if not payload:
-                return None
-            try:
-                return json.loads(payload.decode("utf-8"))
-            except Exception:
-                return None
-
-        def format_json_value(value) -> str:
-            if isinstance(value, str):
-                return value
-            if value is None:
-                return "null"
-            try:
-                return json.dumps(value, ensure_ascii=False, sort_keys=True)
-            except TypeError:
-                return str(value)
-
-        def diff_json_values(server_value, local_value, path: str = "") -> list[tuple[str, str, str]]:
-            if isinstance(server_value, dict) and isinstance(local_value, dict):
-                diffs = []
-                keys = sorted(set(server_value) | set(local_value), key=str)
-                for key in keys:
-                    child_path = f"{path}.{key}" if path else str(key)
-                    if key not in server_value:
-                        diffs.append((child_path, "<нет>", format_json_value(local_value.get(key))))
-                    elif key not in local_value:
-                        diffs.append((child_path, format_json_value(server_value.get(key)), "<нет>"))
-                    else:
-                        diffs.extend(diff_json_values(server_value.get(key), local_value.get(key), child_path))
-                return diffs
-            if isinstance(server_value, list) and isinstance(local_value, list):
-                diffs = []
-                max_len = max(len(server_value), len(local_value))
-                for index in range(max_len):
-                    child_path = f"{path}[{index}]" if path else f"[{index}]"
-                    if index >= len(server_value):
-                        diffs.append((child_path, "<нет>", format_json_value(local_value[index])))
-                    elif index >= len(local_value):
-                        diffs.append((child_path, format_json_value(server_value[index]), "<нет>"))
-                    else:
-                        diffs.extend(diff_json_values(server_value[index], local_value[index], child_path))
-                return diffs
-            if server_value != local_value:
-                return [(path or "<root>", format_json_value(server_value), format_json_value(local_value))]
-            return []
-
         def format_timestamp(timestamp_value: float | int | None) -> str:
             if not timestamp_value:
                 return "неизвестно"
@@ -6587,25 +7793,10 @@ class PlanEditorMainWindow(QMainWindow):
             return result["action"]
 
         try:
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(hostname=host, port=port, username=username, pkey=key_obj, allow_agent=False, look_for_keys=False)
-            sftp = ssh.open_sftp()
-
-            remote_dir_clean = remote_dir.replace("\\", "/").strip()
-            remote_dir_effective = remote_dir_clean
-            if remote_dir_effective and remote_dir_effective not in (".", "./"):
-                if remote_dir_effective.startswith("~"):
-                    try:
-                        home_dir = sftp.normalize(".")
-                    except IOError:
-                        home_dir = sftp.normalize("~")
-                    subpath = remote_dir_effective[1:].lstrip("/")
-                    remote_dir_effective = posixpath.join(home_dir, subpath) if subpath else home_dir
-                ensure_remote_dirs(remote_dir_effective)
-                base_dir = sftp.normalize(remote_dir_effective)
-            else:
-                base_dir = sftp.normalize(".")
+            self._ssh_sessions.connect(host, port, username, key_obj)
+            sftp = self._ssh_sessions.open_sftp()
+
+            base_dir = resolve_remote_base_dir(sftp, remote_dir, known_remote_dirs)
 
             try:
                 default_projects_dir = sftp.normalize(DEFAULT_REMOTE_PROJECTS_DIR)
@@ -6622,13 +7813,20 @@ class PlanEditorMainWindow(QMainWindow):
             else:
                 export_folder_name = self._build_remote_export_folder_name()
             target_directory = posixpath.join(base_dir, export_folder_name)
-            ensure_remote_dirs(target_directory)
+            ensure_remote_dirs(sftp, target_directory, known_remote_dirs)
             normalized_target_directory = sftp.normalize(target_directory)
+            if is_direct_ftpradiog_upload:
+                manifest_files, manifest_dirs = build_remote_manifest(sftp, normalized_target_directory)
+                remote_manifest.update(manifest_files)
+                known_remote_dirs.update(manifest_dirs)
 
-            nested_project_dir = posixpath.join(normalized_target_directory, excursion_folder_name())
+            nested_project_dir = posixpath.join(
+                normalized_target_directory,
+                excursion_folder_name(self._load_system_config("excurs.json"), self._project_label_for_configs()),
+            )
             tracks_content_dir = posixpath.join(nested_project_dir, "content")
             if upload_full_project:
-                ensure_remote_dirs(tracks_content_dir)
+                ensure_remote_dirs(sftp, tracks_content_dir, known_remote_dirs)
 
             rooms_remote_path = posixpath.join(normalized_target_directory, "rooms.json")
             tracks_remote_path = posixpath.join(tracks_content_dir, "tracks.json")
@@ -6668,12 +7866,12 @@ class PlanEditorMainWindow(QMainWindow):
                     raise IOError("Не удалось определить структуру локального проекта для полной выгрузки.")
 
                 root_remote_dir = nested_project_dir if is_direct_ftpradiog_upload else posixpath.join(normalized_target_directory, os.path.basename(local_root_dir))
-                ensure_remote_dirs(root_remote_dir)
+                ensure_remote_dirs(sftp, root_remote_dir, known_remote_dirs)
 
                 for root, _, files in os.walk(local_root_dir):
                     rel_root = os.path.relpath(root, local_root_dir)
                     remote_root = root_remote_dir if rel_root == "." else posixpath.join(root_remote_dir, rel_root.replace("\\", "/"))
-                    ensure_remote_dirs(remote_root)
+                    ensure_remote_dirs(sftp, remote_root, known_remote_dirs)
                     for filename in files:
                         local_path = os.path.join(root, filename)
                         remote_path = posixpath.join(remote_root, filename)
@@ -6710,51 +7908,24 @@ class PlanEditorMainWindow(QMainWindow):
                         compare_dialog.setLabelText(f"Сравнение {index}/{len(files_to_upload)}:\n{display_name}")
                         QApplication.processEvents()
 
-                        try:
-                            remote_stat = sftp.stat(remote_path)
-                        except IOError:
-                            remote_stat = None
+                        remote_stat = remote_manifest.get(remote_path)
                         if remote_stat is None:
                             filtered_files.append((item_type, remote_path, size_value, display_name, source))
                             compare_dialog.setValue(index)
                             QApplication.processEvents()
                             continue
 
-                        json_diffs = []
-                        should_upload = True
-                        replacement_reason = ""
-                        if is_audio_display_name(display_name):
-                            normalized_audio_name = display_name.replace("\\", "/")
-                            if normalized_audio_name.startswith("content/"):
-                                normalized_audio_name = normalized_audio_name[len("content/"):]
-                            local_crc = local_track_crc_map.get(normalized_audio_name)
-                            remote_crc = remote_crc_map.get(normalized_audio_name)
-                            if local_crc is None:
-                                local_crc = local_track_crc_map.get(os.path.basename(normalized_audio_name))
-                            if remote_crc is None:
-                                remote_crc = remote_crc_map.get(os.path.basename(normalized_audio_name))
-                            if local_crc and remote_crc:
-                                should_upload = local_crc != remote_crc
-                            else:
-                                should_upload = False
-                            if should_upload:
-                                replacement_reason = "CRC отличается"
-                        elif is_json_display_name(display_name):
-                            local_payload = local_payload_for_upload_item(item_type, source)
-                            remote_payload = read_remote_bytes(remote_path)
-                            local_json = decode_json_payload(local_payload)
-                            remote_json = decode_json_payload(remote_payload)
-                            json_diffs = diff_json_values(remote_json, local_json) if local_json is not None and remote_json is not None else []
-                            should_upload = bool(json_diffs) if local_json is not None and remote_json is not None else local_payload is not None and local_payload != remote_payload
-                            if should_upload:
-                                replacement_reason = "параметры изменились" if json_diffs else "содержимое отличается"
-                        else:
-                            local_payload = local_payload_for_upload_item(item_type, source)
-                            remote_payload = read_remote_bytes(remote_path)
-                            should_upload = local_payload is not None and local_payload != remote_payload
-                            if should_upload:
-                                replacement_reason = "файл отличается"
-
+                        should_upload, replacement_reason, json_diffs = compare_upload_item(
+                            item_type,
+                            display_name,
+                            size_value,
+                            remote_stat,
+                            local_mtime_for_upload_item(item_type, source),
+                            lambda: local_payload_for_upload_item(item_type, source),
+                            lambda: read_remote_bytes(sftp, remote_path),
+                            local_track_crc_map,
+                            remote_crc_map,
+                        )
                         if should_upload:
                             local_time = local_mtime_for_upload_item(item_type, source)
                             remote_time = remote_stat.st_mtime or 0
@@ -6776,9 +7947,7 @@ class PlanEditorMainWindow(QMainWindow):
                 existing_extra_remote_audio = []
                 for audio_name in extra_remote_audio:
                     remote_path = remote_existing_audio_paths.get(audio_name) or posixpath.join(tracks_content_dir, audio_name.replace("\\", "/"))
-                    try:
-                        sftp.stat(remote_path)
-                    except IOError:
+                    if remote_path not in remote_manifest:
                         continue
                     existing_extra_remote_audio.append(audio_name)
                 extra_remote_audio = existing_extra_remote_audio
@@ -6839,8 +8008,17 @@ class PlanEditorMainWindow(QMainWindow):
 
                 files_to_upload = filtered_files
 
-            total_bytes_to_upload = sum(item[2] for item in files_to_upload)
-            total_files_count = len(files_to_upload)
+            upload_jobs = []
+            for item_type, remote_path, size_value, display_name, source in files_to_upload:
+                job = {"remote_path": remote_path, "size": size_value, "display_name": display_name}
+                if item_type == "bytes":
+                    job["payload"] = local_payload_for_upload_item(item_type, source)
+                else:
+                    job["local_path"] = source
+                    job["mtime"] = local_mtime_for_upload_item(item_type, source)
+                    if is_audio_display_name(source):
+                        job["crc32"] = self._audio_metadata_cache().file_metadata(source)["crc32"]
+                upload_jobs.append(job)
             progress_dialog = QProgressDialog("Подготовка выгрузки...", "Отмена", 0, 100, self)
             progress_dialog.setWindowTitle("Выгрузка на сервер")
             progress_dialog.setWindowModality(Qt.WindowModal)
@@ -6849,19 +8027,13 @@ class PlanEditorMainWindow(QMainWindow):
             progress_dialog.setAutoReset(False)
             progress_dialog.setValue(0)
             progress_dialog.setMaximum(100)
-
-            for item_type, remote_path, _, display_name, source in files_to_upload:
-                self.statusBar().showMessage(f"Загрузка: {display_name}")
-                if item_type == "bytes":
-                    if source == "rooms.json":
-                        payload = rooms_bytes
-                    elif source == "tracks.json":
-                        payload = tracks_bytes
-                    else:
-                        payload = system_config_bytes[source]
-                    upload_bytes(remote_path, payload, display_name)
-                else:
-                    upload_local_file(source, remote_path, display_name)
+            upload_error = self._run_sftp_transfer(
+                SftpUploadWorker(self._ssh_sessions.open_sftp, upload_jobs, connection_settings["transfer_channels"], self),
+                progress_dialog,
+                upload_results,
+            )
+            if upload_error:
+                raise IOError(upload_error)
 
             if is_direct_ftpradiog_upload:
                 for audio_name, remote_path in remote_audio_to_delete:
@@ -6887,11 +8059,6 @@ class PlanEditorMainWindow(QMainWindow):
                     sftp.close()
                 except Exception:
                     pass
-            if ssh is not None:
-                try:
-                    ssh.close()
-                except Exception:
-                    pass
 
         mode_suffix = "Проект целиком" if upload_full_project else "Только конфигурация"
         self.statusBar().showMessage(f"Выгрузка на сервер завершена ({mode_suffix}).", 7000)
@@ -6907,447 +8074,18 @@ class PlanEditorMainWindow(QMainWindow):
         QMessageBox.information(self, "Выгрузка на сервер", message_text)
 
 
-    def _prepare_export_payload(self) -> tuple[str, dict]:
-        config = {"rooms": []}
-        audio_files_map: dict[str, dict] = {}
-        track_entries_map: dict[str, dict] = {}
-        anchor_bound_flags = {a.number: bool(a.bound_explicit) for a in self.anchors}
-        anchor_start_flags = {a.number: bool(getattr(a, "start", False)) for a in self.anchors}
-        anchor_zone_halls: dict[int, set[int]] = {}
-
-        for pz in self.proximity_zones:
-            if not pz.anchor:
-                continue
-            halls = pz.halls or ([pz.anchor.main_hall_number] if pz.anchor else [])
-            for hall_num in halls:
-                if not isinstance(hall_num, int):
-                    continue
-                anchor_zone_halls.setdefault(pz.anchor.number, set()).add(hall_num)
-
-        def _bytes_from_b64(b64str: str) -> int:
-            if not b64str:
-                return 0
-            try:
-                return len(base64.b64decode(b64str.encode("ascii")))
-            except Exception:
-                return 0
-
-        def _extract_size(info: dict | None) -> int:
-            if not isinstance(info, dict):
-                return 0
-            try:
-                size_val = int(info.get("size") or 0)
-            except (TypeError, ValueError):
-                size_val = 0
-            if size_val <= 0:
-                size_val = _bytes_from_b64(info.get("data", ""))
-            return max(size_val, 0)
-
-        def _extract_crc32(info: dict | None) -> str:
-            if not isinstance(info, dict):
-                return ""
-            payload = info.get("data")
-            if not payload:
-                crc_value = str(info.get("crc32", "") or "").strip().lower()
-                return crc_value
-            try:
-                raw_bytes = base64.b64decode(payload.encode("ascii"))
-            except Exception:
-                return ""
-            crc = 0
-            for offset in range(0, len(raw_bytes), 4096):
-                crc = zlib.crc32(raw_bytes[offset:offset + 4096], crc)
-            return f"{crc & 0xFFFFFFFF:08x}"
-
-        def _register_audio_file(name: str, size_bytes: int, crc32_hex: str):
-            existing = audio_files_map.get(name)
-            if existing is None:
-                audio_files_map[name] = {
-                    "size": max(size_bytes, 0),
-                    "crc32": crc32_hex
-                }
-                return
-            existing["size"] = max(int(existing.get("size", 0)), max(size_bytes, 0))
-            if crc32_hex:
-                existing["crc32"] = crc32_hex
-
-        def collect_audio_files(info: dict | None):
-            if not isinstance(info, dict):
-                return
-            name = info.get("filename")
-            if isinstance(name, str) and name:
-                size_bytes = _extract_size(info)
-                _register_audio_file(name, size_bytes, _extract_crc32(info))
-            secondary = info.get("secondary")
-            if isinstance(secondary, dict):
-                sec_name = secondary.get("filename")
-                if isinstance(sec_name, str) and sec_name:
-                    size_bytes2 = _extract_size(secondary)
-                    _register_audio_file(sec_name, size_bytes2, _extract_crc32(secondary))
-
-        def create_track_entry(info: dict | None, room_id: int, is_hall: bool):
-            if not isinstance(info, dict):
-                return None
-            filename = info.get("filename")
-            if not filename:
-                return None
-            base_id = extract_track_id(filename)
-            extras = [i for i in info.get("extra_ids", []) if isinstance(i, int)]
-
-            entry = {
-                "audio": filename,
-                "hall": is_hall,
-                "id": base_id,
-                "name": "",
-                "play_once": bool(info.get("play_once", False)),
-                "reset": bool(info.get("reset", False)),
-                "room_id": room_id,
-                "term": bool(info.get("interruptible", True))
-            }
-
-            if extras:
-                seen = set()
-                merged = []
-                for mid in [base_id] + extras:
-                    if mid in seen:
-                        continue
-                    seen.add(mid)
-                    merged.append(mid)
-                entry["multi_id"] = merged
-
-            secondary = info.get("secondary")
-            if isinstance(secondary, dict) and secondary.get("filename"):
-                entry["audio2"] = secondary["filename"]
-                entry["extra"] = True
-            return entry
-
-        def register_track_entry(entry: dict | None):
-            if not isinstance(entry, dict):
-                return
-            key = entry.get("audio")
-            if not key:
-                return
-            existing = track_entries_map.get(key)
-            if existing is None:
-                track_entries_map[key] = entry
-                return
-
-            existing["hall"] = bool(existing.get("hall")) or bool(entry.get("hall"))
-
-            new_room = entry.get("room_id")
-            old_room = existing.get("room_id")
-            if isinstance(new_room, int):
-                if not isinstance(old_room, int):
-                    existing["room_id"] = new_room
-                else:
-                    existing["room_id"] = min(old_room, new_room)
-
-            if entry.get("audio2") and not existing.get("audio2"):
-                existing["audio2"] = entry["audio2"]
-
-            if entry.get("extra"):
-                existing["extra"] = True
-
-            existing["play_once"] = bool(existing.get("play_once")) or bool(entry.get("play_once"))
-            existing["reset"] = bool(existing.get("reset")) or bool(entry.get("reset"))
-            existing["term"] = bool(existing.get("term", True)) and bool(entry.get("term", True))
-
-            combined_ids: set[int] = set()
-            for value in (existing.get("id"), entry.get("id")):
-                if isinstance(value, int):
-                    combined_ids.add(value)
-            for seq in (existing.get("multi_id"), entry.get("multi_id")):
-                if isinstance(seq, list):
-                    for value in seq:
-                        if isinstance(value, int):
-                            combined_ids.add(value)
-            base_id = existing.get("id")
-            if isinstance(base_id, int) and base_id in combined_ids:
-                combined_ids.remove(base_id)
-            if combined_ids:
-                existing["multi_id"] = sorted(combined_ids)
-            elif "multi_id" in existing:
-                existing.pop("multi_id")
-
-        # === rooms.json ===
-        for h in self.halls:
-            w_m = fix_negative_zero(round(h.rect().width() / (self.scene.pixel_per_cm_x * 100), 1))
-            h_m = fix_negative_zero(round(h.rect().height() / (self.scene.pixel_per_cm_x * 100), 1))
-
-            room = {
-                "num": h.number,
-                "width": w_m,
-                "height": h_m,
-                "anchors": [],
-                "zones": []
-            }
-            if h.extra_tracks:
-                room["extra_tracks"] = sorted({int(x) for x in h.extra_tracks if isinstance(x, int)})
-
-            for a in self.anchors:
-                if a.main_hall_number == h.number or h.number in a.extra_halls:
-                    lp = h.mapFromScene(a.scenePos())
-                    xm = fix_negative_zero(round(lp.x() / (self.scene.pixel_per_cm_x * 100), 1))
-                    ym = fix_negative_zero(round((h.rect().height() - lp.y()) / (self.scene.pixel_per_cm_x * 100), 1))
-                    ae = {"id": a.number, "x": xm, "y": ym, "z": fix_negative_zero(round(a.z / 100, 1))}
-                    if anchor_bound_flags.get(a.number, False):
-                        ae["bound"] = True
-                    if anchor_start_flags.get(a.number, False):
-                        ae["start"] = True
-                    if h.number in anchor_zone_halls.get(a.number, set()):
-                        ae["anch_zone"] = True
-                    room["anchors"].append(ae)
-
-            zones: dict[int, dict] = {}
-            default = {"x": 0, "y": 0, "w": 0, "h": 0, "angle": 0}
-            for ch in h.childItems():
-                if isinstance(ch, RectZoneItem):
-                    n = ch.zone_num
-                    if n not in zones:
-                        zones[n] = {"num": n, "enter": default.copy(), "exit": default.copy()}
-                    dz = ch.get_export_data()
-                    if ch.zone_type == "Входная зона":
-                        zones[n]["enter"] = dz
-                    elif ch.zone_type == "Выходная зона":
-                        zones[n]["exit"] = dz
-                    elif ch.zone_type == "Переходная":
-                        zones[n]["enter"] = dz
-                        zones[n]["bound"] = True
-
-            for z in zones.values():
-                room["zones"].append(z)
-
-            for pz in self.proximity_zones:
-                if not pz.anchor:
-                    continue
-                halls = pz.halls or ([pz.anchor.main_hall_number] if pz.anchor else [])
-                if h.number not in halls:
-                    continue
-                pz_entry = {
-                    "num": pz.zone_num,
-                    "anch_zone": True,
-                    "anchor_id": pz.anchor.number if pz.anchor else None,
-                    "dist_in": fix_negative_zero(round(pz.dist_in, 1)),
-                    "dist_out": fix_negative_zero(round(pz.dist_out, 1)),
-                }
-                if pz.bound:
-                    pz_entry["bound"] = True
-                if pz.blacklist:
-                    pz_entry["blist"] = list(pz.blacklist)
-                room["zones"].append(pz_entry)
-
-            config["rooms"].append(room)
-
-            if h.audio_settings:
-                collect_audio_files(h.audio_settings)
-                register_track_entry(create_track_entry(h.audio_settings, h.number, True))
-            for _, audio_info in sorted(h.zone_audio_tracks.items()):
-                if not audio_info:
-                    continue
-                collect_audio_files(audio_info)
-                register_track_entry(create_track_entry(audio_info, h.number, False))
-
-        for pz in self.proximity_zones:
-            if not pz.audio_info:
-                continue
-            halls = pz.halls or ([] if not pz.anchor else [pz.anchor.main_hall_number])
-            hall_numbers = [h for h in halls if isinstance(h, int)]
-            room_id = min(hall_numbers) if hall_numbers else (pz.anchor.main_hall_number if pz.anchor else 0)
-            collect_audio_files(pz.audio_info)
-            register_track_entry(create_track_entry(pz.audio_info, room_id if room_id is not None else 0, False))
-
-        rooms_strs = []
-        for room in config["rooms"]:
-            lines = [
-                "{",
-                f'"num": {room["num"]},',
-                f'"width": {room["width"]},',
-                f'"height": {room["height"]},',
-                (f'"extra_tracks": {json.dumps(room["extra_tracks"], ensure_ascii=False)},' if room.get("extra_tracks") else None),
-                '"anchors": ['
-            ]
-            lines = [line for line in lines if line is not None]
-            alines = []
-            for a in room["anchors"]:
-                s = f'{{ "id": {a["id"]}, "x": {a["x"]}, "y": {a["y"]}, "z": {a["z"]}'
-                if a.get("bound"):
-                    s += ', "bound": true'
-                if a.get("start"):
-                    s += ', "start": true'
-                if a.get("anch_zone"):
-                    s += ', "anch_zone": true'
-                s += " }"
-                alines.append(s)
-            lines.append(",\n".join(alines))
-            lines.append("],")
-            lines.append('"zones": [')
-            zlines = []
-            for z in room["zones"]:
-                if z.get("anch_zone"):
-                    zl = "{"
-                    zl += f'\n"num": {z.get("num", 0)},'
-                    zl += f'\n"anch_zone": true,'
-                    zl += f'\n"anchor_id": {z.get("anchor_id", 0)},'
-                    zl += f'\n"dist_in": {z.get("dist_in", 0)},'
-                    zl += f'\n"dist_out": {z.get("dist_out", 0)}'
-                    if z.get("bound"):
-                        zl += ',\n"bound": true'
-                    if z.get("blist"):
-                        zl += f',\n"blist": {json.dumps(z.get("blist"))}'
-                    zl += "\n}"
-                else:
-                    zl = "{"
-                    zl += f'\n"num": {z["num"]},'
-                    zl += (
-                        f'\n"enter": {{ "x": {z["enter"]["x"]}, "y": {z["enter"]["y"]}, '
-                        f'"w": {z["enter"]["w"]}, "h": {z["enter"]["h"]}, '
-                        f'"angle": {z["enter"]["angle"]} }},'
-                    )
-                    zl += (
-                        f'\n"exit":  {{ "x": {z["exit"]["x"]}, "y": {z["exit"]["y"]}, '
-                        f'"w": {z["exit"]["w"]}, "h": {z["exit"]["h"]}, '
-                        f'"angle": {z["exit"]["angle"]} }}'
-                    )
-                    if z.get("bound"):
-                        zl += ',\n"bound": true'
-                    zl += "\n}"
-                zlines.append(zl)
-            lines.append(",\n".join(zlines))
-            lines.append("]")
-            lines.append("}")
-            rooms_strs.append("\n".join(lines))
-
-        rooms_json_text = '{\n"rooms": [\n' + ",\n".join(rooms_strs) + "\n]\n}"
-
-        track_entries = list(track_entries_map.values())
-
-        def _sort_key(item: dict):
-            room_id = item.get("room_id")
-            if not isinstance(room_id, int):
-                try:
-                    room_id = int(room_id)
-                except (TypeError, ValueError):
-                    room_id = 0
-            return (
-                room_id,
-                not bool(item.get("hall")),
-                item.get("id", 0),
-                item.get("audio", "")
-            )
-
-        track_entries.sort(key=_sort_key)
-        files_list = []
-        for name in sorted(audio_files_map):
-            file_info = audio_files_map[name]
-            files_list.append({
-                "name": name,
-                "size": int(file_info.get("size", 0)),
-                "crc32": file_info.get("crc32", "")
-            })
-        tracks_data = {
-            "files": files_list,
-            "langs": [],
-            "tracks": track_entries
-        }
-
-        return rooms_json_text, tracks_data
+    def _prepare_export_payload(self) -> tuple[list[ExportRoom], dict]:
+        return build_export_payload(self._collect_project_data(), self._get_effective_content_dir(), self._audio_metadata_cache())
 
     @staticmethod
     def _normalize_unmatched_audio_files(raw_files):
-        def _safe_size(value):
-            try:
-                return max(0, int(value or 0))
-            except (TypeError, ValueError):
-                return 0
-
-        normalized = {}
-        if not isinstance(raw_files, dict):
-            return normalized
-        for name, meta in raw_files.items():
-            if not isinstance(name, str) or not name:
-                continue
-            item = meta if isinstance(meta, dict) else {}
-            normalized[name] = {
-                "name": name,
-                "size": _safe_size(item.get("size", 0)),
-                "crc32": str(item.get("crc32", "") or ""),
-            }
-        return normalized
+        return normalize_unmatched_audio_files(raw_files)
 
     def _merge_unmatched_audio_files_into_tracks_data(self, tracks_data: dict):
-        files_index = {
-            str(item.get("name", "")): item
-            for item in tracks_data.get("files", [])
-            if isinstance(item, dict) and item.get("name")
-        }
-        for name, meta in self.unmatched_audio_files.items():
-            existing = files_index.get(name)
-            if existing is None:
-                files_index[name] = {
-                    "name": name,
-                    "size": int(meta.get("size", 0)),
-                    "crc32": str(meta.get("crc32", "")),
-                }
-                continue
-            existing["size"] = max(int(existing.get("size", 0)), int(meta.get("size", 0)))
-            if not existing.get("crc32") and meta.get("crc32"):
-                existing["crc32"] = str(meta.get("crc32", ""))
-        tracks_data["files"] = [files_index[name] for name in sorted(files_index)]
+        merge_unmatched_audio_files(tracks_data, self.unmatched_audio_files)
 
     def _merge_existing_tracks_metadata(self, tracks_data: dict):
-        previous_signature = None
-        previous_version = None
-        tracks_path = self._tracks_json_path()
-        if tracks_path and os.path.isfile(tracks_path):
-            try:
-                with open(tracks_path, "r", encoding="utf-8") as f:
-                    existing_data = json.load(f)
-            except Exception:
-                existing_data = None
-
-            if isinstance(existing_data, dict):
-                previous_signature = _tracks_data_signature(existing_data)
-                previous_version = existing_data.get("version")
-
-                existing_files = existing_data.get("files")
-                if isinstance(existing_files, list):
-                    existing_index = {}
-                    for item in existing_files:
-                        if not isinstance(item, dict):
-                            continue
-                        name = item.get("name")
-                        if not isinstance(name, str) or not name:
-                            continue
-                        existing_index[name] = item
-
-                    for item in tracks_data.get("files", []):
-                        if not isinstance(item, dict):
-                            continue
-                        name = item.get("name")
-                        if not isinstance(name, str) or not name:
-                            continue
-                        old_item = existing_index.get(name)
-                        if not isinstance(old_item, dict):
-                            continue
-
-                        if not item.get("crc32") and old_item.get("crc32"):
-                            item["crc32"] = str(old_item.get("crc32", ""))
-
-                        try:
-                            current_size = int(item.get("size") or 0)
-                        except (TypeError, ValueError):
-                            current_size = 0
-                        try:
-                            old_size = int(old_item.get("size") or 0)
-                        except (TypeError, ValueError):
-                            old_size = 0
-                        item["size"] = max(current_size, old_size, 0)
-
-        current_signature = _tracks_data_signature(tracks_data)
-        if previous_signature is not None and current_signature == previous_signature and _is_tracks_version_valid(previous_version):
-            tracks_data["version"] = previous_version
-        else:
-            tracks_data["version"] = datetime.now().strftime("%y%m%d-%H%M")
+        merge_existing_tracks_metadata(tracks_data, self._tracks_json_path(), self._export_cache)
 
     def closeEvent(self, event):
         self._save_window_preferences()
@@ -7358,10 +8096,15 @@ class PlanEditorMainWindow(QMainWindow):
             self.scene.selectionChanged.disconnect(self.on_scene_selection_changed)
         except Exception:
             pass
+        if self.scene.background_tiles is not None:
+            self.scene.background_tiles.close()
         self.view.setScene(None)
+        self._ssh_sessions.close()
         event.accept()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ("export", "sync"):
+        sys.exit(run_cli(sys.argv[1:]))
     app = QApplication(os.getenv("QT_FORCE_STDERR_LOGGING") and sys.argv or sys.argv)
     icons_dir = os.path.join(os.path.dirname(__file__), "icons")
     app_icon_path = os.path.join(icons_dir, "app.png")
@@ -0,0 +1,1988 @@
+# rg_mapper_core.py — модель проекта и экспорт rooms.json/tracks.json без Qt
+import sys, json, os, posixpath, zlib, zipfile, stat, threading, base64, argparse, io, hashlib, struct, shlex
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+import paramiko
+from datetime import datetime
+from mutagen.mp3 import MP3
+
+
+def fix_negative_zero(val):
+    return 0.0 if abs(val) < 1e-9 else val
+
+
+TRACKS_DIGEST_KEY = "digest"
+
+
+def _tracks_data_signature(tracks_data: dict) -> str:
+    # Отпечаток содержимого tracks.json без version и самого отпечатка.
+    # Один json.dumps на C быстрее, чем хэширование каждой записи на Python.
+    if not isinstance(tracks_data, dict):
+        return ""
+    normalized = {key: value for key, value in tracks_data.items() if key not in ("version", TRACKS_DIGEST_KEY)}
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _is_tracks_version_valid(value) -> bool:
+    if not isinstance(value, str):
+        return False
+    try:
+        datetime.strptime(value, "%y%m%d-%H%M")
+    except ValueError:
+        return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Audio helpers
+# ---------------------------------------------------------------------------
+def extract_track_id(filename: str) -> int:
+    name = os.path.splitext(os.path.basename(filename))[0]
+    digits = ''.join(ch for ch in name if ch.isdigit())
+    return int(digits) if digits else 0
+
+
+def parse_additional_ids(text: str):
+    ids = []
+    for token in text.split(','):
+        token = token.strip()
+        if not token:
+            continue
+        try:
+            ids.append(int(token))
+        except ValueError:
+            continue
+    return ids
+
+
+def normalize_int_list(values) -> list[int]:
+    if values is None:
+        return []
+    if isinstance(values, str):
+        return parse_additional_ids(values)
+
+    result: list[int] = []
+    if isinstance(values, (list, tuple, set)):
+        for value in values:
+            try:
+                result.append(int(value))
+            except (TypeError, ValueError):
+                continue
+    return result
+
+
+AUDIO_FILE_REF_KEYS = ('filename', 'path', 'size', 'mtime', 'crc32', 'duration_ms')
+
+
+def compute_file_crc32(path: str) -> str:
+    crc = 0
+    with open(path, 'rb') as fh:
+        while True:
+            chunk = fh.read(65536)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc & 0xFFFFFFFF:08x}"
+
+
+def read_mp3_info(path: str) -> tuple[int, dict]:
+    try:
+        audio = MP3(path)
+    except Exception as exc:
+        raise ValueError(str(exc)) from exc
+    duration_ms = int(round(audio.info.length * 1000)) if audio.info.length else 0
+    tags = {}
+    if audio.tags is not None:
+        for key, frame in audio.tags.items():
+            if key.startswith("T") and hasattr(frame, "text"):
+                tags[key] = "; ".join(str(value) for value in frame.text)
+    return duration_ms, tags
+
+
+def load_audio_file_info(path: str, cache=None):
+    # Аудио хранится ссылкой на файл (путь, размер, mtime, CRC32):
+    # сами байты читаются только для подсчёта CRC и при выгрузке на сервер.
+    if cache is not None:
+        try:
+            entry = cache.lookup(path, with_audio_info=True)
+        except OSError as exc:
+            raise ValueError(str(exc)) from exc
+        return {
+            'filename': os.path.basename(path),
+            'path': os.path.abspath(path),
+            'size': entry["size"],
+            'mtime': entry["mtime_ns"] / 1e9,
+            'crc32': entry["crc32"],
+            'duration_ms': entry["duration_ms"]
+        }
+    duration_ms, _ = read_mp3_info(path)
+    try:
+        file_stat = os.stat(path)
+        crc32_hex = compute_file_crc32(path)
+    except OSError as exc:
+        raise ValueError(str(exc)) from exc
+    return {
+        'filename': os.path.basename(path),
+        'path': os.path.abspath(path),
+        'size': int(file_stat.st_size),
+        'mtime': file_stat.st_mtime,
+        'crc32': crc32_hex,
+        'duration_ms': duration_ms
+    }
+
+
+def audio_file_ref(info) -> dict | None:
+    if not isinstance(info, dict):
+        return None
+    ref = {key: info[key] for key in AUDIO_FILE_REF_KEYS if key in info}
+    ref.setdefault('filename', None)
+    ref.setdefault('duration_ms', 0)
+    ref.setdefault('size', 0)
+    return ref
+
+
+def resolve_audio_file_path(info, content_dir: str | None) -> str | None:
+    if not isinstance(info, dict):
+        return None
+    filename = info.get('filename')
+    if content_dir and isinstance(filename, str) and filename:
+        candidate = os.path.join(content_dir, filename)
+        if os.path.isfile(candidate):
+            return candidate
+    path = info.get('path')
+    if isinstance(path, str) and path and os.path.isfile(path):
+        return path
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Audio metadata cache
+# ---------------------------------------------------------------------------
+AUDIO_METADATA_CACHE_SUFFIX = ".audiocache.json"
+AUDIO_METADATA_CACHE_VERSION = 1
+
+
+class AudioMetadataCache:
+    # Кэш CRC32/длительности/тегов MP3 в JSON-файле рядом с .proj.
+    # Запись считается актуальной, пока не изменились размер и mtime файла.
+    def __init__(self, cache_path: str | None = None):
+        self.cache_path = cache_path
+        self.base_dir = os.path.dirname(cache_path) if cache_path else None
+        self.entries: dict[str, dict] = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.cache_path or not os.path.isfile(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                payload = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(payload, dict) or payload.get("version") != AUDIO_METADATA_CACHE_VERSION:
+            return
+        files = payload.get("files")
+        if isinstance(files, dict):
+            self.entries = {key: value for key, value in files.items() if isinstance(value, dict)}
+
+    def _key(self, path: str) -> str:
+        full_path = os.path.abspath(path)
+        if self.base_dir:
+            try:
+                relative = os.path.relpath(full_path, self.base_dir)
+            except ValueError:
+                relative = None
+            if relative and not relative.startswith(".."):
+                return relative.replace("\\", "/")
+        return full_path.replace("\\", "/")
+
+    def lookup(self, path: str, with_audio_info: bool = False) -> dict:
+        file_stat = os.stat(path)
+        key = self._key(path)
+        with self._lock:
+            entry = self.entries.get(key)
+        if (
+            not isinstance(entry, dict)
+            or entry.get("size") != file_stat.st_size
+            or entry.get("mtime_ns") != file_stat.st_mtime_ns
+        ):
+            entry = {
+                "size": int(file_stat.st_size),
+                "mtime_ns": int(file_stat.st_mtime_ns),
+                "crc32": compute_file_crc32(path),
+            }
+        else:
+            entry = dict(entry)
+        if with_audio_info and "duration_ms" not in entry:
+            entry["duration_ms"], entry["tags"] = read_mp3_info(path)
+        with self._lock:
+            if self.entries.get(key) != entry:
+                self.entries[key] = entry
+                self.dirty = True
+        return entry
+
+    def store(self, path: str, crc32_hex: str):
+        file_stat = os.stat(path)
+        with self._lock:
+            self.entries[self._key(path)] = {
+                "size": int(file_stat.st_size),
+                "mtime_ns": int(file_stat.st_mtime_ns),
+                "crc32": crc32_hex,
+            }
+            self.dirty = True
+
+    def file_metadata(self, path: str) -> dict:
+        try:
+            entry = self.lookup(path)
+        except OSError:
+            return {"size": 0, "crc32": ""}
+        return {"size": int(entry["size"]), "crc32": entry["crc32"]}
+
+    def save(self):
+        if not self.cache_path or not self.dirty:
+            return
+        with self._lock:
+            payload = {"version": AUDIO_METADATA_CACHE_VERSION, "files": dict(sorted(self.entries.items()))}
+            self.dirty = False
+        try:
+            with open(self.cache_path, "w", encoding="utf-8") as cache_file:
+                json.dump(payload, cache_file, ensure_ascii=False, separators=(",", ":"))
+        except OSError:
+            self.dirty = True
+
+# ---------------------------------------------------------------------------
+# Project file (.proj)
+# ---------------------------------------------------------------------------
+# Начиная с формата 2 проект — zip-архив: план хранится исходными байтами
+# отдельным элементом без перекодирования в PNG/base64, объектная модель —
+# компактным JSON. Старые .proj (JSON с image_data в base64) читаются как раньше.
+PROJECT_FORMAT_VERSION = 2
+PROJECT_DATA_MEMBER = "project.json"
+PROJECT_IMAGE_MEMBER = "plan"
+
+
+def image_bytes_extension(image_bytes: bytes) -> str:
+    if image_bytes.startswith(b"\xff\xd8"):
+        return "jpg"
+    if image_bytes.startswith(b"BM"):
+        return "bmp"
+    return "png"
+
+
+def read_project_file(path: str, with_image: bool = True) -> tuple[dict, bytes]:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            data = json.loads(archive.read(PROJECT_DATA_MEMBER).decode("utf-8"))
+            image_member = data.get("image_member") or ""
+            image_bytes = archive.read(image_member) if image_member and with_image else b""
+        return data, image_bytes
+    with open(path, "r", encoding="utf-8") as project_file:
+        data = json.load(project_file)
+    encoded = data.pop("image_data", "") or ""
+    image_bytes = base64.b64decode(encoded) if encoded and with_image else b""
+    return data, image_bytes
+
+
+def _previous_project_archive(path: str, image_member: str, image_size: int, image_crc: int) -> tuple[bytes | None, zipfile.ZipInfo | None]:
+    # Возвращает project.json прежнего архива (None, если состав элементов
+    # другой) и описание его плана, если тот совпадает с текущим по размеру и CRC32.
+    if not zipfile.is_zipfile(path):
+        return None, None
+    try:
+        with zipfile.ZipFile(path) as archive:
+            image_info = None
+            expected_names = {PROJECT_DATA_MEMBER}
+            if image_member:
+                expected_names.add(image_member)
+                info = archive.getinfo(image_member)
+                if info.file_size == image_size and info.CRC == image_crc:
+                    image_info = info
+            if set(archive.namelist()) != expected_names or (image_member and image_info is None):
+                return None, image_info
+            return archive.read(PROJECT_DATA_MEMBER), image_info
+    except (zipfile.BadZipFile, KeyError, OSError):
+        return None, None
+
+
+def _copy_stored_member(source_path: str, info: zipfile.ZipInfo, archive: zipfile.ZipFile):
+    # Данные несжатого элемента — это сами байты плана: они переносятся из
+    # старого архива как есть, без повторного подсчёта CRC32.
+    copied = zipfile.ZipInfo(info.filename, info.date_time)
+    copied.compress_type = zipfile.ZIP_STORED
+    copied.CRC = info.CRC
+    copied.file_size = copied.compress_size = info.file_size
+    copied.external_attr = info.external_attr
+    copied.header_offset = archive.fp.tell()
+    with open(source_path, "rb") as source:
+        source.seek(info.header_offset)
+        header = source.read(zipfile.sizeFileHeader)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        source.seek(name_length + extra_length, os.SEEK_CUR)
+        archive.fp.write(copied.FileHeader())
+        remaining = info.file_size
+        while remaining > 0:
+            chunk = source.read(min(TRANSFER_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Элемент {info.filename} обрезан")
+            archive.fp.write(chunk)
+            remaining -= len(chunk)
+    archive.filelist.append(copied)
+    archive.NameToInfo[copied.filename] = copied
+    archive.start_dir = archive.fp.tell()
+
+
+def write_project_file(path: str, data: dict, image_bytes: bytes) -> bool:
+    # Архив пишется во временный файл и атомарно подменяет старый; если ни
+    # модель, ни план не изменились, файл на диске не трогается вовсе. Ради
+    # атомарности архив собирается целиком, поэтому байты плана всё равно
+    # переписываются на диск, но неизменившийся план копируется из старого
+    # архива готовым элементом.
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    image_member = data.get("image_member") or ""
+    image_crc = zlib.crc32(image_bytes) if image_member else 0
+    previous_payload, previous_image = _previous_project_archive(path, image_member, len(image_bytes), image_crc)
+    if previous_payload == payload:
+        return False
+    temp_path = f"{path}.tmp"
+    try:
+        with zipfile.ZipFile(temp_path, "w") as archive:
+            if previous_image is not None and previous_image.compress_type == zipfile.ZIP_STORED:
+                _copy_stored_member(path, previous_image, archive)
+            elif image_member:
+                # Изображения уже сжаты, поэтому план хранится без deflate.
+                archive.writestr(image_member, image_bytes, compress_type=zipfile.ZIP_STORED)
+            archive.writestr(PROJECT_DATA_MEMBER, payload, compress_type=zipfile.ZIP_DEFLATED)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+def validate_project_data(data) -> dict:
+    if not isinstance(data, dict):
+        raise ValueError("Файл проекта повреждён: ожидался объект JSON.")
+    for key in ("halls", "anchors", "proximity_zones"):
+        items = data.get(key) or []
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise ValueError(f"Файл проекта повреждён: раздел «{key}» должен быть списком объектов.")
+        data[key] = items
+    for hall_data in data["halls"]:
+        zones = hall_data.get("zones") or []
+        if not isinstance(zones, list) or not all(isinstance(zone, dict) for zone in zones):
+            raise ValueError(f"Файл проекта повреждён: зоны зала {hall_data.get('num', '?')} должны быть списком объектов.")
+        hall_data["zones"] = zones
+    for key in ("pixel_per_cm_x", "pixel_per_cm_y", "grid_step_cm"):
+        if key in data:
+            try:
+                float(data[key])
+            except (TypeError, ValueError):
+                raise ValueError(f"Файл проекта повреждён: параметр «{key}» должен быть числом.")
+    return data
+
+
+# ---------------------------------------------------------------------------
+# Project layout
+# ---------------------------------------------------------------------------
+def sanitize_name_for_folder(name: str) -> str:
+    sanitized_chars = []
+    for ch in name:
+        if ch in ("/", "\\", ":", "*", "?", '"', "<", ">", "|"):
+            sanitized_chars.append("_")
+        elif ch.isspace():
+            sanitized_chars.append("_")
+        else:
+            sanitized_chars.append(ch)
+    sanitized = "".join(sanitized_chars).strip("_")
+    return sanitized
+
+
+def project_layout(project_file: str) -> tuple[str, str]:
+    # Рядом с .proj лежит папка проекта, в её подпапке content — MP3 и tracks.json.
+    project_file_abs = os.path.abspath(project_file)
+    project_dir = os.path.dirname(project_file_abs)
+    project_base_name = os.path.splitext(os.path.basename(project_file_abs))[0]
+    project_folder_name = sanitize_name_for_folder(project_base_name) or project_base_name
+    root_dir = os.path.join(project_dir, project_folder_name)
+    return root_dir, os.path.join(root_dir, "content")
+
+
+def ensure_project_layout(project_file: str) -> tuple[str, str]:
+    root_dir, content_dir = project_layout(project_file)
+    os.makedirs(content_dir, exist_ok=True)
+    return root_dir, content_dir
+
+
+def rooms_json_path(project_file: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(project_file)), "rooms.json")
+
+
+def tracks_json_path(content_dir: str) -> str:
+    return os.path.join(content_dir, "tracks.json")
+
+
+def audio_metadata_cache_path(project_file: str) -> str:
+    return os.path.splitext(os.path.abspath(project_file))[0] + AUDIO_METADATA_CACHE_SUFFIX
+
+
+# ---------------------------------------------------------------------------
+# rooms.json model
+# ---------------------------------------------------------------------------
+# Типизированная модель rooms.json. Строится за один проход по проекту и
+# пишется потоком в том же виде, который понимают устройства, — поэтому
+# writer не использует json.dump, а повторяет прежнюю построчную раскладку.
+@dataclass
+class ExportAnchor:
+    id: int
+    x: float
+    y: float
+    z: float
+    bound: bool = False
+    start: bool = False
+    anch_zone: bool = False
+
+
+@dataclass
+class ExportZoneRect:
+    x: float = 0
+    y: float = 0
+    w: float = 0
+    h: float = 0
+    angle: float = 0
+
+
+@dataclass
+class ExportZone:
+    num: int
+    enter: ExportZoneRect = field(default_factory=ExportZoneRect)
+    exit: ExportZoneRect = field(default_factory=ExportZoneRect)
+    bound: bool = False
+
+
+@dataclass
+class ExportProximityZone:
+    num: int
+    anchor_id: int
+    dist_in: float
+    dist_out: float
+    bound: bool = False
+    blist: list[int] = field(default_factory=list)
+
+
+@dataclass
+class ExportRoom:
+    num: int
+    width: float
+    height: float
+    extra_tracks: list[int] = field(default_factory=list)
+    anchors: list[ExportAnchor] = field(default_factory=list)
+    zones: list[ExportZone | ExportProximityZone] = field(default_factory=list)
+
+
+class RoomsValidationError(ValueError):
+    def __init__(self, problems: list[str]):
+        super().__init__("\n".join(problems))
+        self.problems = problems
+
+
+def collect_export_proximity_zones(data: dict) -> list[tuple[dict, dict, list]]:
+    # Зоны приближения без существующего якоря в экспорт не попадают;
+    # пустой список залов означает основной зал якоря.
+    anchor_map = {ad.get("number", 0): ad for ad in data.get("anchors", [])}
+    result = []
+    for zd in data.get("proximity_zones", []):
+        anchor = anchor_map.get(zd.get("anchor_id"))
+        if not anchor:
+            continue
+        halls = list(zd.get("halls") or []) or [anchor.get("main_hall")]
+        result.append((zd, anchor, halls))
+    return result
+
+
+def build_rooms_model(data: dict, proximity_zones: list[tuple[dict, dict, list]] | None = None) -> list[ExportRoom]:
+    if proximity_zones is None:
+        proximity_zones = collect_export_proximity_zones(data)
+    scale = data.get("pixel_per_cm_x", 1.0) * 100
+
+    def metres(value) -> float:
+        return fix_negative_zero(round(value / scale, 1))
+
+    # Якоря и зоны приближения заранее раскладываются по залам, чтобы не
+    # перебирать их целиком для каждого зала.
+    anchors_by_hall: dict[int, list[dict]] = {}
+    for ad in data.get("anchors", []):
+        for hall_num in dict.fromkeys([ad.get("main_hall")] + list(ad.get("extra_halls") or [])):
+            anchors_by_hall.setdefault(hall_num, []).append(ad)
+    proximity_by_hall: dict[int, list[tuple[dict, dict]]] = {}
+    anchor_zone_halls: set[tuple[int, int]] = set()
+    for zd, anchor, halls in proximity_zones:
+        for hall_num in dict.fromkeys(halls):
+            proximity_by_hall.setdefault(hall_num, []).append((zd, anchor))
+            if isinstance(hall_num, int):
+                anchor_zone_halls.add((anchor.get("number", 0), hall_num))
+
+    rooms = []
+    for hd in data.get("halls", []):
+        hall_num = hd.get("num", 0)
+        hall_x, hall_y = hd.get("x_px", 0), hd.get("y_px", 0)
+        hall_h = hd.get("h_px", 100)
+        extra_tracks = normalize_int_list(hd.get("extra_tracks"))
+        room = ExportRoom(
+            num=hall_num,
+            width=metres(hd.get("w_px", 100)),
+            height=metres(hall_h),
+            extra_tracks=sorted(set(extra_tracks)),
+        )
+
+        for ad in anchors_by_hall.get(hall_num, []):
+            anchor_num = ad.get("number", 0)
+            start = bool(ad.get("start", False))
+            room.anchors.append(ExportAnchor(
+                id=anchor_num,
+                x=metres(ad.get("x", 0) - hall_x),
+                y=metres(hall_h - (ad.get("y", 0) - hall_y)),
+                z=fix_negative_zero(round(ad.get("z", 0) / 100, 1)),
+                bound=bool(ad.get("bound", False)) and not start,
+                start=start,
+                anch_zone=(anchor_num, hall_num) in anchor_zone_halls,
+            ))
+
+        zones: dict[int, ExportZone] = {}
+        for zd in hd.get("zones", []):
+            n = zd.get("zone_num", 0)
+            zone_type = zd.get("zone_type", "Входная зона")
+            zone = zones.setdefault(n, ExportZone(num=n))
+            rect = ExportZoneRect(
+                x=metres(zd.get("bottom_left_x", 0)),
+                y=metres(hall_h - zd.get("bottom_left_y", 0)),
+                w=metres(zd.get("w_px", 0)),
+                h=metres(zd.get("h_px", 0)),
+                angle=fix_negative_zero(round(zd.get("zone_angle", 0), 1)),
+            )
+            if zone_type == "Входная зона":
+                zone.enter = rect
+            elif zone_type == "Выходная зона":
+                zone.exit = rect
+            elif zone_type == "Переходная":
+                zone.enter = rect
+                zone.bound = True
+        room.zones.extend(zones.values())
+
+        for zd, anchor in proximity_by_hall.get(hall_num, []):
+            room.zones.append(ExportProximityZone(
+                num=zd.get("zone_num", 0),
+                anchor_id=anchor.get("number", 0),
+                dist_in=fix_negative_zero(round(float(zd.get("dist_in", 0.0)), 1)),
+                dist_out=fix_negative_zero(round(float(zd.get("dist_out", 0.0)), 1)),
+                bound=bool(zd.get("bound")),
+                blist=list(zd.get("blacklist") or []),
+            ))
+        rooms.append(room)
+    return rooms
+
+
+def validate_rooms_model(rooms: list[ExportRoom]):
+    # Устройство различает залы, якоря зала и зоны зала только по номерам,
+    # поэтому повтор номера делает конфигурацию неоднозначной.
+    problems = []
+    seen_rooms: set[int] = set()
+    for room in rooms:
+        if room.num in seen_rooms:
+            problems.append(f"Зал {room.num}: номер зала повторяется.")
+        seen_rooms.add(room.num)
+        seen_anchors: set[int] = set()
+        for anchor in room.anchors:
+            if anchor.id in seen_anchors:
+                problems.append(f"Зал {room.num}: якорь {anchor.id} повторяется.")
+            seen_anchors.add(anchor.id)
+        seen_zones: set[int] = set()
+        for zone in room.zones:
+            if zone.num in seen_zones:
+                problems.append(f"Зал {room.num}: номер зоны {zone.num} повторяется.")
+            seen_zones.add(zone.num)
+    if problems:
+        raise RoomsValidationError(problems)
+
+
+def _write_rect(out, rect: ExportZoneRect):
+    out.write(f'{{ "x": {rect.x}, "y": {rect.y}, "w": {rect.w}, "h": {rect.h}, "angle": {rect.angle} }}')
+
+
+def write_rooms_json(rooms: list[ExportRoom], out):
+    out.write('{\n"rooms": [\n')
+    for room_index, room in enumerate(rooms):
+        if room_index:
+            out.write(",\n")
+        out.write(f'{{\n"num": {room.num},\n"width": {room.width},\n"height": {room.height},\n')
+        if room.extra_tracks:
+            out.write(f'"extra_tracks": {json.dumps(room.extra_tracks, ensure_ascii=False)},\n')
+        out.write('"anchors": [\n')
+        for anchor_index, anchor in enumerate(room.anchors):
+            if anchor_index:
+                out.write(",\n")
+            out.write(f'{{ "id": {anchor.id}, "x": {anchor.x}, "y": {anchor.y}, "z": {anchor.z}')
+            if anchor.bound:
+                out.write(', "bound": true')
+            if anchor.start:
+                out.write(', "start": true')
+            if anchor.anch_zone:
+                out.write(', "anch_zone": true')
+            out.write(" }")
+        out.write('\n],\n"zones": [\n')
+        for zone_index, zone in enumerate(room.zones):
+            if zone_index:
+                out.write(",\n")
+            if isinstance(zone, ExportProximityZone):
+                out.write(
+                    f'{{\n"num": {zone.num},\n"anch_zone": true,\n"anchor_id": {zone.anchor_id},'
+                    f'\n"dist_in": {zone.dist_in},\n"dist_out": {zone.dist_out}'
+                )
+                if zone.bound:
+                    out.write(',\n"bound": true')
+                if zone.blist:
+                    out.write(f',\n"blist": {json.dumps(zone.blist)}')
+            else:
+                out.write(f'{{\n"num": {zone.num},\n"enter": ')
+                _write_rect(out, zone.enter)
+                out.write(',\n"exit":  ')
+                _write_rect(out, zone.exit)
+                if zone.bound:
+                    out.write(',\n"bound": true')
+            out.write("\n}")
+        out.write("\n]\n}")
+    out.write("\n]\n}")
+
+
+def render_rooms_json(rooms: list[ExportRoom]) -> str:
+    buffer = io.StringIO()
+    write_rooms_json(rooms, buffer)
+    return buffer.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# rooms.json / tracks.json export
+# ---------------------------------------------------------------------------
+def build_export_payload(data: dict, content_dir: str | None, audio_cache: AudioMetadataCache) -> tuple[list[ExportRoom], dict]:
+    # Экспорт строится по модели проекта — тому же словарю, что пишется в .proj,
+    # поэтому редактор и командная строка дают одинаковые rooms/tracks.
+    audio_files_map: dict[str, dict] = {}
+    track_entries_map: dict[str, dict] = {}
+    proximity_zones = collect_export_proximity_zones(data)
+    rooms = build_rooms_model(data, proximity_zones)
+
+    def _extract_size(info: dict | None) -> int:
+        if not isinstance(info, dict):
+            return 0
+        try:
+            size_val = int(info.get("size") or 0)
+        except (TypeError, ValueError):
+            size_val = 0
+        if size_val <= 0:
+            file_path = resolve_audio_file_path(info, content_dir)
+            if file_path:
+                try:
+                    size_val = os.path.getsize(file_path)
+                except OSError:
+                    size_val = 0
+        return max(size_val, 0)
+
+    def _extract_crc32(info: dict | None) -> str:
+        if not isinstance(info, dict):
+            return ""
+        crc_value = str(info.get("crc32", "") or "").strip().lower()
+        if crc_value:
+            return crc_value
+        file_path = resolve_audio_file_path(info, content_dir)
+        if not file_path:
+            return ""
+        return audio_cache.file_metadata(file_path)["crc32"]
+
+    def _register_audio_file(name: str, size_bytes: int, crc32_hex: str):
+        existing = audio_files_map.get(name)
+        if existing is None:
+            audio_files_map[name] = {
+                "size": max(size_bytes, 0),
+                "crc32": crc32_hex
+            }
+            return
+        existing["size"] = max(int(existing.get("size", 0)), max(size_bytes, 0))
+        if crc32_hex:
+            existing["crc32"] = crc32_hex
+
+    def collect_audio_files(info: dict | None):
+        if not isinstance(info, dict):
+            return
+        name = info.get("filename")
+        if isinstance(name, str) and name:
+            size_bytes = _extract_size(info)
+            _register_audio_file(name, size_bytes, _extract_crc32(info))
+        secondary = info.get("secondary")
+        if isinstance(secondary, dict):
+            sec_name = secondary.get("filename")
+            if isinstance(sec_name, str) and sec_name:
+                size_bytes2 = _extract_size(secondary)
+                _register_audio_file(sec_name, size_bytes2, _extract_crc32(secondary))
+
+    def create_track_entry(info: dict | None, room_id: int, is_hall: bool):
+        if not isinstance(info, dict):
+            return None
+        filename = info.get("filename")
+        if not filename:
+            return None
+        base_id = extract_track_id(filename)
+        extras = [i for i in info.get("extra_ids", []) if isinstance(i, int)]
+
+        entry = {
+            "audio": filename,
+            "hall": is_hall,
+            "id": base_id,
+            "name": "",
+            "play_once": bool(info.get("play_once", False)),
+            "reset": bool(info.get("reset", False)),
+            "room_id": room_id,
+            "term": bool(info.get("interruptible", True))
+        }
+
+        if extras:
+            seen = set()
+            merged = []
+            for mid in [base_id] + extras:
+                if mid in seen:
+                    continue
+                seen.add(mid)
+                merged.append(mid)
+            entry["multi_id"] = merged
+
+        secondary = info.get("secondary")
+        if isinstance(secondary, dict) and secondary.get("filename"):
+            entry["audio2"] = secondary["filename"]
+            entry["extra"] = True
+        return entry
+
+    def register_track_entry(entry: dict | None):
+        if not isinstance(entry, dict):
+            return
+        key = entry.get("audio")
+        if not key:
+            return
+        existing = track_entries_map.get(key)
+        if existing is None:
+            track_entries_map[key] = entry
+            return
+
+        existing["hall"] = bool(existing.get("hall")) or bool(entry.get("hall"))
+
+        new_room = entry.get("room_id")
+        old_room = existing.get("room_id")
+        if isinstance(new_room, int):
+            if not isinstance(old_room, int):
+                existing["room_id"] = new_room
+            else:
+                existing["room_id"] = min(old_room, new_room)
+
+        if entry.get("audio2") and not existing.get("audio2"):
+            existing["audio2"] = entry["audio2"]
+
+        if entry.get("extra"):
+            existing["extra"] = True
+
+        existing["play_once"] = bool(existing.get("play_once")) or bool(entry.get("play_once"))
+        existing["reset"] = bool(existing.get("reset")) or bool(entry.get("reset"))
+        existing["term"] = bool(existing.get("term", True)) and bool(entry.get("term", True))
+
+        combined_ids: set[int] = set()
+        for value in (existing.get("id"), entry.get("id")):
+            if isinstance(value, int):
+                combined_ids.add(value)
+        for seq in (existing.get("multi_id"), entry.get("multi_id")):
+            if isinstance(seq, list):
+                for value in seq:
+                    if isinstance(value, int):
+                        combined_ids.add(value)
+        base_id = existing.get("id")
+        if isinstance(base_id, int) and base_id in combined_ids:
+            combined_ids.remove(base_id)
+        if combined_ids:
+            existing["multi_id"] = sorted(combined_ids)
+        elif "multi_id" in existing:
+            existing.pop("multi_id")
+
+    # === tracks.json ===
+    for hd in data.get("halls", []):
+        hall_num = hd.get("num", 0)
+        if hd.get("audio"):
+            collect_audio_files(hd["audio"])
+            register_track_entry(create_track_entry(hd["audio"], hall_num, True))
+        zone_audio = {}
+        for key, audio_info in (hd.get("zone_audio") or {}).items():
+            try:
+                zone_audio[int(key)] = audio_info
+            except (TypeError, ValueError):
+                continue
+        for _, audio_info in sorted(zone_audio.items()):
+            if not audio_info:
+                continue
+            collect_audio_files(audio_info)
+            register_track_entry(create_track_entry(audio_info, hall_num, False))
+
+    for zd, anchor, halls in proximity_zones:
+        audio_info = zd.get("audio")
+        if not audio_info:
+            continue
+        hall_numbers = [h for h in halls if isinstance(h, int)]
+        room_id = min(hall_numbers) if hall_numbers else anchor.get("main_hall")
+        collect_audio_files(audio_info)
+        register_track_entry(create_track_entry(audio_info, room_id if room_id is not None else 0, False))
+
+    track_entries = list(track_entries_map.values())
+
+    def _sort_key(item: dict):
+        room_id = item.get("room_id")
+        if not isinstance(room_id, int):
+            try:
+                room_id = int(room_id)
+            except (TypeError, ValueError):
+                room_id = 0
+        return (
+            room_id,
+            not bool(item.get("hall")),
+            item.get("id", 0),
+            item.get("audio", "")
+        )
+
+    track_entries.sort(key=_sort_key)
+    files_list = []
+    for name in sorted(audio_files_map):
+        file_info = audio_files_map[name]
+        files_list.append({
+            "name": name,
+            "size": int(file_info.get("size", 0)),
+            "crc32": file_info.get("crc32", "")
+        })
+    tracks_data = {
+        "files": files_list,
+        "langs": [],
+        "tracks": track_entries
+    }
+
+    return rooms, tracks_data
+
+
+def normalize_unmatched_audio_files(raw_files) -> dict[str, dict]:
+    def _safe_size(value):
+        try:
+            return max(0, int(value or 0))
+        except (TypeError, ValueError):
+            return 0
+
+    normalized = {}
+    if not isinstance(raw_files, dict):
+        return normalized
+    for name, meta in raw_files.items():
+        if not isinstance(name, str) or not name:
+            continue
+        item = meta if isinstance(meta, dict) else {}
+        normalized[name] = {
+            "name": name,
+            "size": _safe_size(item.get("size", 0)),
+            "crc32": str(item.get("crc32", "") or ""),
+        }
+    return normalized
+
+
+def merge_unmatched_audio_files(tracks_data: dict, unmatched_audio_files: dict[str, dict]):
+    files_index = {
+        str(item.get("name", "")): item
+        for item in tracks_data.get("files", [])
+        if isinstance(item, dict) and item.get("name")
+    }
+    for name, meta in unmatched_audio_files.items():
+        existing = files_index.get(name)
+        if existing is None:
+            files_index[name] = {
+                "name": name,
+                "size": int(meta.get("size", 0)),
+                "crc32": str(meta.get("crc32", "")),
+            }
+            continue
+        existing["size"] = max(int(existing.get("size", 0)), int(meta.get("size", 0)))
+        if not existing.get("crc32") and meta.get("crc32"):
+            existing["crc32"] = str(meta.get("crc32", ""))
+    tracks_data["files"] = [files_index[name] for name in sorted(files_index)]
+
+
+def iter_language_audio_files(content_dir: str | None) -> list[tuple[str, str, str]]:
+    if not content_dir or not os.path.isdir(content_dir):
+        return []
+
+    results = []
+    for lang_name in sorted(os.listdir(content_dir)):
+        if not lang_name or lang_name.startswith("."):
+            continue
+        lang_dir = os.path.join(content_dir, lang_name)
+        if not os.path.isdir(lang_dir):
+            continue
+        for entry in sorted(os.listdir(lang_dir)):
+            if not entry.lower().endswith(".mp3"):
+                continue
+            full_path = os.path.join(lang_dir, entry)
+            if os.path.isfile(full_path):
+                results.append((lang_name, f"{lang_name}/{entry}", full_path))
+    return results
+
+
+def collect_language_audio_files(content_dir: str | None, audio_cache: AudioMetadataCache) -> tuple[list[str], dict[str, dict]]:
+    langs: list[str] = []
+    files: dict[str, dict] = {}
+    for lang_name, relative_name, full_path in iter_language_audio_files(content_dir):
+        metadata = audio_cache.file_metadata(full_path)
+        files[relative_name] = {
+            "name": relative_name,
+            "size": metadata["size"],
+            "crc32": metadata["crc32"],
+        }
+        if lang_name not in langs:
+            langs.append(lang_name)
+
+    return langs, files
+
+
+def merge_language_audio_files(tracks_data: dict, content_dir: str | None, audio_cache: AudioMetadataCache):
+    if not isinstance(tracks_data, dict):
+        return
+
+    langs, language_files = collect_language_audio_files(content_dir, audio_cache)
+    tracks_data["langs"] = langs
+
+    files_index = {
+        str(item.get("name", "")): item
+        for item in tracks_data.get("files", [])
+        if isinstance(item, dict) and item.get("name")
+    }
+    for name, meta in language_files.items():
+        existing = files_index.get(name)
+        if existing is None:
+            files_index[name] = meta
+            continue
+        existing["size"] = int(meta.get("size", 0))
+        existing["crc32"] = str(meta.get("crc32", "") or "")
+
+    tracks_data["files"] = [files_index[name] for name in sorted(files_index)]
+
+
+class ExportCache:
+    # Что было последним записано в rooms.json/tracks.json. Пока размер и mtime
+    # файла не изменились, прежний tracks.json не перечитывается и не
+    # подписывается заново, а совпадающие данные не перезаписываются.
+    def __init__(self):
+        self._entries: dict[str, dict] = {}
+
+    @staticmethod
+    def _stat_key(path: str):
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns
+
+    def lookup(self, path: str) -> dict | None:
+        entry = self._entries.get(os.path.abspath(path))
+        if entry is None or entry["stat"] != self._stat_key(path):
+            return None
+        return entry
+
+    def remember(self, path: str, **values):
+        self._entries[os.path.abspath(path)] = dict(values, stat=self._stat_key(path))
+
+
+def _tracks_files_index(files) -> dict[str, dict]:
+    index = {}
+    if not isinstance(files, list):
+        return index
+    for item in files:
+        if not isinstance(item, dict):
+            continue
+        name = item.get("name")
+        if not isinstance(name, str) or not name:
+            continue
+        index[name] = item
+    return index
+
+
+def merge_existing_tracks_metadata(tracks_data: dict, tracks_path: str | None, export_cache: ExportCache | None = None):
+    previous_signature = None
+    previous_version = None
+    existing_index: dict[str, dict] = {}
+    cached = export_cache.lookup(tracks_path) if export_cache is not None and tracks_path else None
+    if cached is not None:
+        previous_signature = cached["signature"]
+        previous_version = cached["version"]
+        existing_index = cached["files"]
+    elif tracks_path and os.path.isfile(tracks_path):
+        try:
+            with open(tracks_path, "r", encoding="utf-8") as f:
+                existing_data = json.load(f)
+        except Exception:
+            existing_data = None
+
+        if isinstance(existing_data, dict):
+            # Отпечаток, записанный вместе с файлом, описывает именно эту
+            # версию, поэтому пересчитывать его не нужно.
+            previous_signature = existing_data.get(TRACKS_DIGEST_KEY)
+            if not isinstance(previous_signature, str) or not previous_signature:
+                previous_signature = _tracks_data_signature(existing_data)
+            previous_version = existing_data.get("version")
+            existing_index = _tracks_files_index(existing_data.get("files"))
+
+    if existing_index:
+        for item in tracks_data.get("files", []):
+            if not isinstance(item, dict):
+                continue
+            name = item.get("name")
+            if not isinstance(name, str) or not name:
+                continue
+            old_item = existing_index.get(name)
+            if not isinstance(old_item, dict):
+                continue
+
+            if not item.get("crc32") and old_item.get("crc32"):
+                item["crc32"] = str(old_item.get("crc32", ""))
+
+            try:
+                current_size = int(item.get("size") or 0)
+            except (TypeError, ValueError):
+                current_size = 0
+            try:
+                old_size = int(old_item.get("size") or 0)
+            except (TypeError, ValueError):
+                old_size = 0
+            item["size"] = max(current_size, old_size, 0)
+
+    current_signature = _tracks_data_signature(tracks_data)
+    if previous_signature is not None and current_signature == previous_signature and _is_tracks_version_valid(previous_version):
+        tracks_data["version"] = previous_version
+    else:
+        tracks_data["version"] = datetime.now().strftime("%y%m%d-%H%M")
+    tracks_data[TRACKS_DIGEST_KEY] = current_signature
+
+
+def recalculate_tracks_files_metadata(tracks_data: dict, content_dir: str | None, audio_cache: AudioMetadataCache):
+    if not isinstance(tracks_data, dict):
+        return
+    files_section = tracks_data.get("files")
+    if not isinstance(files_section, list):
+        return
+    if not content_dir or not os.path.isdir(content_dir):
+        return
+
+    for entry in files_section:
+        if not isinstance(entry, dict):
+            continue
+        name = entry.get("name")
+        if not isinstance(name, str) or not name:
+            continue
+        file_path = os.path.join(content_dir, name)
+        if not os.path.isfile(file_path):
+            continue
+
+        try:
+            metadata = audio_cache.lookup(file_path)
+        except OSError:
+            continue
+
+        entry["size"] = int(max(metadata["size"], 0))
+        entry["crc32"] = metadata["crc32"]
+
+
+def build_auxiliary_configs(data: dict, content_dir: str | None, audio_cache: AudioMetadataCache, tracks_path: str | None) -> tuple[list[ExportRoom], dict]:
+    rooms, tracks_data = build_export_payload(data, content_dir, audio_cache)
+    merge_unmatched_audio_files(tracks_data, normalize_unmatched_audio_files(data.get("unmatched_audio_files")))
+    merge_language_audio_files(tracks_data, content_dir, audio_cache)
+    merge_existing_tracks_metadata(tracks_data, tracks_path)
+    return rooms, tracks_data
+
+
+def _write_text_if_changed(path: str, text: str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8") as existing_file:
+            if existing_file.read() == text:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(text)
+    return True
+
+
+def write_auxiliary_configs(rooms_path: str, tracks_path: str, rooms: list[ExportRoom], tracks_data: dict, export_cache: ExportCache | None = None):
+    # Неизменившиеся файлы не переписываются: их mtime остаётся прежним, и
+    # выгрузка на сервер не считает их изменёнными. Кэш избавляет от сборки
+    # текста, без него (CLI, sync) текст сравнивается с файлом на диске.
+    cached = export_cache.lookup(rooms_path) if export_cache is not None else None
+    if cached is None or cached["rooms"] != rooms:
+        _write_text_if_changed(rooms_path, render_rooms_json(rooms))
+        if export_cache is not None:
+            export_cache.remember(rooms_path, rooms=rooms)
+
+    # После пересчёта размеров и CRC отпечаток мог измениться.
+    signature = _tracks_data_signature(tracks_data)
+    tracks_data[TRACKS_DIGEST_KEY] = signature
+    cached = export_cache.lookup(tracks_path) if export_cache is not None else None
+    if cached is None or cached["signature"] != signature or cached["version"] != tracks_data.get("version"):
+        _write_text_if_changed(tracks_path, json.dumps(tracks_data, ensure_ascii=False, indent=4))
+        if export_cache is not None:
+            export_cache.remember(
+                tracks_path,
+                signature=signature,
+                version=tracks_data.get("version"),
+                files={name: dict(item) for name, item in _tracks_files_index(tracks_data.get("files")).items()},
+            )
+
+
+def export_project(project_file: str, data: dict | None = None) -> tuple[str, str]:
+    # То же, что делает редактор при сохранении проекта: rooms.json рядом с .proj,
+    # tracks.json в content, CRC32 берутся из кэша аудио проекта. Уже прочитанные
+    # и проверенные данные проекта можно передать в data, чтобы не читать .proj снова.
+    if data is None:
+        data, _ = read_project_file(project_file, with_image=False)
+        data = validate_project_data(data)
+    _, content_dir = ensure_project_layout(project_file)
+    audio_cache = AudioMetadataCache(audio_metadata_cache_path(project_file))
+    rooms_path = rooms_json_path(project_file)
+    tracks_path = tracks_json_path(content_dir)
+    rooms, tracks_data = build_auxiliary_configs(data, content_dir, audio_cache, tracks_path)
+    recalculate_tracks_files_metadata(tracks_data, content_dir, audio_cache)
+    audio_cache.save()
+    write_auxiliary_configs(rooms_path, tracks_path, rooms, tracks_data)
+    return rooms_path, tracks_path
+
+
+# ---------------------------------------------------------------------------
+# SFTP sync
+# ---------------------------------------------------------------------------
+SYSTEM_CONFIG_FILENAMES = ("config.json", "defconfig.json", "excurs.json", "settings.json")
+DEFAULT_REMOTE_PROJECTS_DIR = "/ftpradiog"
+DEFAULT_SERVER_HOST = "178.154.195.218"
+DEFAULT_SERVER_USERNAME = "radiog"
+DEFAULT_SERVER_PORT = 26015
+DEFAULT_TRANSFER_CHANNELS = 4
+DEFAULT_SYNC_WORKERS = 4
+TRANSFER_CHUNK_SIZE = 256 * 1024
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_COMMAND_TIMEOUT = 120
+SSH_KEY_PASSPHRASE_ENV = "RG_MAPPER_KEY_PASSPHRASE"
+
+
+def find_default_ssh_key(base_dir: str) -> str | None:
+    try:
+        entries = os.listdir(base_dir)
+    except OSError:
+        return None
+
+    preferred_names = {
+        "id_rsa",
+        "id_dsa",
+        "id_ecdsa",
+        "id_ed25519",
+        "id_ecdsa_sk",
+        "id_ed25519_sk",
+    }
+    for name in preferred_names:
+        path = os.path.join(base_dir, name)
+        if os.path.isfile(path):
+            return path
+
+    allowed_suffixes = (".pem", ".key", ".rsa", ".ppk")
+    for entry in sorted(entries):
+        if entry.lower().endswith(allowed_suffixes):
+            path = os.path.join(base_dir, entry)
+            if os.path.isfile(path):
+                return path
+
+    return None
+
+
+def load_private_key(key_path: str, passphrase: str | None):
+    if key_path.lower().endswith(".ppk"):
+        import importlib.util
+        if importlib.util.find_spec("paramiko.ppk") is not None:
+            from paramiko.ppk import PPKKey as _PPKKey
+        elif importlib.util.find_spec("paramiko_ppk") is not None:
+            from paramiko_ppk import PPKKey as _PPKKey  # type: ignore
+        else:
+            raise ModuleNotFoundError("Поддержка ключей PPK недоступна. Установите пакет paramiko-ppk.")
+        return _PPKKey.from_file(key_path, password=passphrase)
+    return paramiko.RSAKey.from_private_key_file(key_path, password=passphrase)
+
+
+def build_remote_manifest(sftp, root_dir: str) -> tuple[dict, set[str]]:
+    # Один обход listdir_attr по каталогам вместо stat на каждый файл:
+    # возвращает атрибуты всех файлов дерева и список существующих каталогов.
+    files = {}
+    dirs = {root_dir}
+    pending = [root_dir]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = sftp.listdir_attr(current)
+        except IOError:
+            continue
+        for entry in entries:
+            path = posixpath.join(current, entry.filename)
+            if stat.S_ISDIR(entry.st_mode or 0):
+                dirs.add(path)
+                pending.append(path)
+            else:
+                files[path] = entry
+    return files, dirs
+
+
+def partial_upload_path(remote_path: str, crc32_hex: str) -> str:
+    directory, filename = posixpath.split(remote_path)
+    return posixpath.join(directory, f".{filename}.{crc32_hex}.part")
+
+
+def remove_stale_partial_uploads(sftp, remote_path: str, keep_path: str):
+    # Недокачанные файлы прежних версий (.<имя>.<старый CRC>.part) уже
+    # никогда не будут дописаны.
+    directory, filename = posixpath.split(remote_path)
+    prefix = f".{filename}."
+    keep_name = posixpath.basename(keep_path)
+    try:
+        names = sftp.listdir(directory or ".")
+    except IOError:
+        return
+    for name in names:
+        if name == keep_name or not name.startswith(prefix) or not name.endswith(".part"):
+            continue
+        if len(name) != len(prefix) + 8 + len(".part"):
+            continue
+        try:
+            sftp.remove(posixpath.join(directory, name))
+        except IOError:
+            pass
+
+
+def remote_file_crc32(sftp, remote_path: str, start: int, end: int, crc: int = 0, check_cancelled=None) -> int:
+    if end <= start:
+        return crc
+    with sftp.file(remote_path, "rb") as remote_stream:
+        remote_stream.seek(start)
+        remote_stream.prefetch(end)
+        remaining = end - start
+        while remaining > 0:
+            if check_cancelled is not None:
+                check_cancelled()
+            chunk = remote_stream.read(min(TRANSFER_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+    return crc
+
+
+def remote_file_md5(sftp, remote_path: str) -> str | None:
+    # MD5 файла, посчитанный самим сервером командой md5sum по тому же
+    # SSH-соединению. None — если команды нет или выполнять их нельзя
+    # (например, у пользователя только SFTP).
+    try:
+        channel = sftp.get_channel().get_transport().open_session()
+    except (AttributeError, paramiko.SSHException, OSError):
+        return None
+    try:
+        channel.settimeout(SSH_COMMAND_TIMEOUT)
+        channel.exec_command(f"md5sum -- {shlex.quote(remote_path)}")
+        output = channel.makefile("rb").read()
+        status = channel.recv_exit_status()
+    except (paramiko.SSHException, OSError):
+        return None
+    finally:
+        channel.close()
+    digest = output.split(None, 1)[0].decode("ascii", "replace").lower() if output.strip() else ""
+    if status != 0 or len(digest) != 32 or any(ch not in "0123456789abcdef" for ch in digest):
+        return None
+    return digest
+
+
+def replace_remote_file(sftp, temp_path: str, remote_path: str):
+    try:
+        sftp.posix_rename(temp_path, remote_path)
+        return
+    except IOError:
+        pass
+    try:
+        sftp.remove(remote_path)
+    except IOError:
+        pass
+    sftp.rename(temp_path, remote_path)
+
+
+class SshSessionManager:
+    # Одно аутентифицированное SSH-соединение на всё время работы приложения:
+    # расшифрованный ключ и транспорт переиспользуются между выгрузками и
+    # загрузками, keepalive не даёт серверу закрыть простаивающую сессию,
+    # а оборванный транспорт прозрачно переподключается при следующем запросе.
+    def __init__(self, keepalive_interval: int = SSH_KEEPALIVE_INTERVAL):
+        self.keepalive_interval = keepalive_interval
+        self._lock = threading.RLock()
+        self._keys = {}
+        self._client = None
+        self._signature = None
+        self._connect_args = None
+
+    @staticmethod
+    def _key_cache_key(key_path: str, passphrase: str | None):
+        try:
+            key_mtime = os.stat(key_path).st_mtime_ns
+        except OSError:
+            key_mtime = None
+        return os.path.abspath(key_path), passphrase or "", key_mtime
+
+    def cached_key(self, key_path: str, passphrase: str | None):
+        with self._lock:
+            return self._keys.get(self._key_cache_key(key_path, passphrase))
+
+    def remember_key(self, key_path: str, passphrase: str | None, key_obj):
+        with self._lock:
+            self._keys[self._key_cache_key(key_path, passphrase)] = key_obj
+
+    @staticmethod
+    def _is_alive(client) -> bool:
+        if client is None:
+            return False
+        transport = client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def _close_client(self):
+        client = self._client
+        self._client = None
+        self._signature = None
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def _reconnect(self):
+        host, port, username, key_obj = self._connect_args
+        self._close_client()
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(hostname=host, port=port, username=username, pkey=key_obj, allow_agent=False, look_for_keys=False)
+        transport = client.get_transport()
+        if transport is not None and self.keepalive_interval:
+            transport.set_keepalive(self.keepalive_interval)
+        self._client = client
+        self._signature = self._connect_args
+        return client
+
+    def connect(self, host: str, port: int, username: str, key_obj):
+        with self._lock:
+            self._connect_args = (host, int(port), username, key_obj)
+            if self._signature == self._connect_args and self._is_alive(self._client):
+                return self._client
+            return self._reconnect()
+
+    def open_sftp(self):
+        with self._lock:
+            if self._connect_args is None:
+                raise RuntimeError("SSH-соединение не установлено.")
+            client = self._client
+            if not self._is_alive(client):
+                client = self._reconnect()
+        try:
+            return client.open_sftp()
+        except (paramiko.SSHException, EOFError, OSError):
+            with self._lock:
+                # Пока этот поток ждал, соединение мог уже восстановить другой канал.
+                if self._client is client and self._is_alive(client):
+                    raise
+                if self._client is client:
+                    client = self._reconnect()
+                else:
+                    client = self._client
+            return client.open_sftp()
+
+    def close(self):
+        with self._lock:
+            self._close_client()
+
+
+def ensure_remote_dirs(sftp, path_value: str, known_remote_dirs: set[str]):
+    normalized = path_value.replace("\\", "/")
+    if not normalized:
+        return
+    parts = [part for part in normalized.split("/") if part]
+    current = "/" if normalized.startswith("/") else ""
+    for part in parts:
+        current = posixpath.join(current, part) if current else part
+        if current in known_remote_dirs:
+            continue
+        try:
+            sftp.listdir(current)
+        except IOError:
+            sftp.mkdir(current)
+        known_remote_dirs.add(current)
+
+
+def resolve_remote_base_dir(sftp, remote_dir: str, known_remote_dirs: set[str]) -> str:
+    remote_dir_effective = remote_dir.replace("\\", "/").strip()
+    if not remote_dir_effective or remote_dir_effective in (".", "./"):
+        return sftp.normalize(".")
+    if remote_dir_effective.startswith("~"):
+        try:
+            home_dir = sftp.normalize(".")
+        except IOError:
+            home_dir = sftp.normalize("~")
+        subpath = remote_dir_effective[1:].lstrip("/")
+        remote_dir_effective = posixpath.join(home_dir, subpath) if subpath else home_dir
+    ensure_remote_dirs(sftp, remote_dir_effective, known_remote_dirs)
+    return sftp.normalize(remote_dir_effective)
+
+
+def read_remote_bytes(sftp, path_value: str) -> bytes | None:
+    try:
+        with sftp.file(path_value, "rb") as remote_file:
+            return remote_file.read()
+    except IOError:
+        return None
+
+
+def read_local_bytes(path_value: str) -> bytes | None:
+    try:
+        with open(path_value, "rb") as local_file:
+            return local_file.read()
+    except OSError:
+        return None
+
+
+def upload_job_crc32(job: dict) -> str:
+    crc32_hex = str(job.get("crc32") or "").strip().lower()
+    if crc32_hex:
+        return crc32_hex
+    payload = job.get("payload")
+    if payload is not None:
+        return f"{zlib.crc32(payload) & 0xFFFFFFFF:08x}"
+    return compute_file_crc32(job["local_path"])
+
+
+def upload_remote_file(sftp, job: dict, on_chunk=None, on_resume=None, check_cancelled=None):
+    # Данные пишутся во временный файл, имя которого содержит CRC32
+    # содержимого: недокачанный файл той же версии дописывается с места
+    # обрыва, если его начало на сервере совпадает с локальным. CRC32 и MD5
+    # считаются по ходу отправки; на итоговое имя файл попадает, когда
+    # совпали размер на сервере, CRC32 и MD5, посчитанный сервером. Если
+    # сервер посчитать MD5 не может, переданная часть читается обратно.
+    display_name = job["display_name"]
+    size = int(job.get("size") or 0)
+    expected_crc = upload_job_crc32(job)
+    temp_path = partial_upload_path(job["remote_path"], expected_crc)
+    try:
+        offset = int(sftp.stat(temp_path).st_size or 0)
+    except IOError:
+        offset = 0
+    if offset > size:
+        offset = 0
+    crc = 0
+    md5 = hashlib.md5()
+    payload = job.get("payload")
+    with (io.BytesIO(payload) if payload is not None else open(job["local_path"], "rb")) as local_stream:
+        if offset:
+            remaining = offset
+            while remaining > 0:
+                chunk = local_stream.read(min(TRANSFER_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                md5.update(chunk)
+                remaining -= len(chunk)
+            if remaining or remote_file_crc32(sftp, temp_path, 0, offset, check_cancelled=check_cancelled) != crc:
+                # Начало временного файла на сервере не то — передаём заново.
+                offset = 0
+                crc = 0
+                md5 = hashlib.md5()
+                local_stream.seek(0)
+            elif on_resume is not None:
+                on_resume(offset)
+        prefix_crc = crc
+        sent = offset
+        with sftp.file(temp_path, "r+b" if offset else "wb") as remote_stream:
+            if offset:
+                remote_stream.seek(offset)
+            remote_stream.set_pipelined(True)
+            while True:
+                if check_cancelled is not None:
+                    check_cancelled()
+                chunk = local_stream.read(TRANSFER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                remote_stream.write(chunk)
+                crc = zlib.crc32(chunk, crc)
+                md5.update(chunk)
+                sent += len(chunk)
+                if on_chunk is not None:
+                    on_chunk(len(chunk))
+            remote_stream.flush()
+    remote_size = int(sftp.stat(temp_path).st_size or 0)
+    if sent != size or remote_size != size:
+        raise IOError(f"Файл передан не полностью: {display_name}")
+    if f"{crc & 0xFFFFFFFF:08x}" == expected_crc:
+        remote_md5 = remote_file_md5(sftp, temp_path)
+        if remote_md5 is not None:
+            verified = remote_md5 == md5.hexdigest()
+        else:
+            # Начало, проверенное при докачке, уже совпало с сервером,
+            # дочитывается только переданное сейчас.
+            remote_crc = remote_file_crc32(sftp, temp_path, offset, size, prefix_crc, check_cancelled)
+            verified = f"{remote_crc & 0xFFFFFFFF:08x}" == expected_crc
+    else:
+        verified = False
+    if not verified:
+        try:
+            sftp.remove(temp_path)
+        except IOError:
+            pass
+        raise IOError(f"Контрольная сумма не совпала после передачи: {display_name}")
+    remove_stale_partial_uploads(sftp, job["remote_path"], temp_path)
+    replace_remote_file(sftp, temp_path, job["remote_path"])
+    mtime = job.get("mtime")
+    if mtime:
+        try:
+            sftp.utime(job["remote_path"], (mtime, mtime))
+        except IOError:
+            pass
+
+
+def extract_track_crc_map(data: dict | None) -> dict[str, str]:
+    result = {}
+    files_section = data.get("files") if isinstance(data, dict) else None
+    if not isinstance(files_section, list):
+        return result
+    for item in files_section:
+        if not isinstance(item, dict):
+            continue
+        name = item.get("name")
+        crc = str(item.get("crc32", "") or "").strip().lower()
+        if isinstance(name, str) and name and crc:
+            result[name.replace("\\", "/")] = crc
+    return result
+
+
+def decode_json_payload(payload: bytes | None):
+    if not payload:
+        return None
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except Exception:
+        return None
+
+
+def format_json_value(value) -> str:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return "null"
+    try:
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+    except TypeError:
+        return str(value)
+
+
+def diff_json_values(server_value, local_value, path: str = "") -> list[tuple[str, str, str]]:
+    if isinstance(server_value, dict) and isinstance(local_value, dict):
+        diffs = []
+        keys = sorted(set(server_value) | set(local_value), key=str)
+        for key in keys:
+            if not path and key == TRACKS_DIGEST_KEY:
+                # Отпечаток tracks.json производен от содержимого и сам отличием не считается.
+                continue
+            child_path = f"{path}.{key}" if path else str(key)
+            if key not in server_value:
+                diffs.append((child_path, "<нет>", format_json_value(local_value.get(key))))
+            elif key not in local_value:
+                diffs.append((child_path, format_json_value(server_value.get(key)), "<нет>"))
+            else:
+                diffs.extend(diff_json_values(server_value.get(key), local_value.get(key), child_path))
+        return diffs
+    if isinstance(server_value, list) and isinstance(local_value, list):
+        diffs = []
+        max_len = max(len(server_value), len(local_value))
+        for index in range(max_len):
+            child_path = f"{path}[{index}]" if path else f"[{index}]"
+            if index >= len(server_value):
+                diffs.append((child_path, "<нет>", format_json_value(local_value[index])))
+            elif index >= len(local_value):
+                diffs.append((child_path, format_json_value(server_value[index]), "<нет>"))
+            else:
+                diffs.extend(diff_json_values(server_value[index], local_value[index], child_path))
+        return diffs
+    if server_value != local_value:
+        return [(path or "<root>", format_json_value(server_value), format_json_value(local_value))]
+    return []
+
+
+def compare_upload_item(
+    item_type: str,
+    display_name: str,
+    size_value: int,
+    remote_stat,
+    local_mtime: float,
+    read_local,
+    read_remote,
+    local_track_crc_map: dict[str, str],
+    remote_track_crc_map: dict[str, str],
+) -> tuple[bool, str, list]:
+    # Файл уже есть на сервере: MP3 сравниваются по CRC32 из tracks.json,
+    # JSON — по параметрам, остальное — по размеру, mtime и содержимому.
+    json_diffs = []
+    should_upload = True
+    replacement_reason = ""
+    lower_name = display_name.lower()
+    if lower_name.endswith(".mp3"):
+        normalized_audio_name = display_name.replace("\\", "/")
+        if normalized_audio_name.startswith("content/"):
+            normalized_audio_name = normalized_audio_name[len("content/"):]
+        local_crc = local_track_crc_map.get(normalized_audio_name)
+        remote_crc = remote_track_crc_map.get(normalized_audio_name)
+        if local_crc is None:
+            local_crc = local_track_crc_map.get(os.path.basename(normalized_audio_name))
+        if remote_crc is None:
+            remote_crc = remote_track_crc_map.get(os.path.basename(normalized_audio_name))
+        if local_crc and remote_crc:
+            should_upload = local_crc != remote_crc
+        else:
+            should_upload = False
+        if should_upload:
+            replacement_reason = "CRC отличается"
+    elif lower_name.endswith(".json"):
+        local_payload = read_local()
+        remote_payload = read_remote()
+        local_json = decode_json_payload(local_payload)
+        remote_json = decode_json_payload(remote_payload)
+        if (
+            isinstance(local_json, dict)
+            and isinstance(remote_json, dict)
+            and local_json.get(TRACKS_DIGEST_KEY)
+            and local_json.get(TRACKS_DIGEST_KEY) == remote_json.get(TRACKS_DIGEST_KEY)
+            and local_json.get("version") == remote_json.get("version")
+            and len(local_payload) == len(remote_payload)
+        ):
+            # tracks.json с тем же отпечатком и версией не разбирается поэлементно.
+            return False, "", []
+        json_diffs = diff_json_values(remote_json, local_json) if local_json is not None and remote_json is not None else []
+        should_upload = bool(json_diffs) if local_json is not None and remote_json is not None else local_payload is not None and local_payload != remote_payload
+        if should_upload:
+            replacement_reason = "параметры изменились" if json_diffs else "содержимое отличается"
+    elif int(remote_stat.st_size or 0) != int(size_value):
+        replacement_reason = "файл отличается"
+    elif item_type == "file" and int(remote_stat.st_mtime or 0) == int(local_mtime):
+        should_upload = False
+    else:
+        local_payload = read_local()
+        remote_payload = read_remote()
+        should_upload = local_payload is not None and local_payload != remote_payload
+        if should_upload:
+            replacement_reason = "файл отличается"
+    return should_upload, replacement_reason, json_diffs
+
+
+def collect_local_audio_names(content_dir: str | None) -> set[str]:
+    if not content_dir or not os.path.isdir(content_dir):
+        return set()
+    result: set[str] = set()
+    for root, _, files in os.walk(content_dir):
+        for filename in files:
+            if not filename.lower().endswith(".mp3"):
+                continue
+            full_path = os.path.join(root, filename)
+            result.add(os.path.relpath(full_path, content_dir).replace("\\", "/"))
+    return result
+
+
+def project_config_label(project_name: str, project_file: str | None) -> str:
+    if isinstance(project_name, str) and project_name.strip():
+        return project_name.strip()
+    if project_file:
+        base_name = os.path.splitext(os.path.basename(project_file))[0]
+        if base_name:
+            return base_name
+    return "project"
+
+
+def excursion_folder_name(excurs_data, project_label: str) -> str:
+    excursions = excurs_data.get("excursions") if isinstance(excurs_data, dict) else None
+    if isinstance(excursions, list) and excursions and isinstance(excursions[0], dict):
+        path_value = str(excursions[0].get("path", "") or "").strip()
+        if path_value:
+            return sanitize_name_for_folder(path_value) or path_value
+        name_value = str(excursions[0].get("name", "") or "").strip()
+        if name_value:
+            return sanitize_name_for_folder(name_value) or name_value
+    return sanitize_name_for_folder(project_label) or project_label
+
+
+def resolve_project_files(paths: list[str]) -> list[str]:
+    # Каталог проекта разворачивается в лежащие в нём .proj.
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = sorted(
+                os.path.join(path, entry)
+                for entry in os.listdir(path)
+                if entry.lower().endswith(".proj") and os.path.isfile(os.path.join(path, entry))
+            )
+            if not found:
+                raise FileNotFoundError(f"В каталоге нет файла проекта .proj: {path}")
+            result.extend(found)
+        else:
+            result.append(path)
+    seen = set()
+    return [path for path in map(os.path.abspath, result) if not (path in seen or seen.add(path))]
+
+
+def sync_project(sessions: SshSessionManager, project_file: str, remote_dir: str = DEFAULT_REMOTE_PROJECTS_DIR, delete_extra_audio: bool = False) -> dict:
+    # Неинтерактивный вариант полной выгрузки в /ftpradiog: те же правила
+    # сравнения, но вместо диалогов — политика по умолчанию. Файлы, которые
+    # на сервере новее локальных, и лишние MP3 на сервере не трогаются
+    # (лишние удаляются только с delete_extra_audio) и попадают в отчёт.
+    project_file = os.path.abspath(project_file)
+    report = {
+        "project": project_file,
+        "remote_dir": "",
+        "status": "failed",
+        "bytes_uploaded": 0,
+        "bytes_resumed": 0,
+        "uploaded": [],
+        "skipped": [],
+        "extra_remote_audio": [],
+        "deleted": [],
+        "error": "",
+    }
+    sftp = None
+    try:
+        data, _ = read_project_file(project_file, with_image=False)
+        data = validate_project_data(data)
+        validate_rooms_model(build_rooms_model(data))
+        rooms_path, tracks_path = export_project(project_file, data)
+        project_dir = os.path.dirname(project_file)
+        local_root_dir, content_dir = project_layout(project_file)
+        audio_cache = AudioMetadataCache(audio_metadata_cache_path(project_file))
+        with open(tracks_path, "r", encoding="utf-8") as tracks_file:
+            local_track_crc_map = extract_track_crc_map(json.load(tracks_file))
+        excurs_data = None
+        excurs_path = os.path.join(project_dir, "excurs.json")
+        if os.path.isfile(excurs_path):
+            try:
+                with open(excurs_path, "r", encoding="utf-8") as excurs_file:
+                    excurs_data = json.load(excurs_file)
+            except (OSError, ValueError):
+                excurs_data = None
+
+        sftp = sessions.open_sftp()
+        known_remote_dirs: set[str] = set()
+        base_dir = resolve_remote_base_dir(sftp, remote_dir, known_remote_dirs)
+        project_label = project_config_label(data.get("project_name", ""), project_file)
+        target_directory = posixpath.join(base_dir, sanitize_name_for_folder(project_label) or project_label)
+        ensure_remote_dirs(sftp, target_directory, known_remote_dirs)
+        target_directory = sftp.normalize(target_directory)
+        report["remote_dir"] = target_directory
+        remote_manifest, manifest_dirs = build_remote_manifest(sftp, target_directory)
+        known_remote_dirs.update(manifest_dirs)
+        nested_project_dir = posixpath.join(target_directory, excursion_folder_name(excurs_data, project_label))
+        tracks_content_dir = posixpath.join(nested_project_dir, "content")
+        ensure_remote_dirs(sftp, tracks_content_dir, known_remote_dirs)
+        tracks_remote_path = posixpath.join(tracks_content_dir, "tracks.json")
+
+        files_to_upload = [
+            (posixpath.join(target_directory, "rooms.json"), "rooms.json", rooms_path),
+            (tracks_remote_path, "tracks.json", tracks_path),
+        ]
+        for filename in SYSTEM_CONFIG_FILENAMES:
+            path = os.path.join(project_dir, filename)
+            if os.path.isfile(path):
+                files_to_upload.append((posixpath.join(target_directory, filename), filename, path))
+        files_to_upload.append((posixpath.join(target_directory, os.path.basename(project_file)), os.path.basename(project_file), project_file))
+        for root, _, files in os.walk(local_root_dir):
+            for filename in files:
+                local_path = os.path.join(root, filename)
+                rel_from_root = os.path.relpath(local_path, local_root_dir).replace("\\", "/")
+                if rel_from_root.lower() == "content/tracks.json":
+                    continue
+                rel_display = rel_from_root
+                if rel_from_root.lower().startswith("content/"):
+                    rel_display = rel_from_root[len("content/"):]
+                remote_path = posixpath.join(nested_project_dir, rel_from_root)
+                ensure_remote_dirs(sftp, posixpath.dirname(remote_path), known_remote_dirs)
+                files_to_upload.append((remote_path, rel_display, local_path))
+
+        remote_track_crc_map = extract_track_crc_map(decode_json_payload(read_remote_bytes(sftp, tracks_remote_path)))
+        upload_jobs = []
+        for remote_path, display_name, local_path in files_to_upload:
+            size_value = os.path.getsize(local_path)
+            local_mtime = os.path.getmtime(local_path)
+            remote_stat = remote_manifest.get(remote_path)
+            reason = "new"
+            if remote_stat is not None:
+                should_upload, detail, _ = compare_upload_item(
+                    "file", display_name, size_value, remote_stat, local_mtime,
+                    lambda path=local_path: read_local_bytes(path),
+                    lambda path=remote_path: read_remote_bytes(sftp, path),
+                    local_track_crc_map, remote_track_crc_map,
+                )
+                remote_time = remote_stat.st_mtime or 0
+                if not should_upload:
+                    report["skipped"].append({"name": display_name, "reason": "unchanged"})
+                    continue
+                if local_mtime and remote_time and local_mtime < remote_time:
+                    report["skipped"].append({"name": display_name, "reason": "remote_newer", "detail": detail})
+                    continue
+                reason = "changed"
+            job = {
+                "remote_path": remote_path,
+                "size": size_value,
+                "display_name": display_name,
+                "local_path": local_path,
+                "mtime": local_mtime,
+                "reason": reason,
+            }
+            if display_name.lower().endswith(".mp3"):
+                job["crc32"] = audio_cache.file_metadata(local_path)["crc32"]
+            upload_jobs.append(job)
+
+        prefix = tracks_content_dir.rstrip("/") + "/"
+        remote_audio_paths = {
+            remote_path[len(prefix):]: remote_path
+            for remote_path in remote_manifest
+            if remote_path.startswith(prefix) and remote_path.lower().endswith(".mp3")
+        }
+        extra_remote_audio = sorted(set(remote_audio_paths) - collect_local_audio_names(content_dir), key=str.lower)
+
+        def add_resumed(byte_count: int):
+            report["bytes_uploaded"] += byte_count
+            report["bytes_resumed"] += byte_count
+
+        def add_uploaded(byte_count: int):
+            report["bytes_uploaded"] += byte_count
+
+        for job in upload_jobs:
+            before = report["bytes_uploaded"]
+            upload_remote_file(sftp, job, on_chunk=add_uploaded, on_resume=add_resumed)
+            report["uploaded"].append({
+                "name": job["display_name"],
+                "bytes": report["bytes_uploaded"] - before,
+                "reason": job["reason"],
+            })
+        audio_cache.save()
+
+        for audio_name in extra_remote_audio:
+            if delete_extra_audio:
+                sftp.remove(remote_audio_paths[audio_name])
+                report["deleted"].append(audio_name)
+            else:
+                report["extra_remote_audio"].append(audio_name)
+        report["status"] = "uploaded" if report["uploaded"] or report["deleted"] else "up_to_date"
+    except Exception as exc:
+        report["status"] = "failed"
+        report["error"] = str(exc) or exc.__class__.__name__
+    finally:
+        if sftp is not None:
+            try:
+                sftp.close()
+            except Exception:
+                pass
+    return report
+
+
+def sync_projects(sessions: SshSessionManager, project_files: list[str], remote_dir: str = DEFAULT_REMOTE_PROJECTS_DIR, workers: int = DEFAULT_SYNC_WORKERS, delete_extra_audio: bool = False) -> list[dict]:
+    # Проекты синхронизируются параллельно, каждый по своему SFTP-каналу
+    # одного SSH-соединения; workers ограничивает число открытых каналов.
+    workers = max(1, min(int(workers or 1), len(project_files) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda project_file: sync_project(sessions, project_file, remote_dir, delete_extra_audio),
+            project_files,
+        ))
+
+
+# ---------------------------------------------------------------------------
+# Command line
+# ---------------------------------------------------------------------------
+def _cli_export(args) -> int:
+    failed = 0
+    for project_file in args.projects:
+        try:
+            rooms_path, tracks_path = export_project(project_file)
+        except Exception as exc:
+            failed += 1
+            print(f"{project_file}: ошибка экспорта: {exc}", file=sys.stderr)
+            continue
+        print(f"{project_file}: {rooms_path}, {tracks_path}")
+    return 1 if failed else 0
+
+
+def _cli_sync(args) -> int:
+    sessions = SshSessionManager()
+    try:
+        project_files = resolve_project_files(args.projects)
+        key_path = args.key or find_default_ssh_key(os.path.expanduser("~/.ssh"))
+        if not key_path:
+            raise FileNotFoundError("Не найден приватный SSH-ключ, укажите его через --key.")
+        key_obj = load_private_key(key_path, os.environ.get(SSH_KEY_PASSPHRASE_ENV) or None)
+        sessions.connect(args.host, args.port, args.user, key_obj)
+    except Exception as exc:
+        sessions.close()
+        print(f"Ошибка подключения: {exc}", file=sys.stderr)
+        return 2
+    try:
+        projects = sync_projects(sessions, project_files, args.remote_dir, args.workers, args.delete_extra_audio)
+    finally:
+        sessions.close()
+    report = {
+        "host": args.host,
+        "remote_dir": args.remote_dir,
+        "failed": sum(1 for item in projects if item["status"] == "failed"),
+        "projects": projects,
+    }
+    report_text = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            report_file.write(report_text)
+        for item in projects:
+            print(f"{item['project']}: {item['status']}, {item['bytes_uploaded']} байт{': ' + item['error'] if item['error'] else ''}")
+    else:
+        print(report_text)
+    return 1 if report["failed"] else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="rg-mapper", description="RG Tags Mapper без графического интерфейса.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="пересобрать rooms.json и tracks.json по файлу проекта")
+    export_parser.add_argument("projects", nargs="+", metavar="PROJ", help="файл проекта .proj")
+    export_parser.set_defaults(handler=_cli_export)
+    sync_parser = commands.add_parser("sync", help="выгрузить проекты на сервер без диалогов")
+    sync_parser.add_argument("projects", nargs="+", metavar="PROJ", help="файл проекта .proj или каталог с ним")
+    sync_parser.add_argument("--host", default=DEFAULT_SERVER_HOST)
+    sync_parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT)
+    sync_parser.add_argument("--user", default=DEFAULT_SERVER_USERNAME)
+    sync_parser.add_argument(
+        "--key",
+        help=f"приватный SSH-ключ (по умолчанию ищется в ~/.ssh); пароль к ключу — в переменной {SSH_KEY_PASSPHRASE_ENV}",
+    )
+    sync_parser.add_argument("--remote-dir", default=DEFAULT_REMOTE_PROJECTS_DIR)
+    sync_parser.add_argument("--workers", type=int, default=DEFAULT_SYNC_WORKERS, help="сколько проектов выгружать одновременно")
+    sync_parser.add_argument("--delete-extra-audio", action="store_true", help="удалять на сервере MP3, которых нет в проекте")
+    sync_parser.add_argument("--report", help="файл для JSON-отчёта (по умолчанию отчёт выводится в stdout)")
+    sync_parser.set_defaults(handler=_cli_sync)
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())